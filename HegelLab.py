@@ -1,20 +1,27 @@
 import sys
 from IPython import get_ipython
 
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtWidgets import QApplication, QFileDialog
 from PyQt5.QtCore import QObject, pyqtSignal, Qt
 
-from windows import MainWindow, RackWindow, DisplayWindow, MonitorWindow
+from windows import MainWindow, RackWindow, DisplayWindow, MonitorWindow, QueueWindow, ProfileWindow
 from widgets import WindowWidget, TreeWidget, ConsoleWidget
 from src import LoaderSaver, Model, Popup, SweepThread#, Shortcuts
 from src.GuiInstrument import GuiInstrument, GuiDevice
-from src.SweepIdxIter import IdxIter
+from src.SweepIdxIter import allocData
+from src.SweepQueue import SweepQueue
+from src.FeedbackLoop import FeedbackLoop
+from src.SweepLog import readLogDevices
+from src.SweepEngine import BufferedLine
+from src.TimeTrace import ChunkedBuffer
+from src.SweepFile import readSweepRows
 
 from src import Drivers # for eval
 
 import numpy as np
 import time
 import os
+import json
 
 
 # HegelLab is made to support any instrument with minimal effort.
@@ -35,11 +42,16 @@ class HegelLab(QObject):
         self.loader = LoaderSaver.LoaderSaver(self)
         self.pop = Popup.Popup()
         self.model = Model.Model(self)
+        self.sweep_queue = SweepQueue()
+        try: self.sweep_queue.load()
+        except Exception as e: self.pop.loadingJSONError(e)
         self.view_main = main = MainWindow.MainWindow(self)
         self.view_rack = rack = RackWindow.RackWindow(self)
         self.view_display = disp = DisplayWindow.DisplayWindow(self)
         self.view_monitor = moni = MonitorWindow.MonitorWindow(self)
         self.view_console = console = ConsoleWidget.ConsoleWidget(self)
+        self.view_queue = queue = QueueWindow.QueueWindow(self)
+        self.view_profile = profile = ProfileWindow.ProfileWindow(self)
 
         # for drop mime data:
         TreeWidget.TreeWidget.lab = self
@@ -51,6 +63,8 @@ class HegelLab(QObject):
         self.default_instr_list = []
         self.gui_instruments = []  # list of loaded GuiInstrument
         self.sweep_file_path = ''
+        self.feedback_loop = None  # retroaction of the running sweep
+        self.feedback_loops = []  # every loop until its thread finished (it sets ST back after the sweep)
 
         # signals -->
         self.sig_instrumentAdded.connect(rack.gui_onInstrumentAdded)
@@ -86,7 +100,10 @@ class HegelLab(QObject):
 
         # sweep related
         self.loop_control = self.model.initLoopControl()
-        self.sweep_thread = SweepThread.SweepThread(self.loop_control, self.sig_sweepProgress, self.sig_sweepError, self.sig_sweepFinished)
+        self.trace_buffer = None  # ChunkedBuffer of the last time trace (src.TimeTrace)
+        QApplication.instance().aboutToQuit.connect(self._closeTraceBuffer)  # its chunks spilled to disk
+        self.sweep_thread = SweepThread.SweepThread(self.loop_control, self.sig_sweepProgress, self.sig_sweepError, self.sig_sweepFinished,
+                                                    self.sig_sweepStarted, self.sig_queueChanged, self.sig_sweepAborted)
 
         self.sig_sweepStarted.connect(lambda: main.gui_onSweepStarted())
         self.sig_sweepStarted.connect(disp.gui_onSweepStarted)
@@ -95,10 +112,23 @@ class HegelLab(QObject):
         self.sig_sweepPaused.connect(main.gui_onSweepPaused)
         self.sig_sweepResumed.connect(main.gui_onSweepResumed)
 
+        self.sig_sweepAborting.connect(main.gui_onSweepAborting)
+        self.sig_sweepAborted.connect(main.gui_onSweepAborted)
         self.sig_sweepError.connect(self.pop.sweepThreadError)
         self.sig_sweepFinished.connect(main.gui_onSweepFinished)
         self.sig_sweepFinished.connect(disp.gui_onSweepFinished)
 
+        self.sig_sweepStarted.connect(lambda: queue.gui_onSweepStarted())
+        self.sig_sweepFinished.connect(queue.gui_onSweepFinished)
+        self.sig_queueChanged.connect(self.onQueueChanged)
+
+        self.sig_sweepStarted.connect(profile.gui_onSweepStarted)
+        self.sig_sweepProgress.connect(profile.gui_onSweepProgress)
+        self.sig_sweepFinished.connect(profile.gui_onSweepFinished)
+
+        self.sig_sweepProgress.connect(lambda: main.gui_updateFeedbackStats(self.feedback_loop))
+        self.sig_sweepFinished.connect(self._stopFeedbackLoop)
+
     # -- GENERAL --
 
     def showMain(self):
@@ -116,6 +146,12 @@ class HegelLab(QObject):
     def showConsole(self):
         self.view_console.focus()
 
+    def showQueue(self):
+        self.view_queue.focus()
+
+    def showProfile(self):
+        self.view_profile.focus()
+
     def askClose(self, event):
         if self.pop.askQuit():
             self.abortSweep()
@@ -433,26 +469,31 @@ class HegelLab(QObject):
 
     # -- SWEEP THREAD --
 
-    def _prepareFilename(self):
-        folder_path = self.view_main.folder_path
+    def _prepareFilename(self, folder_path=None, filename=None):
+        # default to the folder and filename of the main window
+        if folder_path is None: folder_path = self.view_main.folder_path
+        if filename is None: filename = self.view_main.filename_edit.text()
         date = time.strftime("%Y%m%d")
         folder_path += date
         if not os.path.exists(folder_path): os.mkdir(folder_path)
 
-        filename = self.view_main.filename_edit.text()
         if filename == "": filename = "sweep"
         return folder_path + "/%t_" + filename + ".txt"
 
-    def _makeComment(self, comment, log_devs):
+    def _readLogDevices(self, log_devs, log_instr):
+        # return ({fullname: value}, {fullname: reason}) of the log devices read and not read
+        # (read concurrently per instrument, with a timeout, see src.SweepLog)
+        return readLogDevices(log_devs, log_instr, self.model.getValue)
+
+    def _makeComment(self, comment, log_vals, log_errors={}):
         # make a comment for the sweep file
         res = ""
-        for dev in log_devs:
-            try:
-                val = self.model.getValue(dev)
-                res += f"{dev.getfullname()}: {val}\n"
-            except:
-                continue
+        for name, val in log_vals.items():
+            res += f"{name}: {val}\n"
         if res != "": res = "Log devices:\n" + res + "\n"
+        if log_errors:
+            res += "Log devices not read:\n"
+            res += "".join(f"{name}: {reason}\n" for name, reason in log_errors.items()) + "\n"
         if comment != "":
             res += "Comment:\n" + comment
         return res
@@ -475,6 +516,14 @@ class HegelLab(QObject):
             return True
         return False
 
+    def _multiEngineError(self, gui_out_devs, native):
+        # the pyHegel engine gives the values of a multi device as separate read_vals: native engine only
+        names = [gui_dev.nickname for gui_dev in gui_out_devs if gui_dev.multiShape() != ()]
+        if names and not native:
+            self.pop.multiNeedsNativeEngine(names)
+            return True
+        return False
+
     def _genLists(self, gui_sw_devs, gui_out_devs, gui_log_devs):
         # generate the lists for kwargs
         ph_sw_devs, start, stop, npts = [], [], [], []
@@ -495,24 +544,13 @@ class HegelLab(QObject):
         return ph_sw_devs, start, stop, npts, ph_out_devs, ph_log_devs
 
     def _allocData(self, gui_out_devs, start, stop, npts, alternate):
-        # start, stop, npts are lists
-        # allocate data in out_devices for the live view.
-        # we allocate a numpy array for output devices
-        # and an "custom iterator".
-
-        reverse = [False] * len(start)
-        for i, (sta, sto) in enumerate(zip(start, stop)):
-            if sta > sto:
-                reverse[i] = True
-
-        if len(npts) == 1:
-            npts = npts + [1]  # not .append to preserve npts
-        if len(npts) == 2:
-            for dev in gui_out_devs:
-                dev.values = np.full(npts, np.nan)
-                dev.sw_idx = IdxIter(*npts, *reverse, alternate)
+        # live values of the out devices and their shared IdxIter (src.SweepIdxIter.allocData,
+        # also used by the benchmarks)
+        return allocData(gui_out_devs, start, stop, npts, alternate)
     
     def _makeRetroactionFunction(self, ph_sw_devs):
+        # start the feedback loop (src.FeedbackLoop, its own thread and rate)
+        # and return the exec_before giving it the setpoints of the sweep.
         win_retro = self.view_main.win_retroaction
         retro_en = win_retro.gb_retro.isChecked()
 
@@ -522,56 +560,89 @@ class HegelLab(QObject):
         st_guidev = win_retro.combo_st.currentData()
         p1_guidev = win_retro.combo_p1.currentData()
         p2_guidev = win_retro.combo_p2.currentData()
+        pv_guidev = win_retro.combo_pv.currentData() if win_retro.gb_pid.isChecked() else None
 
-        if st_guidev is None or p1_guidev is None or p2_guidev is None:
+        if st_guidev is None or p1_guidev is None or p2_guidev is None \
+                or (win_retro.gb_pid.isChecked() and pv_guidev is None):
             self.pop.retroactionMissingDev()
             return
 
         st_ph_dev = st_guidev.getPhDev()
-        st_first_val = st_ph_dev.get()
-
-        p1_ph_dev = p1_guidev.getPhDev()
-        coeff_p1 = win_retro.spin_p1.value()
-
-        p2_ph_dev = p2_guidev.getPhDev()
-        coeff_p2 = win_retro.spin_p2.value()
-
-        p1_idx, p2_idx = None, None
-        if p1_ph_dev in ph_sw_devs:
-            p1_idx = ph_sw_devs.index(p1_ph_dev)
-        if p2_ph_dev in ph_sw_devs:
-            p2_idx = ph_sw_devs.index(p2_ph_dev)
+        st_first_val = None  # read by the loop, once the previous one has set its ST back
+
+        # only the swept devices are used, from the setpoints
+        p_coeffs = []
+        for gui_dev, spin in [(p1_guidev, win_retro.spin_p1), (p2_guidev, win_retro.spin_p2)]:
+            if gui_dev.getPhDev() in ph_sw_devs:
+                p_coeffs.append((ph_sw_devs.index(gui_dev.getPhDev()), spin.value()))
+
+        pid = None
+        if pv_guidev is not None:
+            pid = dict(dev=pv_guidev.getPhDev(), target=win_retro.spin_target.value(),
+                       kp=win_retro.spin_kp.value(), ki=win_retro.spin_ki.value(), kd=win_retro.spin_kd.value())
+
+        self._stopFeedbackLoop()
+        previous = self.feedback_loops[-1] if self.feedback_loops else None
+        self.feedback_loop = loop = FeedbackLoop(st_ph_dev, st_first_val, p_coeffs,
+                                                 win_retro.spin_rate.value(), pid, self.sig_sweepError,
+                                                 previous=previous)
+        loop.finished.connect(lambda: self._feedbackLoopFinished(loop))
+        self.feedback_loops.append(loop)
+        loop.start()
 
         def retro_function(datas):
-            st_val = st_first_val
-            st_val += coeff_p1 * p1_ph_dev.get() if p1_idx is not None else 0
-            st_val += coeff_p2 * p2_ph_dev.get() if p2_idx is not None else 0
-            st_ph_dev.set(st_val)
-            if datas['iter_part'] == datas['iter_total']:
-                print("last iteration")
-                st_ph_dev.set(st_first_val)
+            loop.setSetpoints(datas['set_vals'])
         return retro_function
 
+    def _stopFeedbackLoop(self):
+        # end of the sweep: only asks the loop to stop, its thread sets ST back (can be a slow ramp)
+        loop, self.feedback_loop = self.feedback_loop, None
+        if loop is None: return
+        loop.stopLoop()
+
+    def _feedbackLoopFinished(self, loop):
+        # ST is back: save the log of the loop (latency, jitter)
+        self.feedback_loops.remove(loop)
+        if self.feedback_loop is None:
+            self.view_main.gui_updateFeedbackStats(loop)
+        if loop.nb_ticks > 0:
+            os.makedirs(self.view_main.folder_path, exist_ok=True)
+            loop.saveLog(os.path.join(self.view_main.folder_path, time.strftime("feedback_%Y%m%d-%H%M%S.npz")))
+
     sig_sweepStarted = pyqtSignal(SweepThread.SweepStatus)
     sig_sweepPaused = pyqtSignal()
     sig_sweepResumed = pyqtSignal()
     sig_sweepProgress = pyqtSignal(SweepThread.SweepStatus)
     sig_sweepError = pyqtSignal(Exception)
     sig_sweepFinished = pyqtSignal()
+    sig_sweepAborting = pyqtSignal()
+    sig_sweepAborted = pyqtSignal(float, float)  # s from the abort to: loop stopped, safe values
     def startSweep(self, gui_sw_devs, gui_out_devs, gui_log_devs):
         # Prepare everything and start the thread.
 
         # generate lists and allocate data
         ph_sw_devs, start, stop, npts, ph_out_devs, ph_log_devs = self._genLists(gui_sw_devs, gui_out_devs, gui_log_devs)
         alternate = {True: "alternate", False: False}[self.view_main.cb_alternate.isChecked()]
-        self._allocData(gui_out_devs, start, stop, npts, alternate)
 
         # check for errors
-        if self._startSweepCheckError(start, stop, npts, ph_sw_devs, ph_out_devs):
+        if self._startSweepCheckError(start, stop, npts, ph_sw_devs, ph_out_devs) \
+                or self._multiEngineError(gui_out_devs, self.view_main.cb_native.isChecked()):
             self.sig_sweepFinished.emit()
             return
+        buffered = None
+        if self.view_main.cb_buffered.isChecked():
+            try:
+                buffered = self._makeBufferedLine(gui_sw_devs, gui_out_devs)
+            except Exception as e:
+                self.pop.bufferedLineError(e)
+                self.sig_sweepFinished.emit()
+                return
+
+        sw_idx = self._allocData(gui_out_devs, start, stop, npts, alternate)
         
-        comment = self._makeComment(self.view_main.te_comment.toPlainText(), ph_log_devs)
+        user_comment = self.view_main.te_comment.toPlainText()
+        log_vals, log_errors = self._readLogDevices(ph_log_devs, [gui_dev.parent for gui_dev in gui_log_devs])
+        comment = self._makeComment(user_comment, log_vals, log_errors)
         
         # check for retroaction loop
         retro_function = self._makeRetroactionFunction(ph_sw_devs)
@@ -584,21 +655,284 @@ class HegelLab(QObject):
             "beforewait": self.view_main.sb_before_wait.value(),
             "updown": alternate,
             "exec_before": retro_function,
+            "engine": "native" if self.view_main.cb_native.isChecked() else "pyHegel",
         }
-
-
+        if sweep_kwargs["engine"] == "native":
+            # options only known by the native engine
+            sweep_kwargs["parallel_read"] = self.view_main.cb_parallel_read.isChecked()
+            sweep_kwargs["buffered"] = buffered
+            sweep_kwargs["out_instr"] = [gui_dev.parent for gui_dev in gui_out_devs]
+            sweep_kwargs["out_multi"] = [gui_dev.multi for gui_dev in gui_out_devs]
+            sweep_kwargs["file_format"] = self.view_main.cb_file_format.currentData()
+            sweep_kwargs["log_vals"] = log_vals
+            sweep_kwargs["comment"] = user_comment
+            sweep_kwargs["journal"] = self._makeJournal(gui_sw_devs, gui_out_devs, sweep_kwargs)
+
+        self._runSweepThread(gui_sw_devs, gui_out_devs, sweep_kwargs, sw_idx)
+
+    def _runSweepThread(self, gui_sw_devs, gui_out_devs, sweep_kwargs, sw_idx):
         # run sweep thread
         self.sweep_thread.initSweepKwargs(sweep_kwargs)
-        self.sweep_thread.initSweepStatus(gui_sw_devs, gui_out_devs, time.time())
-        self.sweep_thread.raz_sw_devs = lambda: [self.setValue(gui_dev, 0) for gui_dev in gui_sw_devs if gui_dev.raz]
+        self.sweep_thread.initSweepStatus(gui_sw_devs, gui_out_devs, sw_idx, time.time())
+        self.sweep_thread.publisher.max_fps = self.view_main.sb_max_fps.value()
+        raz_devs = [gui_dev for gui_dev in gui_sw_devs if gui_dev.raz]
+        self.sweep_thread.raz_sw_devs = lambda: self.model.setValuesNow(raz_devs, 0)
         for out in gui_out_devs:
-            out.alternate = self.view_main.cb_alternate.isChecked()
+            out.alternate = sweep_kwargs["updown"] == "alternate"
         self.sweep_thread.start()
 
         # update gui
         self.sig_sweepStarted.emit(self.sweep_thread.status)
         #self.showDisplay()
 
+    def _makeBufferedLine(self, gui_sw_devs, gui_out_devs):
+        # buffered fast axis (native engine): the instruments of the fastest swept device
+        # and of the out devices take the line together, their drivers must be buffered.
+        # The line is armed on the base device: its values are checked here against the limit
+        # of the logical device (the engine sets the first value of every line through it, ramped).
+        gui_fast = gui_sw_devs[-1]
+        for gui_dev in [gui_fast] + gui_out_devs:
+            if not eval(gui_dev.parent.driver).buffered:
+                raise Exception(f"the driver of {gui_dev.parent.nickname} ({gui_dev.parent.driver}) cannot take a whole line.")
+        limit = gui_fast.logical_kwargs['limit']
+        start, stop = gui_fast.sweep[:2]
+        if limit.get('min') is not None and min(start, stop) < limit['min'] \
+                or limit.get('max') is not None and max(start, stop) > limit['max']:
+            raise Exception(f"the sweep of {gui_fast.nickname} ({start} to {stop}) is outside its limits "
+                            f"({limit.get('min')} to {limit.get('max')}).")
+        parts = {gui_fast.parent: (gui_fast.getPhDev(basedev=True), [])}  # gui_instr: (fast_dev, out_idx)
+        for j, gui_dev in enumerate(gui_out_devs):
+            parts.setdefault(gui_dev.parent, (None, []))[1].append(j)
+        factor = lambda gui_dev: gui_dev.logical_kwargs['scale'].get('factor', 1.)
+        return BufferedLine([(eval(gui_instr.driver), gui_instr.ph_instr, fast_dev, out_idx)
+                             for gui_instr, (fast_dev, out_idx) in parts.items()],
+                            [gui_dev.getPhDev(basedev=True) for gui_dev in gui_out_devs],
+                            factor(gui_fast), [factor(gui_dev) for gui_dev in gui_out_devs])
+
+    # -- TIME TRACE --
+
+    def _closeTraceBuffer(self):
+        # also when the app quits: a long trace can leave gigabytes of chunks in the temporary folder
+        if self.trace_buffer is not None:
+            self.trace_buffer.close()
+            self.trace_buffer = None
+
+    def startTimeTrace(self, gui_out_devs, gui_log_devs):
+        # the out devices against time, without swept device (src.TimeTrace),
+        # in the sweep thread and shown by the live display like a sweep.
+        if gui_out_devs == []:
+            self.pop.traceNoOutputDevice()
+            return
+        main = self.view_main
+        ph_out_devs = [gui_dev.getPhDev() for gui_dev in gui_out_devs]
+        ph_log_devs = [gui_dev.getPhDev() for gui_dev in gui_log_devs]
+        user_comment = main.te_comment.toPlainText()
+        log_vals, log_errors = self._readLogDevices(ph_log_devs, [gui_dev.parent for gui_dev in gui_log_devs])
+        comment = self._makeComment(user_comment, log_vals, log_errors)
+
+        self._closeTraceBuffer()  # the previous trace, its chunks on disk are removed
+        self.trace_buffer = ChunkedBuffer()
+        trace_kwargs = {
+            "out": ph_out_devs,
+            "filename": self._prepareFilename(filename=main.filename_edit.text() or "trace"),
+            "extra_conf": [comment],
+            "rate": main.sb_trace_rate.value(),
+            "duration": main.sb_trace_duration.value(),
+            "parallel_read": main.cb_parallel_read.isChecked(),
+            "out_instr": [gui_dev.parent for gui_dev in gui_out_devs],
+            "out_multi": [gui_dev.multi for gui_dev in gui_out_devs],
+        }
+        self.sweep_thread.initTrace(trace_kwargs, gui_out_devs, self.trace_buffer, time.time())
+        self.sweep_thread.publisher.max_fps = main.sb_max_fps.value()
+        self.sweep_thread.raz_sw_devs = lambda: None
+        self.sweep_thread.start()
+        self.sig_sweepStarted.emit(self.sweep_thread.status)
+
+    # -- JOURNAL / RESUME --
+
+    def _makeJournal(self, gui_sw_devs, gui_out_devs, sweep_kwargs):
+        # what the native engine needs to write a checkpoint journal:
+        # everything to rebuild the sweep (json-able). The live values are read back from the data file.
+        dev_id = lambda gui_dev: [gui_dev.parent.nickname, gui_dev.nickname]
+        info = {
+            "sw_devs": [dev_id(gui_dev) + [gui_dev.sweep, gui_dev.raz] for gui_dev in gui_sw_devs],
+            "out_devs": [dev_id(gui_dev) for gui_dev in gui_out_devs],
+            "beforewait": sweep_kwargs["beforewait"],
+            "updown": sweep_kwargs["updown"],
+            "parallel_read": sweep_kwargs["parallel_read"],
+            "buffered": sweep_kwargs.get("buffered") is not None,
+            "extra_conf": sweep_kwargs["extra_conf"],
+            "comment": sweep_kwargs["comment"],
+            "log_vals": {name: str(val) for name, val in sweep_kwargs["log_vals"].items()},
+        }
+        return info
+
+    def _journalGuiDevice(self, dev_id):
+        gui_instr = self.getGuiInstrument(dev_id[0])
+        gui_dev = gui_instr.getGuiDevice(dev_id[1]) if gui_instr is not None else None
+        if gui_dev is None or not gui_dev.isLoaded():
+            raise Exception(f"Device {dev_id[0]} - {dev_id[1]} is not in the rack or not loaded.")
+        return gui_dev
+
+    def resumeSweepFromJournal(self, path=None):
+        # continue an aborted/crashed sweep of the native engine
+        # from the last point written on disk, in the same data file.
+        if path is None:
+            path = QFileDialog.getOpenFileName(self.view_main, 'Resume sweep', self.view_main.folder_path,
+                                               "Sweep journal (*.journal.json)")[0]
+        if path == "": return
+        try:
+            with open(path) as f:
+                journal = json.load(f)
+            if journal["finished"]:
+                self.pop.resumeSweepFinished()
+                return
+            gui_sw_devs, gui_out_devs = [], []
+            for dev_id, sweep, raz in [(d[:2], d[2], d[3]) for d in journal["sw_devs"]]:
+                gui_dev = self._journalGuiDevice(dev_id)
+                gui_dev.sweep, gui_dev.raz = sweep, raz
+                gui_sw_devs.append(gui_dev)
+            gui_out_devs = [self._journalGuiDevice(dev_id) for dev_id in journal["out_devs"]]
+            buffered = self._makeBufferedLine(gui_sw_devs, gui_out_devs) if journal.get("buffered") else None
+            cursor = journal["cursor"]
+            nb_columns = len(gui_sw_devs) + sum(int(np.prod(gui_dev.multiShape())) for gui_dev in gui_out_devs)
+            rows = readSweepRows(journal["filename"], journal["file_format"], cursor, journal["file_offset"], nb_columns)
+        except Exception as e:
+            self.pop.resumeSweepError(e)
+            return
+
+        ph_sw_devs, start, stop, npts, ph_out_devs, _ = self._genLists(gui_sw_devs, gui_out_devs, [])
+        updown = journal["updown"]
+        sw_idx = self._allocData(gui_out_devs, start, stop, npts, updown)
+        # restore the live values of the points already done from the data file:
+        # the swept devices first, then the columns of every out device
+        done = sw_idx.table[:cursor]
+        column = len(ph_sw_devs)
+        for gui_dev in gui_out_devs:
+            shape = gui_dev.multiShape()
+            size = int(np.prod(shape))
+            gui_dev.flatValues()[done] = rows[:, column:column + size].reshape(-1, *shape)
+            column += size
+        sw_idx.cursor = cursor
+
+        sweep_kwargs = {
+            "dev": ph_sw_devs, "start": start, "stop": stop, "npts": npts, "out": ph_out_devs,
+            "filename": journal["filename"],
+            "extra_conf": journal["extra_conf"],
+            "beforewait": journal["beforewait"],
+            "updown": updown,
+            "exec_before": self._makeRetroactionFunction(ph_sw_devs),
+            "engine": "native",
+            "parallel_read": journal["parallel_read"],
+            "buffered": buffered,
+            "out_instr": [gui_dev.parent for gui_dev in gui_out_devs],
+            "out_multi": [gui_dev.multi for gui_dev in gui_out_devs],
+            "file_format": journal["file_format"],
+            "log_vals": journal["log_vals"],
+            "comment": journal["comment"],
+            "resume": dict(cursor=cursor, file_offset=journal["file_offset"]),
+        }
+        sweep_kwargs["journal"] = self._makeJournal(gui_sw_devs, gui_out_devs, sweep_kwargs)
+
+        self._runSweepThread(gui_sw_devs, gui_out_devs, sweep_kwargs, sw_idx)
+
+    # -- SWEEP QUEUE --
+
+    sig_queueChanged = pyqtSignal()
+    def queueSweep(self, gui_sw_devs, gui_out_devs, gui_log_devs):
+        # add the sweep of the main window to the queue
+        ph_sw_devs, start, stop, npts, ph_out_devs, _ = self._genLists(gui_sw_devs, gui_out_devs, gui_log_devs)
+        main = self.view_main
+        if self._startSweepCheckError(start, stop, npts, ph_sw_devs, ph_out_devs) \
+                or self._multiEngineError(gui_out_devs, main.cb_native.isChecked()):
+            return
+        if main.cb_buffered.isChecked():
+            try:
+                self._makeBufferedLine(gui_sw_devs, gui_out_devs)
+            except Exception as e:
+                self.pop.bufferedLineError(e)
+                return
+        dev_id = lambda gui_dev: [gui_dev.parent.nickname, gui_dev.nickname]
+        native = main.cb_native.isChecked()
+        config = {
+            "name": main.filename_edit.text() or "sweep",
+            "sw_devs": [dev_id(gui_dev) + [list(gui_dev.sweep), gui_dev.raz] for gui_dev in gui_sw_devs],
+            "out_devs": [dev_id(gui_dev) for gui_dev in gui_out_devs],
+            "log_devs": [dev_id(gui_dev) for gui_dev in gui_log_devs],
+            "pre_set": [],
+            "beforewait": main.sb_before_wait.value(),
+            "updown": "alternate" if main.cb_alternate.isChecked() else False,
+            "comment": main.te_comment.toPlainText(),
+            "folder": main.folder_path,
+            "filename": main.filename_edit.text(),
+            "engine": "native" if native else "pyHegel",
+            "parallel_read": native and main.cb_parallel_read.isChecked(),
+            "buffered": native and main.cb_buffered.isChecked(),
+            "file_format": main.cb_file_format.currentData(),
+        }
+        self.sweep_queue.add(config)
+        self.onQueueChanged()
+
+    def onQueueChanged(self):
+        self.sweep_queue.save()
+        self.view_queue.gui_updateQueue()
+
+    def startQueue(self):
+        configs = self.sweep_queue.pending()
+        if configs == []:
+            self.pop.queueEmpty()
+            return
+        self.sweep_thread.publisher.max_fps = self.view_main.sb_max_fps.value()
+        self.sweep_thread.initQueue(configs, self._prepareQueuedSweep)
+        self.sweep_thread.start()
+
+    def _prepareQueuedSweep(self, config):
+        # called by the sweep thread before each queued sweep: no gui in here.
+        # set the pre-sweep values, read the log devices and prepare the sweep.
+        gui_sw_devs = []
+        for dev_id, sweep, raz in [(d[:2], d[2], d[3]) for d in config["sw_devs"]]:
+            gui_dev = self._journalGuiDevice(dev_id)
+            gui_dev.sweep, gui_dev.raz = list(sweep), raz
+            gui_sw_devs.append(gui_dev)
+        gui_out_devs = [self._journalGuiDevice(dev_id) for dev_id in config["out_devs"]]
+        gui_log_devs = [self._journalGuiDevice(dev_id) for dev_id in config["log_devs"]]
+        ph_sw_devs, start, stop, npts, ph_out_devs, ph_log_devs = self._genLists(gui_sw_devs, gui_out_devs, gui_log_devs)
+
+        for instr, dev, value in config["pre_set"]:
+            gui_dev = self._journalGuiDevice([instr, dev])
+            self.model.setValueNow(gui_dev.getPhDev(), value)
+
+        updown = config["updown"]
+        sw_idx = self._allocData(gui_out_devs, start, stop, npts, updown)
+        log_vals, log_errors = self._readLogDevices(ph_log_devs, [gui_dev.parent for gui_dev in gui_log_devs])
+        comment = self._makeComment(config["comment"], log_vals, log_errors)
+
+        sweep_kwargs = {
+            "dev": ph_sw_devs, "start": start, "stop": stop, "npts": npts, "out": ph_out_devs,
+            "filename": self._prepareFilename(config["folder"], config["filename"]),
+            "extra_conf": [comment],
+            "beforewait": config["beforewait"],
+            "updown": updown,
+            "exec_before": None,
+            "engine": config["engine"],
+        }
+        if sweep_kwargs["engine"] == "native":
+            sweep_kwargs["parallel_read"] = config["parallel_read"]
+            sweep_kwargs["buffered"] = self._makeBufferedLine(gui_sw_devs, gui_out_devs) if config.get("buffered") else None
+            sweep_kwargs["out_instr"] = [gui_dev.parent for gui_dev in gui_out_devs]
+            sweep_kwargs["out_multi"] = [gui_dev.multi for gui_dev in gui_out_devs]
+            sweep_kwargs["file_format"] = config["file_format"]
+            sweep_kwargs["log_vals"] = log_vals
+            sweep_kwargs["comment"] = config["comment"]
+            sweep_kwargs["journal"] = self._makeJournal(gui_sw_devs, gui_out_devs, sweep_kwargs)
+        for out in gui_out_devs:
+            out.alternate = updown == "alternate"
+
+        # return to zero in this thread, before the next sweep starts
+        raz_devs = [gui_dev for gui_dev in gui_sw_devs if gui_dev.raz]
+        raz_sw_devs = lambda: self.model.setValuesNow(raz_devs, 0)
+        return sweep_kwargs, gui_sw_devs, gui_out_devs, sw_idx, raz_sw_devs
+
     def pauseSweep(self):
         # called by the main window
         self.loop_control.pause_enabled = True
@@ -611,9 +945,17 @@ class HegelLab(QObject):
 
     def abortSweep(self):
         # called by the main window
+        # The ramps in progress of the swept devices are stopped, the sweep thread
+        # then sets them back to 0 (raz) and emits sig_sweepFinished once they are.
+        self.sweep_thread.abort_time = time.perf_counter()
         self.loop_control.abort_enabled = True
         self.loop_control.pause_enabled = False
-        self.sig_sweepFinished.emit()
+        if not self.sweep_thread.isRunning():
+            self.sig_sweepFinished.emit()
+            return
+        for gui_dev in self.sweep_thread.status.sw_devs or []:
+            self.model.stopSet(gui_dev)
+        self.sig_sweepAborting.emit()
 
 if __name__ == "__main__":
     from PyQt5.QtWidgets import QSplashScreen
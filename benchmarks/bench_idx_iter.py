@@ -0,0 +1,87 @@
+# Per-point cost of the sweep index bookkeeping done in SweepThread.after_get.
+#
+#   python benchmarks/bench_idx_iter.py [nb_cols] [nb_rows] [nb_out_devs]
+#
+# 'stepwise' is the per-point arithmetic used before the index table:
+# one iterator per out device, each one doing branchy python every point.
+# 'table' is src.SweepIdxIter.IdxIter: visiting order precomputed with numpy,
+# one shared cursor for all out devices.
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.SweepIdxIter import IdxIter
+
+
+class StepwiseIdxIter:
+    # reference: per-point arithmetic (previous implementation)
+    def __init__(self, shape, reverse=None, alternate=False):
+        self.shape = list(shape)
+        self.reverse = list(reverse) if reverse is not None else [False] * len(shape)
+        self.alternate = alternate
+        self.current_idx = [n - 1 if rev else 0 for n, rev in zip(self.shape, self.reverse)]
+
+    def next(self):
+        idx, shape, reverse = self.current_idx, self.shape, self.reverse
+        for k in reversed(range(len(idx))):
+            idx[k] = idx[k] - 1 if reverse[k] else idx[k] + 1
+            if k == 0 or 0 <= idx[k] < shape[k]:
+                break
+            if self.alternate:
+                idx[k] = 0 if idx[k] < 0 else shape[k] - 1
+                reverse[k] = not reverse[k]
+            else:
+                idx[k] = shape[k] - 1 if reverse[k] else 0
+        return tuple(idx)
+
+    def current(self):
+        return tuple(self.current_idx)
+
+
+def run_stepwise(shape, nb_out, alternate):
+    values = [np.full(shape, np.nan) for _ in range(nb_out)]
+    iters = [StepwiseIdxIter(shape, [False, True], alternate) for _ in range(nb_out)]
+    nb_points = int(np.prod(shape))
+    t0 = time.perf_counter()
+    for i in range(nb_points):
+        for val, it in zip(values, iters):
+            val[it.current()] = i
+        [it.next() for it in iters]
+    return time.perf_counter() - t0, values
+
+
+def run_table(shape, nb_out, alternate):
+    values = [np.full(shape, np.nan) for _ in range(nb_out)]
+    t0 = time.perf_counter()
+    sw_idx = IdxIter(shape, [False, True], alternate)
+    t_init = time.perf_counter() - t0
+    flat_values = [val.reshape(-1) for val in values]
+    nb_points = int(np.prod(shape))
+    t0 = time.perf_counter()
+    for i in range(nb_points):
+        flat_idx = sw_idx.currentFlat()
+        for flat_val in flat_values:
+            flat_val[flat_idx] = i
+        sw_idx.next()
+    return time.perf_counter() - t0, t_init, values
+
+
+if __name__ == "__main__":
+    nb_cols = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    nb_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    nb_out = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    shape = (nb_cols, nb_rows)
+    nb_points = nb_cols * nb_rows
+
+    for alternate in [False, "alternate"]:
+        t_step, v_step = run_stepwise(shape, nb_out, alternate)
+        t_table, t_init, v_table = run_table(shape, nb_out, alternate)
+        assert all(np.array_equal(a, b) for a, b in zip(v_step, v_table))
+        print(f"{shape} points, {nb_out} out devices, alternate={alternate}")
+        print(f"  stepwise: {t_step / nb_points * 1e6:.2f} us/point")
+        print(f"  table:    {t_table / nb_points * 1e6:.2f} us/point"
+              f" (+ {t_init * 1e3:.1f} ms once at sweep start)")
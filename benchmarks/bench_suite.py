@@ -0,0 +1,211 @@
+# End-to-end sweep benchmark: SweepThread + sweep engine + IdxIter + file writer + live display,
+# against the simulated instrument (src.Simulated), headless (Qt offscreen platform).
+#
+#   python benchmarks/bench_suite.py [-o results.json] [--compare old.json] [--shapes 2000,60x60,15x15x15]
+#                                    [--engine native] [--format txt] [--latency 0] [--beforewait 0] [--fps 30]
+#                                    [--buffered]
+#
+# Every sweep runs in its own process, so the peak RSS is the one of that sweep.
+# Reported for every sweep:
+#   overhead: time per point not spent in beforewait or in the (simulated) instruments
+#   frames: number of frames rendered, late ones (rendered more than 1/fps after
+#     being published) and dropped ones (frame periods without any frame while points came in)
+#   frame_latency: from publish to the end of the rendering
+#   peak_rss: maximum resident memory of the process
+# --buffered takes the fastest axis a whole line at a time (native engine, Drivers.SimulatedDriver).
+# --compare prints the change of overhead and peak RSS against an older result file.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def runSweep(shape, engine, file_format, latency, beforewait, fps, folder, buffered=False):
+    # one sweep, in this process
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)  # for the .ui files
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QObject, pyqtSignal
+    app = QApplication([])
+    from pyHegel.commands import Loop_Control
+    from src.GuiInstrument import GuiInstrument, GuiDevice
+    from src.Simulated import SimulatedInstrument
+    from src.SweepThread import SweepThread, SweepStatus
+    from src.SweepEngine import BufferedLine
+    from src.SweepIdxIter import allocData
+    from src import Drivers
+    from windows.DisplayWindow import DisplayWindow
+
+    class Signals(QObject):
+        sig_progress = pyqtSignal(SweepStatus)
+        sig_error = pyqtSignal(Exception)
+        sig_finished = pyqtSignal()
+
+    # devices
+    instr = SimulatedInstrument(nb_sources=len(shape), latency=latency)
+    device_time = [0.]
+    wait = instr._wait
+    def timedWait():
+        t0 = time.perf_counter()
+        wait()
+        device_time[0] += time.perf_counter() - t0
+    instr._wait = timedWait
+    gui_instr = GuiInstrument("sim", "Simulated.SimulatedInstrument", "Drivers.Default", "")
+    gui_instr.ph_instr = instr
+    def guiDev(name):
+        gui_dev = GuiDevice(name, name, {}, gui_instr)
+        gui_dev.ph_dev = getattr(instr, name)
+        gui_instr.gui_devices.append(gui_dev)
+        return gui_dev
+    gui_sw_devs = [guiDev(f"source{k+1}") for k in range(len(shape))]
+    for gui_dev, n in zip(gui_sw_devs, shape):
+        gui_dev.sweep = [0., 1., n]
+    gui_out_devs = [guiDev("readval")]
+    start, stop, npts = [0.] * len(shape), [1.] * len(shape), list(shape)
+    sw_idx = allocData(gui_out_devs, start, stop, npts, False)
+
+    # display
+    display = DisplayWindow(None)
+    display.show()
+
+    # sweep thread, with the publish times recorded
+    signals = Signals()
+    errors = []
+    signals.sig_error.connect(lambda e: errors.append(repr(e)))
+    thread = SweepThread(Loop_Control(), signals.sig_progress, signals.sig_error, signals.sig_finished)
+    emit_times, render_times = [], []
+    emit = thread.publisher._emit
+    def timedEmit(status, now):
+        emit_times.append(time.perf_counter())
+        emit(status, now)
+    thread.publisher._emit = timedEmit
+    thread.publisher.max_fps = fps
+    def onProgress(status):
+        display.gui_onSweepProgress(status)
+        display.repaint()
+        render_times.append(time.perf_counter())
+    signals.sig_progress.connect(onProgress)
+    signals.sig_finished.connect(app.quit)
+
+    sweep_kwargs = {
+        "dev": [gui_dev.getPhDev() for gui_dev in gui_sw_devs], "start": start, "stop": stop, "npts": npts,
+        "out": [gui_dev.getPhDev() for gui_dev in gui_out_devs],
+        "filename": os.path.join(folder, "bench_%t.txt"),
+        "extra_conf": [""], "beforewait": beforewait, "updown": False, "exec_before": None,
+        "engine": engine,
+    }
+    if engine == "native":
+        sweep_kwargs["file_format"] = file_format
+    if buffered:
+        sweep_kwargs["buffered"] = BufferedLine([(Drivers.SimulatedDriver, instr, gui_sw_devs[-1].ph_dev, [0])],
+                                                [gui_dev.ph_dev for gui_dev in gui_out_devs])
+    thread.initSweepKwargs(sweep_kwargs)
+    thread.initSweepStatus(gui_sw_devs, gui_out_devs, sw_idx, time.time())
+    display.gui_onSweepStarted(thread.status)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    t0 = time.perf_counter()
+    thread.start()
+    app.exec_()
+    thread.wait()
+    duration = time.perf_counter() - t0
+
+    # frames
+    nb_points = int(np.prod(shape))
+    latencies = np.array(render_times) - np.array(emit_times[:len(render_times)])
+    period = 1. / fps
+    gaps = np.diff([t0] + render_times)
+    return {
+        "shape": list(shape),
+        "engine": engine,
+        "file_format": file_format if engine == "native" else "txt",
+        "buffered": buffered,
+        "nb_points": nb_points,
+        "duration": duration,
+        "points_per_s": nb_points / duration,
+        "overhead_us": (duration - nb_points * beforewait - device_time[0]) / nb_points * 1e6,
+        "frames": len(render_times),
+        "late_frames": int(np.sum(latencies > period)),
+        "dropped_frames": int(np.sum(np.maximum(np.floor(gaps / period) - 1, 0))),
+        "frame_latency_ms": {"median": float(np.median(latencies) * 1e3) if len(latencies) else None,
+                             "max": float(np.max(latencies) * 1e3) if len(latencies) else None},
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / 2**20,
+        "sweep_rss_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - rss_before) / 2**20,
+        "errors": errors,
+    }
+
+
+def gitVersion():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, old):
+    # overhead and memory against a previous result file
+    key = lambda c: json.dumps([c["shape"], c["engine"], c["file_format"], c.get("buffered", False)])
+    old_configs = {key(c): c for c in old["configs"]}
+    print(f"compared to {old.get('version')}:")
+    for config in results["configs"]:
+        prev = old_configs.get(key(config))
+        if prev is None: continue
+        print(f"  {config['shape']}: overhead {prev['overhead_us']:.1f} -> {config['overhead_us']:.1f} us/point,"
+              f" peak RSS {prev['peak_rss_mb']:.0f} -> {config['peak_rss_mb']:.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--output", default="bench_suite.json")
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--shapes", default="2000,60x60,15x15x15")
+    parser.add_argument("--engine", default="native", choices=["native", "pyHegel"])
+    parser.add_argument("--format", default="txt", choices=["txt", "npy"])
+    parser.add_argument("--latency", type=float, default=0.)
+    parser.add_argument("--beforewait", type=float, default=0.)
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--buffered", action="store_true")
+    parser.add_argument("--one", default=None, help=argparse.SUPPRESS)  # child process
+    args = parser.parse_args()
+
+    if args.one is not None:
+        with tempfile.TemporaryDirectory() as folder:
+            result = runSweep(json.loads(args.one), args.engine, args.format,
+                              args.latency, args.beforewait, args.fps, folder, args.buffered)
+        print(json.dumps(result))
+        sys.exit(0)
+
+    results = {"version": gitVersion(), "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+               "python": sys.version.split()[0], "args": vars(args), "configs": []}
+    for shape in args.shapes.split(","):
+        shape = [int(n) for n in shape.split("x")]
+        cmd = [sys.executable, os.path.abspath(__file__), "--one", json.dumps(shape),
+               "--engine", args.engine, "--format", args.format, "--latency", str(args.latency),
+               "--beforewait", str(args.beforewait), "--fps", str(args.fps)]
+        if args.buffered:
+            cmd += ["--buffered"]
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, check=True).stdout
+        config = json.loads(out.strip().splitlines()[-1])
+        results["configs"].append(config)
+        print(f"{config['shape']}: {config['points_per_s']:.0f} points/s,"
+              f" overhead {config['overhead_us']:.1f} us/point,"
+              f" frames {config['frames']} (late {config['late_frames']}, dropped {config['dropped_frames']}),"
+              f" peak RSS {config['peak_rss_mb']:.0f} MB")
+        for error in config["errors"]:
+            print("  error:", error)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
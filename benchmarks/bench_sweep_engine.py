@@ -0,0 +1,101 @@
+# Dead time per point of the sweep loop: serial (sweep_multi-like) vs native pipelined engine.
+#
+#   python benchmarks/bench_sweep_engine.py [nb_points] [beforewait_s] [get_latency_s] [write_latency_s]
+#
+# Runs against simulated devices with a fixed latency per call, and a file
+# writer with a fixed latency per write (slow network share).
+# 'serial' reproduces the sweep_multi order: set -> wait -> read all -> write -> publish.
+# 'native' is src.SweepEngine.NativeSweep, 'parallel' the same with parallel_read
+# (the two out devices are on different instruments).
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from src.SweepEngine import NativeSweep
+from src.SweepFile import TextSweepWriter, flatRow
+
+
+class LatencyDevice:
+    def __init__(self, name, latency):
+        self.name = name
+        self.latency = latency
+        self.value = 0.
+
+    def getfullname(self):
+        return self.name
+
+    def set(self, val):
+        time.sleep(self.latency)
+        self.value = val
+
+    def get(self):
+        time.sleep(self.latency)
+        return self.value
+
+
+class SlowWriter(TextSweepWriter):
+    latency = 0.
+
+    def writeRows(self, rows):
+        time.sleep(self.latency)  # per write call
+        super().writeRows(rows)
+
+
+class BenchSweep(NativeSweep):
+    def _makeWriter(self):
+        columns = [dev.getfullname() for dev in self.devs + self.out_devs]
+        return SlowWriter(self.filename, columns, self.extra_conf)
+
+
+class SerialSweep(BenchSweep):
+    # reference: everything in sequence, like sweep_multi
+    def run(self):
+        writer = self._makeWriter()
+        for i in range(len(self.table)):
+            self._setPoint(i)
+            time.sleep(self.beforewait)
+            datas = self._makeDatas(i)
+            datas["read_vals"] = self._readOut(i)
+            writer.writeRows([flatRow(datas["set_vals"] + datas["read_vals"])])
+            writer.flush()
+            if self.exec_after is not None:
+                self.exec_after(datas)
+        writer.close()
+
+
+def publish(datas):
+    # stands for the per-point gui bookkeeping (SweepThread.after_get)
+    time.sleep(50e-6)
+
+
+def run(cls, nb_points, beforewait, get_latency, folder, **extra):
+    sw_dev = LatencyDevice("gate", 0.)
+    out_devs = [LatencyDevice(f"lockin{i}", get_latency) for i in range(2)]
+    kwargs = dict(dev=[sw_dev], start=[0], stop=[1], npts=[nb_points], out=out_devs,
+                  filename=os.path.join(folder, cls.__name__ + "_%t.txt"),
+                  beforewait=beforewait, exec_after=publish, **extra)
+    sweep = cls(**kwargs)
+    t0 = time.perf_counter()
+    sweep.run()
+    return (time.perf_counter() - t0) / nb_points
+
+
+if __name__ == "__main__":
+    nb_points = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    beforewait = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+    get_latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.001
+    SlowWriter.latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.002
+
+    with tempfile.TemporaryDirectory() as folder:
+        configs = [("serial", SerialSweep, {}),
+                   ("native", BenchSweep, {}),
+                   ("parallel", BenchSweep, dict(parallel_read=True, out_instr=["lockin0", "lockin1"]))]
+        for name, cls, extra in configs:
+            per_point = run(cls, nb_points, beforewait, get_latency, folder, **extra)
+            # minimal time per point: wait + reads (in sequence or in parallel)
+            floor = beforewait + get_latency * (1 if extra.get("parallel_read") else 2)
+            print(f"{name}: {per_point * 1e3:.2f} ms/point,"
+                  f" dead time {(per_point - floor) * 1e3:.2f} ms/point")
@@ -0,0 +1,70 @@
+import threading
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+def robustLevels(image, nb_samples=100000, percentiles=(0.5, 99.5)):
+    # (min, max) levels of image: percentiles of about nb_samples values of it, NaN ignored.
+    # None if image is all NaN
+    step = max(1, int(np.sqrt(image.size / nb_samples)))
+    sample = image[::step, ::step]
+    values = sample[np.isfinite(sample)]
+    if values.size == 0:
+        values = image[np.isfinite(image)]  # few points yet, the subsample can miss them
+        if values.size == 0: return None
+    low, high = np.percentile(values, percentiles)
+    return float(low), float(high)
+
+
+def applyLut(image, lut, levels):
+    # RGBA image (uint8, image.shape + (4,)) of image through lut ((n, 4) uint8), NaN transparent
+    low, high = levels
+    scale = (len(lut) - 1) / (high - low) if high > low else 0.
+    with np.errstate(invalid="ignore"):
+        index = np.clip((image - low) * scale, 0, len(lut) - 1)
+    nan = np.isnan(index)
+    index[nan] = 0
+    rgba = lut[index.astype(np.intp)]
+    rgba[nan] = 0
+    return rgba
+
+
+class ColorMapThread(QThread):
+    # Colour mapping of the live image, so the gui thread only shows a ready RGBA image.
+    # request() gives the newest image: a request not started yet is replaced by the next one.
+    # The levels are computed from the image when asked (robustLevels), then the lookup
+    # table is applied and sig_done emits (rgba, levels, info), info as given to request().
+
+    sig_done = pyqtSignal(object, object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.condition = threading.Condition()
+        self.job = None
+        self.stopped = False
+
+    def request(self, image, lut, levels=None, info=None):
+        # image: 2D, not modified afterwards; lut: (n, 4) uint8; levels: (min, max), None to compute them
+        with self.condition:
+            if self.job is not None and self.job[2] is None:
+                levels = None  # levels asked for and not computed yet
+            self.job = (image, lut, levels, info)
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.job is None and not self.stopped:
+                    self.condition.wait()
+                if self.stopped: return
+                (image, lut, levels, info), self.job = self.job, None
+            if levels is None:
+                levels = robustLevels(image)
+                if levels is None: continue
+            self.sig_done.emit(applyLut(image, lut, levels), levels, info)
@@ -11,9 +11,15 @@ from PyQt5.QtWidgets import (
     QFormLayout,
     QLineEdit,
     QCheckBox,
+    QDialog,
+    QComboBox,
+    QTableWidgetItem,
+    QFileDialog,
 )
 from widgets.WindowWidget import Window
 from src.GuiInstrument import GuiInstrument, GuiDevice
+from src import Simulated, Virtual  # for eval of ph_class
+import numpy as np
 
 ####################
 # Loading thread
@@ -63,15 +69,27 @@ class LoadThread(QThread):
 class Default:
     # a class to inherit from when creating a custom gui for an instrument
 
+    # Buffered fast axis (native engine): a driver whose instrument takes a whole line
+    # in one hardware-timed burst (data buffer, triggered ramp...) sets buffered = True
+    # and implements, for every line of the sweep:
+    #   arm(ph_instr, fast_dev, values, out_devs): prepare the line,
+    #     fast_dev: the swept device going through values (None if it is not one of this instrument)
+    #     out_devs: the out devices of this instrument, recording len(values) points
+    #   trigger(ph_instr): start the line (the instrument of fast_dev is triggered last)
+    #   fetch(ph_instr, out_devs): wait for the end of the line, one array of len(values) per out dev
+    # The devices are the base pyHegel devices (no ramp/scale/limit).
+    buffered = False
+
     @staticmethod
-    def load(lab, gui_instr, onFinished):
+    def load(lab, gui_instr, onFinished, kwargs=None):
         # load the instrument, finish by calling
         # either onFinished(gui_instr, None) or onFinished(gui_instr, err)
+        # kwargs of the instrument class: the 'kwargs' of the json entry, updated by kwargs
 
         nickname = gui_instr.nickname
         ph_class = eval(gui_instr.ph_class)
         address = gui_instr.address
-        kwargs = {}
+        kwargs = dict(gui_instr.instr_dict.get('kwargs', {}), **(kwargs or {}))
         if gui_instr.slot is not None:
             kwargs['slot'] = gui_instr.slot
 
@@ -301,13 +319,228 @@ class ami430(Default):
 ####################
 
 class VirtualGates(Default):
+    # Virtual.VirtualGatesInstrument: the window sets the real gates (devices of the rack)
+    # and the matrix (CC or CC^-1), then loads the instrument and adds its vg devices.
+    # Saved in the 'kwargs' of the json entry: gates (as [instr, dev] nicknames), matrix, inverse.
+
+    @staticmethod
+    def makeWindow(lab, gui_instr):
+        win = QDialog()
+        uic.loadUi("ui/DriverVirtualGate.ui", win)
+        win.setWindowTitle("Setup virtual gates - " + str(gui_instr.nickname))
+        win.setWindowIcon(QtGui.QIcon("resources/config.svg"))
+        gui_instr._win = win # avoid garbage collector
+        win.gates = []  # real GuiDevice of every column
+
+        def resize(n):
+            old = VirtualGates._tableMatrix(win)
+            win.gates = (win.gates + [None] * n)[:n]
+            win.cap_table.setRowCount(n)
+            win.cap_table.setColumnCount(n)
+            VirtualGates._fillTable(win, np.eye(n))
+            m = min(n, len(old))
+            VirtualGates._fillTable(win, old[:m, :m])
+        win.cap_gate_num.valueChanged.connect(resize)
+
+        def onSetGates():
+            # one combo per real gate, among the settable devices of the rack
+            devs = [gui_dev for gui_dev in lab.getAllGuiDevices()
+                    if gui_dev.parent is not gui_instr and gui_dev.type[0] is not False]
+            dial = QDialog(win)
+            dial.setWindowTitle("Real gates")
+            form = QFormLayout(dial)
+            combos = []
+            for k in range(len(win.gates)):
+                combo = QComboBox()
+                for gui_dev in devs:
+                    combo.addItem(gui_dev.getDisplayName("short", with_instr=True), gui_dev)
+                if win.gates[k] in devs: combo.setCurrentIndex(devs.index(win.gates[k]))
+                form.addRow(f"Gate {k+1}:", combo)
+                combos.append(combo)
+            ok = QPushButton("Ok")
+            ok.clicked.connect(dial.accept)
+            form.addRow(ok)
+            if dial.exec_():
+                win.gates = [combo.currentData() for combo in combos]
+                VirtualGates._setHeaders(win)
+        win.cap_set_gates.clicked.connect(onSetGates)
+
+        def onLoadArray():
+            path = QFileDialog.getOpenFileName(win, "Load matrix", "", "Array (*.npy *.txt)")[0]
+            if path == "": return
+            try:
+                matrix = np.load(path) if path.endswith(".npy") else np.loadtxt(path, ndmin=2)
+            except Exception as e:
+                lab.pop.virtualGatesError(e)
+                return
+            win.cap_gate_num.setValue(len(matrix))
+            VirtualGates._fillTable(win, matrix)
+        win.cap_load_btn.clicked.connect(onLoadArray)
+
+        def onSaveArray():
+            path = QFileDialog.getSaveFileName(win, "Save matrix", "", "Array (*.npy *.txt)")[0]
+            if path == "": return
+            matrix = VirtualGates._tableMatrix(win)
+            np.save(path, matrix) if path.endswith(".npy") else np.savetxt(path, matrix)
+        win.cap_save.clicked.connect(onSaveArray)
+        win.cap_reset.clicked.connect(lambda: VirtualGates._fillTable(win, np.eye(len(win.gates))))
+
+        # previous configuration
+        kwargs = gui_instr.instr_dict.get('kwargs', {})
+        gates = kwargs.get('gates', [])
+        win.cap_gate_num.setValue(len(gates))
+        resize(len(gates))
+        for k, (instr_nickname, dev_nickname) in enumerate(gates):
+            gui_instr_gate = lab.getGuiInstrument(instr_nickname)
+            win.gates[k] = gui_instr_gate.getGuiDevice(dev_nickname) if gui_instr_gate is not None else None
+        if 'matrix' in kwargs:
+            VirtualGates._fillTable(win, np.array(kwargs['matrix']))
+        win.cap_type.setCurrentIndex(1 if kwargs.get('inverse') else 0)
+        VirtualGates._setHeaders(win)
+        return win
+
+    @staticmethod
+    def _setHeaders(win):
+        win.cap_table.setHorizontalHeaderLabels(
+            [gui_dev.getDisplayName("short") if gui_dev is not None else f"gate {k+1}"
+             for k, gui_dev in enumerate(win.gates)])
+        win.cap_table.setVerticalHeaderLabels([f"vg{k+1}" for k in range(len(win.gates))])
+
+    @staticmethod
+    def _fillTable(win, matrix):
+        for i, j in np.ndindex(matrix.shape):
+            win.cap_table.setItem(i, j, QTableWidgetItem(str(matrix[i, j])))
+        VirtualGates._setHeaders(win)
+
+    @staticmethod
+    def _tableMatrix(win):
+        n = win.cap_table.rowCount()
+        matrix = np.zeros((n, n))
+        for i, j in np.ndindex(matrix.shape):
+            item = win.cap_table.item(i, j)
+            matrix[i, j] = float(item.text()) if item is not None and item.text() != "" else 0.
+        return matrix
 
     @staticmethod
-    def load(gui_instr, lab):
+    def load(lab, gui_instr, onFinished, kwargs=None):
+        win = VirtualGates.makeWindow(lab, gui_instr)
+
+        def onCreate():
+            try:
+                matrix = VirtualGates._tableMatrix(win)
+                if None in win.gates or len(win.gates) == 0:
+                    raise ValueError("Every real gate must be set (Set gates).")
+                if any(not gui_dev.isLoaded() for gui_dev in win.gates):
+                    raise ValueError("The real gates must be loaded.")
+                np.linalg.inv(matrix)  # raises if singular
+            except Exception as e:
+                lab.pop.virtualGatesError(e)
+                return
+            inverse = win.cap_type.currentIndex() == 1
+            kwargs = dict(gates=[[gui_dev.parent.nickname, gui_dev.nickname] for gui_dev in win.gates],
+                          matrix=matrix.tolist(), inverse=inverse)
+            gui_instr.instr_dict = dict(gui_instr.instr_dict, kwargs=kwargs)  # not the one of the default list
+            ph_gates = [gui_dev.getPhDev() for gui_dev in win.gates]
+            win.accept()
+            if gui_instr.ph_instr is not None and gui_instr.ph_instr._gates == ph_gates:
+                # same gates: only the matrix changes
+                try:
+                    gui_instr.ph_instr.setMatrix(matrix, inverse)
+                except Exception as e:
+                    onFinished(gui_instr, e)
+                    return
+                onFinished(gui_instr, None)
+                return
+            Default.load(lab, gui_instr, onLoaded, dict(gates=ph_gates))
+        win.cap_create.clicked.connect(onCreate)
+
+        def onLoaded(gui_instr, err):
+            onFinished(gui_instr, err)
+            if err: return
+            # one device per virtual gate
+            nicknames = [gui_dev.ph_name for gui_dev in gui_instr.gui_devices]
+            new = [dict(ph_name=f"vg{k+1}") for k in range(len(win.gates)) if f"vg{k+1}" not in nicknames]
+            if new: lab.newDevicesFromRack(gui_instr, new)
+
+        def onRejected():
+            # closed without creating: the instrument stays as it was
+            if gui_instr.ph_instr is None:
+                onFinished(gui_instr, Exception("Virtual gates not created."))
+            else:
+                onFinished(gui_instr, None)
+        win.rejected.connect(onRejected)
+        win.show()
+
+    @staticmethod
+    def sweepWindow(lab, gui_dev, sig_finished):
+        # sweep_x/sweep_y: choose the virtual gate of the axis, its path is precomputed
+        if gui_dev.ph_name not in ('sweep_x', 'sweep_y'):
+            Default.sweepWindow(lab, gui_dev, sig_finished)
+            return
+        ph_instr = gui_dev.parent.ph_instr
+        axis = gui_dev.ph_name[-1]
         win = Window()
-        uic.loadUi("ui/DriverVirtualGates.ui", win)
-        
+        win.setWindowTitle("Setup sweep " + gui_dev.getDisplayName("long"))
+        win.setWindowIcon(QtGui.QIcon("resources/favicon/favicon.png"))
+        wid = QWidget()
+        win.setCentralWidget(wid)
+        form = QFormLayout()
+        wid.setLayout(form)
+        combo_gate = QComboBox()
+        for k in range(len(ph_instr._gates)):
+            combo_gate.addItem(f"vg{k+1}", k)
+        if axis in ph_instr._axes:
+            combo_gate.setCurrentIndex(ph_instr._axes[axis][0])
+        spin_start = ScientificSpinBox.PyScientificSpinBox()
+        spin_stop = ScientificSpinBox.PyScientificSpinBox()
+        spin_npts = QSpinBox()
+        spin_npts.setMaximum(1000000)
+        check_raz = QCheckBox(checked=gui_dev.raz)
+        if None not in gui_dev.sweep:
+            spin_start.setValue(gui_dev.sweep[0])
+            spin_stop.setValue(gui_dev.sweep[1])
+            spin_npts.setValue(gui_dev.sweep[2])
+        ok_button = QPushButton("Ok")
+        form.addRow("Virtual gate:", combo_gate)
+        form.addRow("Start:", spin_start)
+        form.addRow("Stop:", spin_stop)
+        form.addRow("# pts:", spin_npts)
+        form.addRow("Ret. to 0:", check_raz)
+        form.addRow(ok_button)
+
+        def onOk():
+            sweep = [spin_start.value(), spin_stop.value(), spin_npts.value()]
+            try:
+                ph_instr.setAxis(axis, combo_gate.currentData(), *sweep)
+            except Exception as e:
+                lab.pop.virtualGatesError(e)
+                return
+            gui_dev.sweep = sweep
+            gui_dev.raz = check_raz.isChecked()
+            sig_finished.emit(gui_dev, True)
+            win.close()
+        ok_button.clicked.connect(onOk)
+
+        gui_dev._win_sweep = win
+        win.focus()
+
+
+####################
+# Simulated
+####################
+
+class SimulatedDriver(Default):
+    # Simulated.SimulatedInstrument, with its buffered line (one call for the whole line)
+    buffered = True
+
+    @staticmethod
+    def arm(ph_instr, fast_dev, values, out_devs):
+        ph_instr.armLine(fast_dev, values)
+
+    @staticmethod
+    def trigger(ph_instr):
+        ph_instr.triggerLine()
 
     @staticmethod
-    def sweep(gui_dev, lab):
-        Default.sweep(gui_dev)
+    def fetch(ph_instr, out_devs):
+        return ph_instr.fetchLine(out_devs)
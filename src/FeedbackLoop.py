@@ -0,0 +1,137 @@
+from PyQt5.QtCore import QThread
+import numpy as np
+import time
+
+
+class FeedbackLoop(QThread):
+    # Retroaction on a device (ST) at its own fixed rate, in its own thread:
+    #   ST = st_first_val + coeff_p1 * P1 + coeff_p2 * P2 (+ PID correction)
+    # P1 and P2 are swept devices: their values are the setpoints of the sweep,
+    # given by the sweep at every point (setSetpoints), they are never read on the instruments.
+    # pid: dict(dev=, target=, kp=, ki=, kd=), the correction is kp*e + ki*int(e) + kd*de/dt
+    #   with e = target - dev.get() (the only read of the loop).
+    # ST is only set when its value changes.
+    # Every tick is logged (the last log_size ones):
+    #   time, jitter (start of the tick - scheduled time), latency (scheduled time -> ST set)
+    #   and the output value. A tick longer than the period skips the next ones (overruns).
+    # When the loop ends, the thread itself sets ST back to its value before the loop
+    # (it can be a slow ramp): stopLoop only asks, finished is emitted once ST is back.
+
+    def __init__(self, st_dev, st_first_val, p_coeffs, rate=10., pid=None, sig_error=None, log_size=100000,
+                 previous=None):
+        # st_dev: pyHegel device set by the loop
+        # p_coeffs: [(index of the device in the setpoints, coeff), ...]
+        # st_first_val: None to read ST when the thread starts
+        # previous: loop of the previous sweep, maybe still setting its ST back: waited for before reading ST
+        super().__init__()
+        self.previous = previous
+        self.st_dev = st_dev
+        self.st_first_val = st_first_val
+        self.p_coeffs = p_coeffs
+        self.rate = rate
+        self.pid = pid
+        self.sig_error = sig_error
+        self.setpoints = None  # set_vals of the current point of the sweep
+        self.stopping = False
+        self.restore = True
+        self.error = None
+        # pid state
+        self.integral = 0.
+        self.last_error = None
+        # log
+        self.log = np.full((log_size, 4), np.nan)  # time, jitter, latency, output
+        self.nb_ticks = 0
+        self.overruns = 0
+        self.last_out = None
+
+    def setSetpoints(self, set_vals):
+        # called by the sweep (exec_before), a new list every time (no lock needed)
+        self.setpoints = list(set_vals)
+
+    def stopLoop(self, restore=True):
+        # ask the thread to stop (does not wait), it sets ST back to its value before the loop if restore
+        self.restore = restore
+        self.stopping = True
+
+    def _output(self, setpoints, dt):
+        out = self.st_first_val
+        for idx, coeff in self.p_coeffs:
+            if setpoints[idx] is not None:
+                out += coeff * setpoints[idx]
+        if self.pid is not None:
+            pid = self.pid
+            error = pid['target'] - pid['dev'].get()
+            self.integral += error * dt
+            derivative = (error - self.last_error) / dt if self.last_error is not None and dt > 0 else 0.
+            self.last_error = error
+            out += pid['kp'] * error + pid['ki'] * self.integral + pid['kd'] * derivative
+        return out
+
+    def _tick(self, t_sched, dt):
+        t_start = time.perf_counter()
+        setpoints = self.setpoints
+        if setpoints is None: return  # the sweep has not started yet
+        out = self._output(setpoints, dt)
+        if out != self.last_out:
+            self.st_dev.set(out)
+            self.last_out = out
+        now = time.perf_counter()
+        row = self.nb_ticks % len(self.log)
+        self.log[row] = (now, t_start - t_sched, now - t_sched, out)
+        self.nb_ticks += 1
+
+    def run(self):
+        if self.previous is not None:
+            self.previous.wait()  # its ST set back first
+            self.previous = None
+        period = 1. / self.rate
+        t_last = None
+        try:
+            if self.st_first_val is None:
+                self.st_first_val = self.st_dev.get()
+            t_sched = time.perf_counter()
+            while not self.stopping:
+                if (remaining := t_sched - time.perf_counter()) > 0:
+                    time.sleep(min(remaining, 0.05))  # stays responsive to stopLoop
+                    continue
+                self._tick(t_sched, t_sched - t_last if t_last is not None else 0.)
+                t_last = t_sched
+                t_sched += period
+                if (late := time.perf_counter() - t_sched) > 0:
+                    # keep the schedule, skip the ticks already missed
+                    skipped = int(late // period) + 1
+                    self.overruns += skipped
+                    t_sched += skipped * period
+        except Exception as e:
+            self._error(e)
+        try:
+            if self.restore and self.last_out is not None:
+                self.st_dev.set(self.st_first_val)
+        except Exception as e:
+            self._error(e)
+
+    def _error(self, e):
+        self.error = e
+        if self.sig_error is not None:
+            self.sig_error.emit(e)
+
+    def ticks(self):
+        # logged ticks, oldest first
+        if self.nb_ticks <= len(self.log):
+            return self.log[:self.nb_ticks]
+        return np.roll(self.log, -(self.nb_ticks % len(self.log)), axis=0)
+
+    def stats(self):
+        ticks = self.ticks()
+        if len(ticks) == 0: return None
+        jitter, latency = ticks[:, 1], ticks[:, 2]
+        duration = ticks[-1, 0] - ticks[0, 0]
+        return dict(ticks=self.nb_ticks, overruns=self.overruns,
+                    rate=float((len(ticks) - 1) / duration) if duration > 0 else None,
+                    latency_mean=float(latency.mean()), latency_max=float(latency.max()),
+                    jitter_std=float(jitter.std()), jitter_max=float(jitter.max()))
+
+    def saveLog(self, path):
+        ticks = self.ticks()
+        np.savez(path, time=ticks[:, 0], jitter=ticks[:, 1], latency=ticks[:, 2], output=ticks[:, 3],
+                 rate=self.rate, overruns=self.overruns)
@@ -1,5 +1,26 @@
 import numpy as np
 
+
+def _multiIsShape(multi):
+    return isinstance(multi, tuple) and all(isinstance(n, (int, np.integer)) for n in multi)
+
+
+def multiShape(multi):
+    # shape of one value of a device from the multi of its pyHegel format:
+    # () for one val only (None, False...), (n,) for n named values, the shape of an array
+    if _multiIsShape(multi):
+        return tuple(int(n) for n in multi)
+    if isinstance(multi, (list, tuple)):
+        return (len(multi),)
+    return ()
+
+
+def multiNames(multi):
+    # names of the values from the multi of a pyHegel format, None if it has none (one val only or array)
+    if isinstance(multi, (list, tuple)) and not _multiIsShape(multi):
+        return [str(name) for name in multi]
+    return None
+
 class GuiInstrument:
     # class attached to every item that represent an instr
 
@@ -12,7 +33,7 @@ class GuiInstrument:
         self.address = address
         self.slot = slot
 
-        self.instr_dict = {}  # the dict from json file (as is (not updated!)). Used ONLY for driver with extra args
+        self.instr_dict = {}  # the dict from json file (as is (not updated!)). Used ONLY for driver with extra args and the 'kwargs' of the instrument class
         self.ph_instr = None
         self.loading = False # True when the instr is loading
         self.gui_devices = []  # list of GuiDevice
@@ -54,6 +75,8 @@ class GuiInstrument:
             d['address'] = self.address
         if self.slot is not None:
             d['slot'] = self.slot
+        if self.instr_dict.get('kwargs'):
+            d['kwargs'] = self.instr_dict['kwargs']
         d['devices'] = []
         for gui_dev in self.gui_devices:
             d['devices'].append(gui_dev.toDict())
@@ -81,7 +104,7 @@ class GuiDevice:
         self.extra_args = extra_args # dict of kwargs for tuple devices
         self.parent = parent
         self.type = [None, None, None]  # (settable, gettable, output_type) = (T/F, T/F, None/bool)
-        self.multi = None # a tuple giving the shape of return when get (None -> one val only)
+        self.multi = None # multi of the pyHegel format: list of the names of the values, or tuple giving the shape of return when get (None or False -> one val only)
         
         self.logical_kwargs = {'scale': {}, 'ramp':{}, 'limit':{}}
         self.logical_dev = None # limit(ramp(scale())))
@@ -96,7 +119,8 @@ class GuiDevice:
 
         # sweep
         # a np.array for when the device is in a sweep (swept or output)
-        # size is allocated at the beginning of the sweep
+        # size is allocated at the beginning of the sweep: one axis per swept device,
+        # plus the trailing axes of multiShape for a multi device
         self.values = None
         self.sw_idx = None  # SweepIdxIter object
 
@@ -108,6 +132,19 @@ class GuiDevice:
         # keep the thread use to set ph_dev value
         self.set_thread = None
 
+    def multiShape(self):
+        # shape of one value: () for one val only, (n,) for n named values, the shape of an array
+        return multiShape(self.multi)
+
+    def channelNames(self):
+        # names of the values of a multi device, None if it has none (one val only or array)
+        return multiNames(self.multi)
+
+    def flatValues(self):
+        # view of self.values with one row per point (indexes of sw_idx.table), no copy:
+        # the values are contiguous, the ones of a multi device are the trailing axes.
+        return self.values.reshape(-1, *self.multiShape())
+
     def getPhDev(self, basedev=False):
         if self.logical_dev is not None and not basedev:
             return self.logical_dev
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class ImagePyramid:
+    # Min/max/mean pyramid of a 2D image, for the live display of very large maps:
+    # level k has one pixel per 2**k x 2**k block of the image (the last blocks can be partial),
+    # level 0 is the image itself. NaN are ignored, a block of NaN only is NaN.
+    # The display shows the level matching the screen resolution, the image stays
+    # at full resolution for the cursor readout and the linecuts.
+
+    # Levels are built on demand, then kept up to date lazily: update() only marks
+    # the lines of the image that changed, their blocks are reduced again when a
+    # level is asked for, from the level below.
+
+    def __init__(self):
+        self.reset(None)
+
+    def reset(self, image):
+        self.image = image
+        self.levels = []  # level k + 1: [sum, count, min, max] arrays
+        self.dirty = []  # level k + 1: [rows, cols] bool masks of its lines to reduce again
+
+    def update(self, image, changed=None):
+        # image: the new image, changed: (axis, indexes) of its lines that changed
+        # since the previous update (rows for axis 0, columns for axis 1), None for all
+        if changed is None or self.image is None or image.shape != self.image.shape:
+            self.reset(image)
+            return
+        self.image = image  # the same data, maybe another view
+        axis, lines = changed
+        for k, dirty in enumerate(self.dirty):
+            dirty[axis][np.asarray(lines) >> (k + 1)] = True
+
+    def nbLevels(self):
+        # up to the level of one pixel
+        if self.image is None: return 0
+        return int(np.ceil(np.log2(max(max(self.image.shape), 1)))) + 1
+
+    def levelFor(self, pixel_ratio):
+        # the coarsest level with blocks not bigger than pixel_ratio (image pixels per screen pixel)
+        if not np.isfinite(pixel_ratio) or pixel_ratio < 2: return 0
+        return min(int(np.log2(pixel_ratio)), self.nbLevels() - 1)
+
+    def mean(self, k):
+        # image of level k (means of the blocks)
+        if k == 0: return self.image
+        total, count = self._level(k)[:2]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(count > 0, total / count, np.nan)
+
+    def range(self):
+        # (min, max) of the image, None if all NaN
+        if self.image is None: return None
+        _, count, mini, maxi = self._level(self.nbLevels() - 1) if self.nbLevels() > 1 else self._stats(0)
+        if not np.any(count): return None
+        return np.nanmin(mini), np.nanmax(maxi)
+
+    def _level(self, k):
+        # [sum, count, min, max] of level k >= 1, built or brought up to date
+        for j in range(1, k + 1):
+            if j > len(self.levels):
+                shape = self._shape(j)
+                self.levels.append([np.zeros(shape), np.zeros(shape), np.full(shape, np.nan), np.full(shape, np.nan)])
+                self.dirty.append([np.zeros(shape[0], dtype=bool), np.zeros(shape[1], dtype=bool)])
+                self._reduce(j, np.arange(shape[0]), False)
+                continue
+            rows, cols = self.dirty[j - 1]
+            if rows.any():
+                self._reduce(j, np.flatnonzero(rows), False)
+                rows[:] = False
+            if cols.any():
+                self._reduce(j, np.flatnonzero(cols), True)
+                cols[:] = False
+        return self.levels[k - 1]
+
+    def _shape(self, k):
+        return tuple(-(-n // 2**k) for n in self.image.shape)
+
+    def _stats(self, k, lines=slice(None), transpose=False):
+        # [sum, count, min, max] of the lines of level k (columns if transpose)
+        if k == 0:
+            values = (self.image.T if transpose else self.image)[lines]
+            valid = ~np.isnan(values)
+            return [np.where(valid, values, 0.), valid.astype(float), values, values]
+        return [(a.T if transpose else a)[lines] for a in self.levels[k - 1]]
+
+    def _reduce(self, k, lines, transpose):
+        # computes the lines of level k (columns if transpose) from their 2x2 blocks of level k - 1
+        nb_src = (self.image.shape[1] if transpose else self.image.shape[0]) if k == 1 \
+            else self.levels[k - 2][0].shape[1 if transpose else 0]
+        first = self._stats(k - 1, 2 * lines, transpose)
+        second = self._stats(k - 1, np.minimum(2 * lines + 1, nb_src - 1), transpose)
+        if (missing := 2 * lines + 1 >= nb_src).any():  # odd number of lines: last block partial
+            for a, fill in zip(second, [0., 0., np.nan, np.nan]):
+                a[missing] = fill
+        total, count = first[0] + second[0], first[1] + second[1]
+        mini, maxi = np.fmin(first[2], second[2]), np.fmax(first[3], second[3])
+        new = []
+        for a, fill, pair in [(total, 0., np.add), (count, 0., np.add), (mini, np.nan, np.fmin), (maxi, np.nan, np.fmax)]:
+            if a.shape[1] % 2:
+                a = np.concatenate([a, np.full((a.shape[0], 1), fill)], axis=1)
+            new.append(pair(a[:, 0::2], a[:, 1::2]))
+        for a, b in zip(self.levels[k - 1], new):
+            (a.T if transpose else a)[lines] = b
@@ -127,6 +127,21 @@ class Model:
         thread.value = value
         thread.start()
 
+    def setValuesNow(self, gui_devs, value):
+        # set all the devices at the same time (their set threads), returns once all are done
+        for gui_dev in gui_devs:
+            self.setValue(gui_dev, value)
+        for gui_dev in gui_devs:
+            gui_dev.set_thread.wait()
+
+    def stopSet(self, gui_dev):
+        # interrupt the ramp in progress of the device (whatever thread is setting it)
+        gui_dev.set_thread.stop()
+
+    def setValueNow(self, dev, value):
+        # set in the calling thread, returns once done (ramps included)
+        c.set(dev, value)
+
     def makeLogicalDevice(self, gui_dev, gui_dev_kwargs, instrument):
         # kwargs = {'scale':{kw scale}, 'ramp':{kw ramp}, 'limit':{kw limit}}
         # (not dict but OrederedDict)
@@ -98,6 +98,36 @@ class Popup:
         self._popErrorW("Warning",
             "Retroaction loop is missing a device.")
 
+    def resumeSweepError(self, exception):
+        self._popErrorC("Error",
+            "Cannot resume the sweep: " + str(exception),
+            self._excToStr(exception))
+
+    def resumeSweepFinished(self):
+        self._popErrorI("Information", "This sweep is already finished.")
+
+    def queueEmpty(self):
+        self._popErrorI("Information", "No pending sweep in the queue.")
+
+    def queuePreSetError(self, exception):
+        self._popErrorW("Warning",
+            "Cannot read the pre-sweep values: " + str(exception))
+
+    def virtualGatesError(self, exception):
+        self._popErrorW("Warning",
+            "Virtual gates: " + str(exception))
+
+    def traceNoOutputDevice(self):
+        self._popErrorW("Warning", "A time trace needs at least one out device.")
+
+    def bufferedLineError(self, exception):
+        self._popErrorW("Warning",
+            "Buffered fast axis: " + str(exception))
+
+    def multiNeedsNativeEngine(self, names):
+        self._popErrorW("Warning",
+            "Multi output devices need the native engine: " + ", ".join(names))
+
 
     # -- YES/NO --
 
@@ -0,0 +1,135 @@
+from pyHegel import instruments_base
+import time
+import numpy as np
+
+
+# Simulated instrument, to use HegelLab (sweeps, monitor, display) without hardware.
+# Load it like any instrument, with ph_class "Simulated.SimulatedInstrument"
+# and its options in the "kwargs" of the json entry (see default_instruments.json).
+#
+# Every get/set of the sources and signals spends a simulated time:
+#   latency + a random jitter (jitter_model: normal, uniform or exponential, of scale jitter)
+# The signals are a smooth function of the sources plus noise:
+#   noise_model white: gaussian of std noise, random_walk: the offset drifts by noise at every get.
+# latency, jitter, noise and the models are devices too, so they can be changed while running.
+# Buffered line (driver "Drivers.SimulatedDriver"): a whole line of a source is measured
+# by one call (armLine, triggerLine, fetchLine), like an instrument with a data buffer.
+
+
+class SimulatedSource(instruments_base.MemoryDevice):
+    # settable and gettable, costs the simulated latency
+
+    def _getdev(self, **kwarg):
+        self.instr._wait()
+        return super()._getdev(**kwarg)
+
+    def _setdev(self, val, **kwarg):
+        self.instr._wait()
+        super()._setdev(val, **kwarg)
+
+
+class SimulatedSignal(instruments_base.BaseDevice):
+    # gettable only, nb_values > 1 returns an array (multi device)
+
+    def __init__(self, nb_values=1, **kwarg):
+        if nb_values > 1:
+            kwarg['multi'] = [f"ch{i}" for i in range(nb_values)]
+        super().__init__(**kwarg)
+        self._getdev_p = True
+        self.nb_values = nb_values
+
+    def _getdev(self, **kwarg):
+        self.instr._wait()
+        values = self.instr._measure(self.nb_values)
+        return values if self.nb_values > 1 else values[0]
+
+
+class SimulatedInstrument(instruments_base.BaseInstrument):
+
+    def __init__(self, nb_sources=2, multi=3, latency=0., jitter=0., jitter_model='normal',
+                 noise=0., noise_model='white', period=1., seed=None):
+        # nb_sources: number of settable devices (source1, source2, ...)
+        # multi: number of values returned by readval_multi
+        # period: of the simulated signal, in units of the sources
+        self._nb_sources = nb_sources
+        self._nb_multi = multi
+        self._init_vals = dict(latency=latency, jitter=jitter, jitter_model=jitter_model,
+                               noise=noise, noise_model=noise_model, period=period)
+        self._rng = np.random.default_rng(seed)
+        self._drift = 0.
+        self._line = None  # (source, values) armed
+        super().__init__()
+
+    def _wait(self):
+        # time spent by one call to the instrument
+        delay = self.latency.getcache()
+        jitter = self.jitter.getcache()
+        if jitter > 0:
+            model = self.jitter_model.getcache()
+            if model == 'uniform':
+                delay += self._rng.uniform(0., jitter)
+            elif model == 'exponential':
+                delay += self._rng.exponential(jitter)  # long tail
+            else:
+                delay += self._rng.normal(0., jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _sources(self):
+        return [getattr(self, f"source{i+1}") for i in range(self._nb_sources)]
+
+    def _measure(self, nb_values, sources=None):
+        if sources is None:
+            sources = [source.getcache() for source in self._sources()]
+        phase = sum(2 * np.pi * val / (self.period.getcache() * (i + 1)) for i, val in enumerate(sources))
+        values = np.sin(phase + np.arange(nb_values) * np.pi / 2)
+        noise = self.noise.getcache()
+        if noise > 0:
+            if self.noise_model.getcache() == 'random_walk':
+                self._drift += self._rng.normal(0., noise)
+                values = values + self._drift
+            else:
+                values = values + self._rng.normal(0., noise, nb_values)
+        return values
+
+    def armLine(self, source, values):
+        # source (None: the sources do not move) goes through values during the next line
+        self._line = (source, np.asarray(values, dtype=float))
+
+    def triggerLine(self):
+        if self._line is None:
+            raise RuntimeError("triggerLine: no line armed.")
+
+    def fetchLine(self, signals):
+        # one array of the line per signal (2D for the multi ones), the whole line costs one call
+        source, values = self._line
+        self._line = None
+        self._wait()
+        sources = [dev.getcache() for dev in self._sources()]
+        k = self._sources().index(source) if source is not None else None
+        lines = {dev: [] for dev in signals}
+        for val in values:
+            if k is not None: sources[k] = val
+            for dev in signals:
+                measured = self._measure(dev.nb_values, sources)
+                lines[dev].append(measured if dev.nb_values > 1 else measured[0])
+        if k is not None:
+            source.setcache(values[-1])
+        return [np.array(lines[dev]) for dev in signals]
+
+    def _current_config(self, dev_obj=None, options={}):
+        return self._conf_helper('latency', 'jitter', 'jitter_model', 'noise', 'noise_model', 'period', options)
+
+    def _create_devs(self):
+        init = self._init_vals
+        self.latency = instruments_base.MemoryDevice(init['latency'], min=0., doc='time of every call (s)')
+        self.jitter = instruments_base.MemoryDevice(init['jitter'], min=0., doc='scale of the random extra time (s)')
+        self.jitter_model = instruments_base.MemoryDevice(init['jitter_model'], choices=['normal', 'uniform', 'exponential'])
+        self.noise = instruments_base.MemoryDevice(init['noise'], min=0.)
+        self.noise_model = instruments_base.MemoryDevice(init['noise_model'], choices=['white', 'random_walk'])
+        self.period = instruments_base.MemoryDevice(init['period'])
+        for i in range(self._nb_sources):
+            setattr(self, f"source{i+1}", SimulatedSource(0.))
+        self.readval = SimulatedSignal(doc='simulated signal, function of the sources')
+        self.readval_multi = SimulatedSignal(self._nb_multi, doc='same as readval, with several phases')
+        super()._create_devs()
@@ -0,0 +1,465 @@
+from PyQt5.QtCore import QThread
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import queue
+import time
+import numpy as np
+
+from src.GuiInstrument import multiShape, multiNames
+from src.SweepIdxIter import IdxIter
+from src.SweepFile import TextSweepWriter, BinarySweepWriter, flatRow
+from src.SweepTimings import SweepTimings
+
+# phases of SweepTimings
+SET, WAIT, READ, PUBLISH, WRITE, POINT = [SweepTimings.PHASES.index(name) for name in
+                                          ["set", "wait", "read", "publish", "write", "point"]]
+
+
+def devKw(dev):
+    # devices with extra args are (dev, {kwargs}) tuples
+    if isinstance(dev, tuple):
+        return dev[0], dev[1]
+    return dev, {}
+
+
+def devName(dev):
+    dev, kw = devKw(dev)
+    name = dev.getfullname()
+    if kw: name += str(kw)
+    return name
+
+
+def columnNames(dev, multi=None):
+    # names of the columns of a device in the sweep files, one per value of a multi device
+    # multi: of the pyHegel format (list of names, tuple shape, None or False for one val only)
+    name = devName(dev)
+    if (names := multiNames(multi)) is not None:
+        return [f"{name}.{channel}" for channel in names]
+    if shape := multiShape(multi):
+        return [f"{name}[{i}]" for i in range(int(np.prod(shape)))]
+    return [name]
+
+
+class WriterThread(QThread):
+    # writes the rows of the sweep file in the background,
+    # so the file I/O (slow network share...) does not stall the instrument loop.
+    # The queue is bounded: the sweep only waits when it is full.
+    # Rows waiting in the queue are written together, and the file
+    # is synced to disk every fsync_interval seconds.
+
+    def __init__(self, writer, maxsize=10000, fsync_interval=1., max_batch=1000):
+        super().__init__()
+        self.writer = writer
+        self.queue = queue.Queue(maxsize)
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self.exception = None
+        self.write_latency = 0.  # duration of the last write (s)
+        self.nb_written = 0
+        self.on_sync = None  # fn(nb_written, done), called after every sync
+
+    def put(self, row):
+        # blocks if the queue is full
+        if self.exception is not None:
+            raise self.exception
+        self.queue.put(row)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def close(self):
+        # write the remaining rows and close the file
+        self.queue.put(None)
+        self.wait()
+        if self.exception is not None:
+            raise self.exception
+
+    def _getBatch(self):
+        rows = [self.queue.get()]
+        while rows[-1] is not None and len(rows) < self.max_batch:
+            try:
+                rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def run(self):
+        last_sync = time.perf_counter()
+        done = False
+        try:
+            while not done:
+                rows = self._getBatch()
+                if rows[-1] is None:
+                    done = True
+                    rows.pop()
+                if rows:
+                    t0 = time.perf_counter()
+                    self.writer.writeRows(rows)
+                    self.write_latency = time.perf_counter() - t0
+                    self.nb_written += len(rows)
+                if done or time.perf_counter() - last_sync > self.fsync_interval:
+                    self.writer.sync()
+                    last_sync = time.perf_counter()
+                    if self.on_sync is not None:
+                        self.on_sync(self.nb_written, done)
+        except Exception as e:
+            self.exception = e
+            # keep emptying the queue so the sweep never blocks on it
+            while not done:
+                done = self.queue.get() is None
+        finally:
+            self.writer.close()
+
+
+class ReadPool:
+    # reads the out devices with one worker per instrument:
+    # devices of the same instrument are read one after the other,
+    # devices of different instruments are read at the same time.
+    # The values are returned in the order of out_devs.
+
+    def __init__(self, out_devs, out_instr):
+        # out_instr: for every out dev, the instrument it belongs to (any hashable)
+        groups = {}
+        for i, (dev, instr) in enumerate(zip(out_devs, out_instr)):
+            groups.setdefault(instr, []).append((i, dev))
+        self.groups = list(groups.values())
+        self.nb_devs = len(out_devs)
+        # the first group is read by the sweep thread itself
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(self.groups) - 1))
+
+    @staticmethod
+    def _readGroup(group, read_vals, durations):
+        for i, dev in group:
+            dev, kw = devKw(dev)
+            t0 = time.perf_counter()
+            read_vals[i] = dev.get(**kw)
+            durations[i] = time.perf_counter() - t0
+
+    def read(self, durations=None):
+        # durations: filled with the get time of every device
+        read_vals = [None] * self.nb_devs
+        if durations is None: durations = [None] * self.nb_devs
+        if not self.groups: return read_vals
+        futures = [self.executor.submit(self._readGroup, group, read_vals, durations) for group in self.groups[1:]]
+        try:
+            self._readGroup(self.groups[0], read_vals, durations)
+        finally:
+            for future in futures:
+                future.result()  # wait, and raise the exception of the worker if any
+        return read_vals
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class BufferedLine:
+    # buffered fast axis: the instruments take a whole line of the fastest swept device
+    # in one hardware-timed burst, with the arm/trigger/fetch of their driver (see Drivers.Default).
+    # parts: [(driver, ph_instr, fast_dev, out_idx), ...], one per instrument of the line
+    #   fast_dev: the fastest swept device (base device) if it is one of the instrument, else None
+    #   out_idx: indexes of the out devices of the instrument in out_devs (base devices)
+    # fast_factor, out_factors: scale factors of the logical devices (raw = value * factor)
+    # The instrument of the fast device is triggered last, once the others wait for it.
+
+    def __init__(self, parts, out_devs, fast_factor=1., out_factors=None):
+        self.parts = sorted(parts, key=lambda part: part[2] is not None)
+        self.out_devs = list(out_devs)
+        self.fast_factor = fast_factor
+        self.out_factors = out_factors if out_factors is not None else [1.] * len(self.out_devs)
+
+    def run(self, values):
+        # values: of the fast device along the line
+        # return one array of len(values) values per out device
+        outs = [[self.out_devs[j] for j in out_idx] for _, _, _, out_idx in self.parts]
+        for (driver, instr, fast_dev, _), devs in zip(self.parts, outs):
+            driver.arm(instr, fast_dev, np.asarray(values) * self.fast_factor, devs)
+        for driver, instr, _, _ in self.parts:
+            driver.trigger(instr)
+        read_vals = [None] * len(self.out_devs)
+        for (driver, instr, _, out_idx), devs in zip(self.parts, outs):
+            for j, array in zip(out_idx, driver.fetch(instr, devs)):
+                array = np.asarray(array, dtype=float)
+                if len(array) != len(values):
+                    raise ValueError(f"{devName(self.out_devs[j])}: {len(array)} values fetched for a line of {len(values)}.")
+                read_vals[j] = array / self.out_factors[j]
+        return read_vals
+
+
+class NativeSweep:
+    # HegelLab-native alternative to pyHegel.commands.sweep_multi.
+    # Takes the same kwargs as sweep_multi (the ones used by HegelLab),
+    # and keeps the loop_control pause/abort semantics.
+    # On abort the waits end within 10 ms and no other device is set
+    # (the ramp in progress is stopped by HegelLab.abortSweep).
+    # The loop is pipelined: once the out devices are read, the next point
+    # is set right away and the file writing (WriterThread) and the
+    # exec_after (gui publishing) are done while the devices settle.
+    # With parallel_read, the out devices of different instruments
+    # (out_instr) are read at the same time (ReadPool).
+    # file_format: "txt" (TextSweepWriter) or "npy" (BinarySweepWriter, which
+    # also stores log_vals and comment separately).
+    # timings: a SweepTimings filled with the duration of every phase of every point.
+    # out_multi: multi of the out devices (GuiDevice.multi), for the column names.
+    # buffered: a BufferedLine, the fastest device is then taken a whole line at a time
+    #   (_runBuffered), exec_after gets the line (nb_points values per out device).
+
+    def __init__(self, dev, start, stop, npts, out, filename, extra_conf=None,
+                 beforewait=0.02, updown=False, exec_before=None, exec_after=None,
+                 loop_control=None, parallel_read=False, out_instr=None,
+                 file_format="txt", log_vals=None, comment="",
+                 write_queue_size=10000, fsync_interval=1.,
+                 journal=None, journal_interval=30., resume=None, timings=None, buffered=None,
+                 out_multi=None, **kwargs):
+        self.devs = list(dev)
+        self.out_devs = list(out)
+        self.out_multi = list(out_multi) if out_multi is not None else [None] * len(self.out_devs)
+        self.filename = filename
+        self.extra_conf = list(extra_conf) if extra_conf is not None else []
+        self.file_format = file_format
+        self.log_vals = dict(log_vals) if log_vals is not None else {}
+        self.comment = comment
+        self.write_queue_size = write_queue_size
+        self.fsync_interval = fsync_interval
+        # checkpoint journal (see _writeJournal), and where to resume from
+        self.journal = journal  # info given by HegelLab (json-able dict) or None
+        self.journal_interval = journal_interval
+        self.last_journal = time.perf_counter()
+        self.resume = resume  # dict(cursor=, file_offset=) or None
+        self.start_cursor = resume["cursor"] if resume is not None else 0
+        self.writer = None
+        self.start, self.stop = list(start), list(stop)
+        self.beforewait = beforewait
+        self.exec_before = exec_before
+        self.exec_after = exec_after
+        self.loop_control = loop_control
+        self.timings = timings
+        self.buffered = buffered
+
+        self.shape = tuple(npts)
+        # values sorted like the live view arrays (index 0 is the smallest value),
+        # the visiting order (IdxIter) starts from the end for reversed devices.
+        self.sweep_vals = [np.linspace(min(sta, sto), max(sta, sto), n) for sta, sto, n in zip(start, stop, npts)]
+        reverse = [sta > sto for sta, sto in zip(start, stop)]
+        self.table = IdxIter(self.shape, reverse, updown).table
+        self.last_idx = None
+        self.set_vals = [None] * len(self.devs)
+        self.read_pool = None
+        if parallel_read:
+            out_instr = out_instr if out_instr is not None else list(range(len(self.out_devs)))
+            self.read_pool = ReadPool(self.out_devs, out_instr)
+
+    # -- loop control --
+
+    def _aborted(self):
+        return self.loop_control is not None and self.loop_control.abort_enabled
+
+    def _paused(self):
+        return self.loop_control is not None and self.loop_control.pause_enabled
+
+    def _checkLoopControl(self):
+        # block while paused, return False on abort
+        while self._paused() and not self._aborted():
+            time.sleep(0.05)
+        return not self._aborted()
+
+    def _waitUntil(self, t_end):
+        # interruptible wait
+        while (remaining := t_end - time.perf_counter()) > 0 and not self._aborted():
+            time.sleep(min(remaining, 0.01))
+
+    # -- point --
+
+    def _makeDatas(self, i):
+        # same keys as the pyHegel datas dict used by HegelLab
+        return dict(iter_part=i + 1, iter_total=len(self.table),
+                    set_vals=list(self.set_vals), read_vals=None)
+
+    def _timePhase(self, i, phase, t0):
+        # store the duration of phase for point i, return the time now
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings.setPhase(i, phase, now - t0)
+        return now
+
+    def _timePoint(self, i, t_loop, last):
+        # duration of point i: the turn of the loop, with the set of point i
+        # instead of the set of point i+1 (pipelined). The sum is the sweep duration.
+        now = time.perf_counter()
+        if self.timings is not None:
+            set_next = self.timings.getPhase(i + 1, SET) if not last else 0.
+            self.timings.setPhase(i, POINT, now - t_loop + self.timings.getPhase(i, SET) - set_next)
+        return now
+
+    def _timeLine(self, first, nb, phase, t0):
+        # same as _timePhase for a whole line: shared by its nb points
+        now = time.perf_counter()
+        if self.timings is not None:
+            self.timings.setPhase(first, phase, (now - t0) / nb, nb)
+        return now
+
+    def _setPoint(self, i):
+        # set the devices whose value changed, return the time of the set
+        t_start = time.perf_counter()
+        idx = np.unravel_index(self.table[i], self.shape)
+        for k, (dev, vals) in enumerate(zip(self.devs, self.sweep_vals)):
+            if self.last_idx is not None and self.last_idx[k] == idx[k]:
+                continue
+            if self._aborted(): return time.perf_counter()  # do not start the next ramp
+            dev, kw = devKw(dev)
+            self.set_vals[k] = vals[idx[k]]
+            t0 = time.perf_counter()
+            dev.set(self.set_vals[k], **kw)
+            if self.timings is not None:
+                self.timings.setDevice(k, time.perf_counter() - t0)
+        self.last_idx = idx
+        if self.exec_before is not None:
+            self.exec_before(self._makeDatas(i))
+        return self._timePhase(i, SET, t_start)
+
+    def _readOut(self, i):
+        durations = [None] * len(self.out_devs)
+        if self.read_pool is not None:
+            read_vals = self.read_pool.read(durations)
+        else:
+            read_vals = []
+            for j, dev in enumerate(self.out_devs):
+                dev, kw = devKw(dev)
+                t0 = time.perf_counter()
+                read_vals.append(dev.get(**kw))
+                durations[j] = time.perf_counter() - t0
+        if self.timings is not None:
+            for j, duration in enumerate(durations):
+                self.timings.setDevice(len(self.devs) + j, duration)
+        return read_vals
+
+    # -- sweep --
+
+    def _makeWriter(self):
+        columns = [devName(dev) for dev in self.devs]
+        for dev, multi in zip(self.out_devs, self.out_multi):
+            columns += columnNames(dev, multi)
+        resume = self.resume if self.resume is not None else {}
+        if self.file_format == "npy":
+            sweep_axes = [dict(name=devName(dev), start=float(sta), stop=float(sto), npts=int(n))
+                          for dev, sta, sto, n in zip(self.devs, self.start, self.stop, self.shape)]
+            return BinarySweepWriter(self.filename, columns, self.extra_conf,
+                                     nb_points=len(self.table), sweep_axes=sweep_axes,
+                                     log_vals=self.log_vals, comment=self.comment,
+                                     resume_cursor=resume.get("cursor"))
+        return TextSweepWriter(self.filename, columns, self.extra_conf,
+                               resume_offset=resume.get("file_offset"))
+
+    # -- journal --
+
+    def _onSync(self, nb_written, done):
+        # called by the writer thread once rows are on disk
+        now = time.perf_counter()
+        if not done and now - self.last_journal < self.journal_interval: return
+        self.last_journal = now
+        self._writeJournal(self.start_cursor + nb_written)
+
+    def _writeJournal(self, cursor):
+        # name.journal.json: info given by HegelLab (devices, sweep parameters...),
+        #   the data file, cursor: the number of points already on disk, and file_offset:
+        #   where they end in the file. Small: the live values are read back from the
+        #   data file on resume (readSweepRows).
+        base = os.path.splitext(self.writer.filename)[0]
+        journal = dict(self.journal,
+                       filename=self.writer.filename,
+                       file_format=self.file_format,
+                       cursor=int(cursor),
+                       file_offset=self.writer.tell(),
+                       finished=cursor == len(self.table),
+                       time=time.strftime("%Y-%m-%d %H:%M:%S"))
+        with open(base + ".journal.tmp.json", "w") as f:
+            json.dump(journal, f, indent=2)
+        os.replace(base + ".journal.tmp.json", base + ".journal.json")
+
+    def run(self):
+        # loop_control is reset by the caller (SweepThread.run), an abort before the start stops the sweep
+        nb_points = len(self.table)
+        self.writer = self._makeWriter()
+        writer = WriterThread(self.writer, self.write_queue_size, self.fsync_interval)
+        if self.journal is not None:
+            writer.on_sync = self._onSync
+        writer.start()
+        try:
+            if self.buffered is not None:
+                return self._runBuffered(writer)
+            if not self._checkLoopControl(): return
+            t_loop = t_set = self._setPoint(self.start_cursor)
+            for i in range(self.start_cursor, nb_points):
+                self._waitUntil(t_set + self.beforewait)
+                t0 = self._timePhase(i, WAIT, t_set)
+                if self._aborted(): break
+                datas = self._makeDatas(i)
+                datas["read_vals"] = self._readOut(i)
+                t0 = self._timePhase(i, READ, t0)
+
+                # set the next point before the bookkeeping of this one
+                last = i + 1 == nb_points
+                pipelined = not last and not self._paused() and not self._aborted()
+                if pipelined:
+                    t0 = t_set = self._setPoint(i + 1)
+
+                # exec_after first: the live values of a row are filled
+                # before the row can be journaled as done
+                datas["write_queue"] = writer.depth()
+                datas["write_latency"] = writer.write_latency
+                datas["timings"] = self.timings
+                if self.exec_after is not None:
+                    self.exec_after(datas)
+                t0 = self._timePhase(i, PUBLISH, t0)
+                writer.put(flatRow(datas["set_vals"] + datas["read_vals"]))
+                self._timePhase(i, WRITE, t0)
+
+                if not pipelined and not last:
+                    t_pause = time.perf_counter()
+                    if not self._checkLoopControl(): break
+                    t_loop += time.perf_counter() - t_pause  # pauses are not part of the point
+                    t_set = self._setPoint(i + 1)
+                t_loop = self._timePoint(i, t_loop, last)
+        finally:
+            if self.read_pool is not None:
+                self.read_pool.close()
+            writer.close()
+
+    def _runBuffered(self, writer):
+        # buffered fast axis: the fastest device is not set point by point,
+        # every line is armed, triggered and fetched at once (self.buffered),
+        # the other devices are set at the beginning of the line. The fastest one is set to the
+        # first value of the line too, through its logical device: the move from the end of the
+        # previous line is ramped and limited like a usual set.
+        # Pause and abort are taken into account between lines.
+        fast = len(self.devs) - 1
+        nb, nb_points = self.shape[fast], len(self.table)
+        for first in range(self.start_cursor - self.start_cursor % nb, nb_points, nb):
+            if not self._checkLoopControl(): break
+            t_line = time.perf_counter()
+            t_set = self._setPoint(first)
+            t0 = self._timeLine(first, nb, SET, t_line)
+            self._waitUntil(t_set + self.beforewait)
+            if self._aborted(): break
+            t0 = self._timeLine(first, nb, WAIT, t0)
+            values = self.sweep_vals[fast][np.unravel_index(self.table[first:first + nb], self.shape)[fast]]
+            read_vals = self.buffered.run(values)
+            self.last_idx = tuple(self.last_idx[:fast]) + (None,)  # the line ends elsewhere: set again next line
+            t0 = self._timeLine(first, nb, READ, t0)
+
+            # the points of the line already done (resumed sweep) are not published again
+            skip = max(self.start_cursor - first, 0)
+            self.set_vals[fast] = values[-1]
+            datas = self._makeDatas(first + nb - 1)
+            datas["read_vals"] = [vals[skip:] for vals in read_vals]
+            datas["nb_points"] = nb - skip
+            datas["write_queue"] = writer.depth()
+            datas["write_latency"] = writer.write_latency
+            datas["timings"] = self.timings
+            if self.exec_after is not None:
+                self.exec_after(datas)
+            t0 = self._timeLine(first, nb, PUBLISH, t0)
+            for j in range(skip, nb):
+                writer.put(flatRow(self.set_vals[:fast] + [values[j]] + [vals[j] for vals in read_vals]))
+            t0 = self._timeLine(first, nb, WRITE, t0)
+            self._timeLine(first, nb, POINT, t_line)
@@ -0,0 +1,113 @@
+import numpy as np
+
+
+class EtaModel:
+    # Remaining time of a sweep, as the sum of the cost of its remaining points.
+    # A point is of level k when axis k (0: slowest swept device) is the slowest
+    # axis to move for it: the faster axes go back to their start (line return),
+    # except with alternate. The last level is the usual step of the fastest axis.
+    # The cost of a level is
+    #   before any measure: beforewait + the ramp times from the ramp rates (prior),
+    #     the levels not measured yet get the measured read/overhead of the fastest one.
+    #   once measured: an exponential moving average of its point times (SweepTimings),
+    #     the point times do not include the pauses.
+
+    ALPHA_STEP = 0.05  # smoothing of the fastest level (many points)
+    ALPHA_LINE = 0.3  # smoothing of the other levels (few points)
+
+    def __init__(self, sweeps, alternate=False, beforewait=0., ramp_rates=None):
+        # sweeps: [[start, stop, npts], ...] of the swept devices, the slowest first
+        # ramp_rates: rate of every swept device in sweep units/s (None: no ramp)
+        self.shape = [int(sweep[2]) for sweep in sweeps]
+        self.nb_points = int(np.prod(self.shape))
+        # a point of level <= k every strides[k] points
+        self.strides = [int(np.prod(self.shape[k+1:])) for k in range(len(self.shape))]
+        self.prior = self._priorCosts(sweeps, alternate, beforewait, ramp_rates)
+        self.cost = [None] * len(self.shape)  # measured costs
+        self.cursor = 1  # next point to take into account (the first one has no known start)
+
+    @classmethod
+    def fromGuiDevices(cls, gui_sw_devs, alternate=False, beforewait=0.):
+        return cls([gui_dev.sweep for gui_dev in gui_sw_devs], alternate, beforewait, cls.rampRates(gui_sw_devs))
+
+    @staticmethod
+    def rampRates(gui_sw_devs):
+        # ramp rate from the logical device, in sweep units (scale factor applied)
+        ramp_rates = []
+        for gui_dev in gui_sw_devs:
+            rate = gui_dev.logical_kwargs['ramp'].get('rate')
+            factor = gui_dev.logical_kwargs['scale'].get('factor', 1.)
+            ramp_rates.append(abs(rate / factor) if rate else None)
+        return ramp_rates
+
+    @staticmethod
+    def _priorCosts(sweeps, alternate, beforewait, ramp_rates):
+        rates = ramp_rates if ramp_rates is not None else [None] * len(sweeps)
+        def rampTime(k, distance):
+            return abs(distance) / rates[k] if rates[k] else 0.
+        costs = []
+        for k, (start, stop, npts) in enumerate(sweeps):
+            step = (stop - start) / (npts - 1) if npts > 1 else 0.
+            cost = beforewait + rampTime(k, step)
+            if not alternate:
+                # the faster devices are set one after the other back to their start
+                cost += sum(rampTime(j, sweeps[j][1] - sweeps[j][0]) for j in range(k + 1, len(sweeps)))
+            costs.append(cost)
+        return costs
+
+    def _levels(self, rows):
+        # level of every point in rows (array of point indexes)
+        levels = np.full(len(rows), len(self.shape) - 1)
+        for k in reversed(range(len(self.shape) - 1)):
+            levels[rows % self.strides[k] == 0] = k
+        return levels
+
+    def _counts(self, first):
+        # number of points of every level from point first to the end
+        last = self.nb_points - 1
+        multiples = [last // stride - (first - 1) // stride for stride in self.strides]
+        return [multiples[0]] + [multiples[k] - multiples[k-1] for k in range(1, len(multiples))]
+
+    def update(self, timings, cursor):
+        # take into account the points measured up to cursor (number of points done).
+        # The point time of the last points can still be missing (known with the set of the next
+        # point): only up to the last point with a time, the next ones are taken at the next update.
+        cursor = min(cursor, self.nb_points)
+        if cursor <= self.cursor: return
+        rows = np.arange(self.cursor, cursor)
+        times = timings.recent(rows, timings.phase("point"))
+        measured = np.isfinite(times)
+        if not measured.any(): return
+        last = np.flatnonzero(measured)[-1] + 1
+        rows, times, measured = rows[:last], times[:last], measured[:last]
+        self.cursor = int(rows[-1]) + 1
+        levels = self._levels(rows)
+        fastest = len(self.shape) - 1
+        for k in range(len(self.shape)):
+            values = times[measured & (levels == k)]
+            if len(values) == 0: continue
+            if self.cost[k] is None:
+                self.cost[k] = float(values.mean())
+                continue
+            alpha = self.ALPHA_STEP if k == fastest else self.ALPHA_LINE
+            weight = 1 - (1 - alpha)**len(values)  # as len(values) updates with the mean
+            self.cost[k] += weight * (float(values.mean()) - self.cost[k])
+
+    def levelCosts(self):
+        # cost of every level, measured or estimated
+        fastest = len(self.shape) - 1
+        extra = 0.  # measured time not in the prior (reads, overhead...)
+        if self.cost[fastest] is not None:
+            extra = self.cost[fastest] - self.prior[fastest]
+        return [cost if cost is not None else prior + extra
+                for cost, prior in zip(self.cost, self.prior)]
+
+    def remaining(self, cursor=None):
+        # remaining time (s) from point cursor (default: the points already measured)
+        cursor = self.cursor if cursor is None else cursor
+        if cursor >= self.nb_points: return 0.
+        return sum(n * cost for n, cost in zip(self._counts(cursor), self.levelCosts()))
+
+    def total(self):
+        # estimated duration of the whole sweep
+        return self.remaining(0)
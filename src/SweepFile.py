@@ -0,0 +1,171 @@
+import json
+import os
+import time
+import numpy as np
+
+
+def expandFilename(filename):
+    # %t is replaced by the date and time, like pyHegel does
+    return filename.replace("%t", time.strftime("%Y%m%d-%H%M%S"))
+
+
+def flatRow(values):
+    # one line of the file: every value as float, arrays are flattened
+    row = []
+    for val in values:
+        try:
+            row.extend(np.ravel(np.asarray(val, dtype=float)).tolist())
+        except (TypeError, ValueError):
+            row.append(float("nan"))
+    return row
+
+
+class TextSweepWriter:
+    # Text file in the same spirit as the pyHegel sweep files:
+    # '#' comment lines, a '#' line with the column names, then one line per point.
+
+    def __init__(self, filename, columns, comments=None, resume_offset=None):
+        # resume_offset: continue an existing file, dropping what is after this offset
+        self.filename = expandFilename(filename)
+        if resume_offset is not None:
+            self.file = open(self.filename, "r+")
+            self.file.truncate(resume_offset)
+            self.file.seek(resume_offset)
+            return
+        self.file = open(self.filename, "w")
+        for comment in comments or []:
+            for line in str(comment).splitlines():
+                self.file.write("#" + line + "\n")
+        self.file.write("#" + "\t".join(columns) + "\n")
+
+    def writeRows(self, rows):
+        lines = ["\t".join(map(repr, row)) + "\n" for row in rows]
+        self.file.writelines(lines)
+
+    def flush(self):
+        self.file.flush()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def tell(self):
+        # position of the end of the last written row
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class BinarySweepWriter:
+    # Binary sweep file, written point by point and readable during the sweep:
+    #   name.npy : (nb_points, nb_columns) float64 array (memmap, NaN when not measured)
+    #   name.json: header, with 'filled' the number of rows already on disk
+    # The rows are flushed to disk by chunks of chunk_size rows.
+
+    def __init__(self, filename, columns, comments=None, nb_points=0, sweep_axes=None,
+                 log_vals=None, comment="", chunk_size=1000, resume_cursor=None):
+        # resume_cursor: continue an existing file from this row
+        base = os.path.splitext(expandFilename(filename))[0]
+        self.filename = base + ".npy"
+        self.header_filename = base + ".json"
+        self.chunk_size = chunk_size
+        if resume_cursor is not None:
+            self._resume(resume_cursor)
+            return
+        self.header = dict(columns=list(columns),
+                           sweep_axes=list(sweep_axes or []),  # [{name, start, stop, npts}, ...]
+                           log_devices={name: str(val) for name, val in (log_vals or {}).items()},
+                           comment=comment,
+                           extra_conf=[str(c) for c in comments or []],
+                           nb_points=int(nb_points),
+                           filled=0,
+                           finished=False)
+        self.data = None  # allocated with the first row (its length gives the number of columns)
+        self.filled = 0
+        self._writeHeader()
+
+    def _resume(self, cursor):
+        with open(self.header_filename) as f:
+            self.header = json.load(f)
+        self.header["filled"] = self.filled = cursor
+        self.header["finished"] = False
+        self.data = None
+        if os.path.exists(self.filename):
+            self.data = np.lib.format.open_memmap(self.filename, mode="r+")
+        self._writeHeader()
+
+    def tell(self):
+        return None
+
+    def _allocate(self, nb_columns):
+        self.data = np.lib.format.open_memmap(self.filename, mode="w+", dtype=np.float64,
+                                              shape=(self.header["nb_points"], nb_columns))
+        self.data[:] = np.nan
+
+    def _writeHeader(self):
+        # atomic, so a reader never sees a half written header
+        tmp = self.header_filename + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.header, f, indent=2)
+        os.replace(tmp, self.header_filename)
+
+    def writeRows(self, rows):
+        if self.data is None:
+            self._allocate(len(rows[0]))
+        start = self.filled
+        self.data[start:start + len(rows)] = rows
+        self.filled += len(rows)
+        if self.filled // self.chunk_size != start // self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.data is not None:
+            self.data.flush()
+        self.header["filled"] = self.filled
+        self._writeHeader()
+
+    def sync(self):
+        # memmap.flush syncs the data to disk
+        self.flush()
+
+    def close(self):
+        self.header["finished"] = True
+        self.flush()
+        self.data = None
+
+
+def loadBinarySweep(filename):
+    # return (data, header) of a binary sweep file, also while it is written.
+    # data only holds the rows already flushed to disk.
+    base = os.path.splitext(filename)[0]
+    with open(base + ".json") as f:
+        header = json.load(f)
+    if not os.path.exists(base + ".npy"):
+        return np.empty((0, len(header["columns"]))), header
+    data = np.load(base + ".npy", mmap_mode="r")
+    return data[:header["filled"]], header
+
+
+def readSweepRows(filename, file_format, nb_rows, file_offset=None, nb_columns=None):
+    # (nb_rows, nb_columns) array of the first nb_rows points of a sweep file,
+    # for a text file only the part before file_offset (its end when None).
+    # Rows missing or with another number of columns are NaN.
+    if file_format == "npy":
+        data, header = loadBinarySweep(filename)
+        nb_columns = len(header["columns"]) if nb_columns is None else nb_columns
+        rows = np.full((nb_rows, nb_columns), np.nan)
+        if data.shape[1] == nb_columns:
+            rows[:len(data[:nb_rows])] = data[:nb_rows]
+        return rows
+    with open(filename, "rb") as f:
+        text = f.read(file_offset if file_offset is not None else -1).decode()
+    lines = [line for line in text.splitlines() if line and not line.startswith("#")]
+    if nb_columns is None:
+        nb_columns = len(lines[0].split("\t")) if lines else 0
+    rows = np.full((nb_rows, nb_columns), np.nan)
+    good = [k for k, line in enumerate(lines[:nb_rows]) if line.count("\t") == nb_columns - 1]
+    if good and nb_columns:
+        values = "\t".join(lines[k] for k in good).split("\t")
+        rows[good] = np.array(values, dtype=float).reshape(len(good), nb_columns)
+    return rows
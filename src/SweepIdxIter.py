@@ -1,53 +1,80 @@
+import numpy as np
+
+
 class IdxIter:
-    # return custom indexes for filling an array in a certain way
-    # array = [ [a,b], [c,d], ... ]
-    # array[2,1] = c
+    # return custom indexes for filling an N-D array in the sweep order
+    # array.shape = (npts_dev1, npts_dev2, ..., npts_devN)
+    # the first swept device is the slowest axis, the last one the fastest.
+
+    # The whole visiting order is computed once at the beginning of the sweep
+    # (self.table, flat indexes of the array), so next() only moves a cursor.
+    # One IdxIter is shared by all the out devices of a sweep.
 
     # this is not an iterator btw, it just counts
 
-    def __init__(self, nb_cols, nb_rows, reverse_cols=False, reverse_rows=False, alternate=False):
-        # reverse_xxx is True if sweep start > sweep stop
-        self.nb_cols = nb_cols - 1
-        self.nb_rows = nb_rows - 1
-        self.reverse_cols = reverse_cols
-        self.reverse_rows = reverse_rows
+    def __init__(self, shape, reverse=None, alternate=False):
+        # shape: list of npts for every swept device
+        # reverse[k] is True if sweep start > sweep stop for device k
+        # alternate: when an axis reaches its end, it changes direction
+        #   instead of going back to its start (all axes but the first).
+        self.shape = tuple(shape)
+        self.reverse = list(reverse) if reverse is not None else [False] * len(self.shape)
         self.alternate = alternate
+        self.table = self._makeTable()
         self.reset()
 
+    def _makeTable(self):
+        # flat index (C order) of every point, in the sweep order
+        nb_points = int(np.prod(self.shape))
+        count = np.arange(nb_points, dtype=np.int64)
+        table = np.zeros(nb_points, dtype=np.int64)
+        stride = nb_points
+        for k, n in enumerate(self.shape):
+            stride //= n  # number of points for one step of axis k
+            idx = (count // stride) % n
+            flip = self.reverse[k]
+            if self.alternate and k > 0:
+                # axis k changes direction after each of its passes (n*stride points)
+                flip = ((count // (n * stride)) % 2 == 1) != flip
+            idx = np.where(flip, n - 1 - idx, idx)
+            table += idx * stride
+        return table
+
     def reset(self):
-        self.current_col = self.nb_cols if self.reverse_cols else 0
-        self.current_row = self.nb_rows if self.reverse_rows else 0
-
-    def next(self):
-        col, row = self.current_col, self.current_row
-        rev_col, rev_row = self.reverse_cols, self.reverse_rows
-        nb_rows = self.nb_rows
-        alternate = self.alternate
-
-        row = row - 1 if rev_row else row + 1
-
-        if row < 0:
-            if alternate:
-                row = 0
-                self.reverse_rows = not self.reverse_rows
-            else:
-                row = nb_rows
-            col = col - 1 if rev_col else col + 1
-
-        elif row > nb_rows:
-            if alternate:
-                row = nb_rows
-                self.reverse_rows = not self.reverse_rows
-            else:
-                row = 0
-            col = col - 1 if rev_col else col + 1
-
-        # if col < 0 or col > self.nb_cols:
-        # raise StopIteration
-
-        self.current_row, self.current_col = row, col
-        return col, row
+        self.cursor = 0
+
+    def next(self, nb=1):
+        self.cursor += nb
+
+    def currentFlat(self):
+        # flat index of the current point (to use on array.reshape(-1))
+        return self.table[self.cursor]
+
+    def currentFlats(self, nb):
+        # flat indexes of the nb points from the current one (a line of a buffered sweep)
+        return self.table[self.cursor:self.cursor + nb]
 
     def current(self):
-        tmp_col, tmp_row = self.current_col, self.current_row
-        return tmp_col, tmp_row
+        # N-D index of the current point (the last one once the sweep is over)
+        cursor = min(self.cursor, len(self.table) - 1)
+        return np.unravel_index(self.table[cursor], self.shape)
+
+
+def allocData(gui_out_devs, start, stop, npts, alternate):
+    # start, stop, npts are lists
+    # allocate data in out_devices for the live view.
+    # we allocate a N-D numpy array (one axis per swept device)
+    # for output devices and an "custom iterator" shared by all of them.
+    # Multi devices get their values as trailing axes (GuiDevice.multiShape),
+    # so one point is one contiguous row (GuiDevice.flatValues).
+
+    reverse = [sta > sto for sta, sto in zip(start, stop)]
+
+    if len(npts) == 1:
+        npts = npts + [1]  # not .append to preserve npts
+        reverse = reverse + [False]
+    sw_idx = IdxIter(npts, reverse, alternate)
+    for dev in gui_out_devs:
+        dev.values = np.full(list(npts) + list(dev.multiShape()), np.nan)
+        dev.sw_idx = sw_idx
+    return sw_idx
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from src.SweepEngine import devName
+
+LOG_TIMEOUT = 2.  # s, for every log device
+
+
+def readLogDevices(log_devs, log_instr, get_fn, timeout=LOG_TIMEOUT):
+    # Snapshot of the log devices at the beginning of a sweep.
+    # One thread per instrument: devices of the same instrument are read one after the other,
+    # devices of different instruments at the same time.
+    # A device not read after timeout is given up, with the ones of its instrument after it
+    # (the instrument is stuck), its thread is left behind (daemon) and cancelled:
+    # it does not read the devices after it, they would compete with the sweep for the instrument.
+    # log_instr: for every log dev, the instrument it belongs to (any hashable)
+    # get_fn(dev) -> value
+    # Return ({name: value}, {name: reason}) for the devices read and the ones not read.
+    groups = {}
+    for i, (dev, instr) in enumerate(zip(log_devs, log_instr)):
+        groups.setdefault(instr, []).append(i)
+    results = [None] * len(log_devs)  # ("ok", value) or ("error", exception)
+    started = [None] * len(log_devs)  # time of the beginning of the get
+
+    def readGroup(group, cancel):
+        for i in group:
+            if cancel.is_set(): return
+            started[i] = time.perf_counter()
+            try:
+                results[i] = ("ok", get_fn(log_devs[i]))
+            except Exception as e:
+                results[i] = ("error", e)
+
+    cancels = {}  # first index of a group: its threading.Event, set on timeout
+    for group in groups.values():
+        cancels[group[0]] = threading.Event()
+        threading.Thread(target=readGroup, args=(group, cancels[group[0]]), daemon=True).start()
+
+    failed = {}  # i: reason
+    pending = list(groups.values())
+    while pending:
+        time.sleep(0.005)
+        now = time.perf_counter()
+        still_pending = []
+        for group in pending:
+            todo = [i for i in group if results[i] is None]
+            if not todo: continue
+            i = todo[0]
+            if started[i] is not None and now - started[i] > timeout:
+                cancels[group[0]].set()
+                failed[i] = f"timeout (> {timeout:g} s)"
+                for j in todo[1:]:
+                    failed[j] = "not read (instrument stuck)"
+                continue
+            still_pending.append(group)
+        pending = still_pending
+
+    log_vals, log_errors = {}, {}
+    for i, dev in enumerate(log_devs):
+        try: name = devName(dev)
+        except Exception: name = str(dev)
+        if i in failed:
+            log_errors[name] = failed[i]
+        elif results[i][0] == "error":
+            log_errors[name] = f"error: {results[i][1]}"
+        else:
+            log_vals[name] = results[i][1]
+    return log_vals, log_errors
@@ -0,0 +1,45 @@
+import itertools
+
+from src.SweepEta import EtaModel
+
+
+# Order of the swept devices and sweep mode (raster or serpentine/alternate)
+# spending the least time in the ramps of the devices.
+# In raster mode, every time an axis steps, all the faster axes ramp back to their start:
+# the fastest axes should be the ones with the shortest line return (range / ramp rate).
+# In serpentine mode there is no line return, only the steps.
+# The ramp times are the prior of EtaModel (beforewait left out, it does not depend on the order).
+
+
+def rampTime(sweeps, ramp_rates, alternate):
+    # time (s) spent ramping from the first point to the end of the sweep
+    # sweeps: [[start, stop, npts], ...] the slowest first, ramp_rates: in sweep units/s (None: no ramp)
+    return EtaModel(sweeps, alternate, 0., ramp_rates).remaining(1)
+
+
+class SweepPlan:
+    # best order (indexes of the swept devices, the slowest first) and mode,
+    # with the ramp time of the current configuration to show the saving.
+
+    MAX_DEVICES = 6  # all the orders are tried (n! * 2)
+
+    def __init__(self, sweeps, ramp_rates, alternate=False):
+        self.current_time = rampTime(sweeps, ramp_rates, alternate)
+        self.order, self.alternate, self.time = list(range(len(sweeps))), alternate, self.current_time
+        orders = itertools.permutations(range(len(sweeps))) if len(sweeps) <= self.MAX_DEVICES else [self.order]
+        for order in orders:
+            for mode in (False, True):
+                time = rampTime([sweeps[i] for i in order], [ramp_rates[i] for i in order], mode)
+                if time < self.time - 1e-9:  # strictly better, the current configuration wins ties
+                    self.order, self.alternate, self.time = list(order), mode, time
+
+    @classmethod
+    def fromGuiDevices(cls, gui_sw_devs, alternate=False):
+        return cls([gui_dev.sweep for gui_dev in gui_sw_devs], EtaModel.rampRates(gui_sw_devs), alternate)
+
+    def saving(self):
+        # predicted time saved (s)
+        return self.current_time - self.time
+
+    def isCurrent(self):
+        return self.saving() <= 0.
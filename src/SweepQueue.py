@@ -0,0 +1,56 @@
+import json
+import os
+
+
+class SweepQueue:
+    # Sweep configurations run one after the other by the SweepThread,
+    # without going back to the gui between two sweeps.
+    # A configuration only holds json-able values (devices are [instr, dev] nicknames)
+    # and the queue is saved at every change, so it survives a restart of HegelLab.
+
+    # config keys:
+    #   name, state: "pending", "running", "done", "aborted", "interrupted" or "error: ..."
+    #   sw_devs: [[instr, dev, [start, stop, npts], raz], ...]
+    #   out_devs, log_devs: [[instr, dev], ...]
+    #   pre_set: [[instr, dev, value], ...], set (in this order) before the sweep
+    #   beforewait, updown, comment, folder, filename,
+    #   engine, parallel_read, buffered, file_format
+
+    def __init__(self, path="sweep_queue.json"):
+        self.path = path
+        self.configs = []
+
+    def load(self):
+        if not os.path.exists(self.path): return
+        with open(self.path) as f:
+            self.configs = json.load(f)
+        # a sweep running when HegelLab was closed is not restarted on its own
+        # (its data file is partly written, see the journal to resume it)
+        for config in self.configs:
+            if config["state"] == "running":
+                config["state"] = "interrupted"
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.configs, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def pending(self):
+        return [config for config in self.configs if config["state"] == "pending"]
+
+    def add(self, config):
+        config["state"] = "pending"
+        self.configs.append(config)
+
+    def remove(self, i):
+        self.configs.pop(i)
+
+    def move(self, i, delta):
+        # move config i of delta rows, return its new row
+        j = min(max(i + delta, 0), len(self.configs) - 1)
+        self.configs.insert(j, self.configs.pop(i))
+        return j
+
+    def setPending(self, i):
+        self.configs[i]["state"] = "pending"
@@ -1,7 +1,14 @@
 from PyQt5.QtCore import QThread, pyqtSignal
 import traceback
+import time
+import copy
+import numpy as np
 
 from pyHegel.commands import sweep_multi
+from src.SweepEngine import NativeSweep, devName
+from src.TimeTrace import TimeTrace
+from src.SweepTimings import SweepTimings
+from src.SweepEta import EtaModel
 
 
 class SweepStatus:
@@ -11,7 +18,109 @@ class SweepStatus:
         self.iteration = [None, None]  # i out of n
         self.sw_devs = None  # list of swept gui_devs
         self.out_devs = None  # list of out gui_devs
+        self.sw_idx = None  # IdxIter shared by the out gui_devs
         self.datas = None  # full dict of datas from the sweep
+        self.nb_merged = 0  # number of points acquired since the previous emit
+        self.timings = None  # SweepTimings of the sweep
+        self.eta = None  # EtaModel of the sweep, updated by the main thread
+        self.watermark = 0  # number of points written in the out values (sw_idx.table order)
+        self.seq = 0  # number of the frame (emitted copy of the status)
+        self.trace = None  # ChunkedBuffer of the samples of a time trace (no sw_idx then)
+
+    def frame(self, seq):
+        # copy sent to the gui: the sweep thread keeps updating this status in place
+        frame = copy.copy(self)
+        frame.iteration = list(self.iteration)
+        frame.datas = dict(self.datas) if self.datas is not None else None
+        frame.seq = seq
+        return frame
+
+
+class ProgressPublisher:
+    # Emit the progress signal at most max_fps times per second.
+    # Points acquired between two frames are merged into one emit,
+    # the last point of the sweep is always emitted.
+    # So the sweep speed does not depend on the rendering speed.
+
+    def __init__(self, sig_progress, max_fps=30):
+        self.sig_progress = sig_progress
+        self.max_fps = max_fps
+        self.seq = 0
+        self.reset()
+
+    def reset(self):
+        self.last_emit = 0.
+        self.pending = 0
+        # self.seq is not reset: frames keep increasing numbers from one sweep to the next
+
+    def publish(self, status, force=False):
+        # called by the sweep thread every point
+        self.pending += 1
+        now = time.perf_counter()
+        if not force and now - self.last_emit < 1. / self.max_fps:
+            return
+        self._emit(status, now)
+
+    def flush(self, status):
+        # emit the points not yet published (pause, abort, ...)
+        if self.pending != 0:
+            self._emit(status, time.perf_counter())
+
+    def _emit(self, status, now):
+        status.nb_merged = self.pending
+        self.pending = 0
+        self.last_emit = now
+        self.seq += 1
+        status.seq = self.seq
+        self.sig_progress.emit(status.frame(self.seq))
+
+
+class LiveSnapshot:
+    # Gui side copy of the values of the out devices, always a consistent prefix of the sweep:
+    # the points before the watermark of the last frame, the others are NaN.
+    # The sweep thread writes every point once in gui_dev.values, then moves the watermark,
+    # so update() only copies the points between the previous watermark and the new one
+    # (sw_idx.table): nothing is locked, no frame is torn, no point is missed.
+
+    def __init__(self):
+        self.sw_idx = None
+        self.values = {}  # gui_dev: array, same shape as gui_dev.values
+        self.flat = {}  # gui_dev: (flat view of the copy, flat view of gui_dev.values), see GuiDevice.flatValues
+        self.watermark = 0
+        self.seq = -1
+
+    def reset(self, sweep_status):
+        # beginning of a sweep, sweep_status is the live status (its watermark can move meanwhile)
+        self.sw_idx = sweep_status.sw_idx
+        self.watermark = sweep_status.watermark  # read before the copy
+        self.seq = 0  # the frames of this sweep emitted before are still used (watermark)
+        self.values = {}
+        self.flat = {}
+        if self.sw_idx is None: return
+        todo = self.sw_idx.table[self.watermark:]
+        for gui_dev in sweep_status.out_devs:
+            if gui_dev.values is None: continue
+            values = np.array(gui_dev.values)
+            flat = values.reshape(-1, *gui_dev.multiShape())
+            flat[todo] = np.nan  # written after the watermark was read
+            self.values[gui_dev] = values
+            self.flat[gui_dev] = (flat, gui_dev.flatValues())
+
+    def update(self, frame):
+        # copy the points of the frame not copied yet (old frames and other sweeps are ignored)
+        if self.sw_idx is None or frame.sw_idx is not self.sw_idx or frame.seq <= self.seq: return
+        self.seq = frame.seq
+        if frame.watermark <= self.watermark: return
+        new = self.sw_idx.table[self.watermark:frame.watermark]
+        for flat, live in self.flat.values():
+            flat[new] = live[new]
+        self.watermark = frame.watermark
+
+    def get(self, gui_dev):
+        # (values, index of the last point) of gui_dev, None if it is not in the sweep
+        if gui_dev not in self.values: return None
+        last = self.sw_idx.table[max(min(self.watermark, len(self.sw_idx.table)) - 1, 0)]
+        return self.values[gui_dev], np.unravel_index(last, self.sw_idx.shape)
 
 
 class SweepThread(QThread):
@@ -19,42 +128,174 @@ class SweepThread(QThread):
     # runs the sweep and calls 'after_get' every point
     # sending a SweepStatusObject to the main thread.
 
-    def __init__(self, loop_control, sig_progress, sig_error, sig_finished):
+    def __init__(self, loop_control, sig_progress, sig_error, sig_finished,
+                 sig_started=None, sig_queueChanged=None, sig_aborted=None):
         super(SweepThread, self).__init__()
         self.loop_control = loop_control
         self.sig_progress = sig_progress
+        self.publisher = ProgressPublisher(sig_progress)
         self.sig_error = sig_error
         self.sig_finished = sig_finished
+        # only emitted from the thread for the queued sweeps:
+        self.sig_started = sig_started
+        self.sig_queueChanged = sig_queueChanged
+        # emitted after sig_finished when the sweep was aborted, with the time (s)
+        # from the abort to the end of the loop and to the devices back to their safe values
+        self.sig_aborted = sig_aborted
+        self.abort_time = None  # time.perf_counter() of the abort, set by HegelLab.abortSweep
+        self.abort_durations = None
         self.enable_live = True
 
         self.fn_kwargs = None
+        self.engine = "pyHegel"  # or "native" (src.SweepEngine.NativeSweep)
         self.status = SweepStatus()
         self.raz_sw_devs = lambda: None
+        self.timings = None  # SweepTimings, filled by the native engine (publish and point only for pyHegel)
+        self.last_get = None  # time of the end of the previous after_get (pyHegel engine)
+
+        # sweep queue (src.SweepQueue): configs to run back to back, and
+        # fn(config) -> (sweep_kwargs, gui_sw_devs, gui_out_devs, sw_idx, raz_sw_devs)
+        # preparing one of them (called in this thread, so no gui in it)
+        self.queue = []
+        self.prepare_queued = None
 
     def initSweepKwargs(self, sweep_multi_kwargs):
         self.fn_kwargs = sweep_multi_kwargs
+        self.engine = self.fn_kwargs.pop("engine", "pyHegel")
         self.fn_kwargs["loop_control"] = self.loop_control
         self.fn_kwargs["exec_after"] = self.after_get
         self.fn_kwargs["graph"] = False
+        nb_points = int(np.prod(self.fn_kwargs["npts"]))
+        dev_names = [devName(dev) for dev in list(self.fn_kwargs["dev"]) + list(self.fn_kwargs["out"])]
+        self.timings = SweepTimings(nb_points, dev_names)
+        if self.engine == "native":
+            self.fn_kwargs["timings"] = self.timings
 
-    def initSweepStatus(self, gui_sw_devs, gui_out_devs, start_time):
+    def initSweepStatus(self, gui_sw_devs, gui_out_devs, sw_idx, start_time):
         self.status.sw_devs = gui_sw_devs
         self.status.out_devs = gui_out_devs
+        self.status.sw_idx = sw_idx
         self.status.start_time = start_time
-        self.enable_live = len(gui_sw_devs) <= 2
+        self.status.timings = self.timings
+        self.status.watermark = sw_idx.cursor  # resumed sweeps start with points already done
+        self.status.trace = None
+        self.status.eta = EtaModel.fromGuiDevices(gui_sw_devs, self.fn_kwargs["updown"] == "alternate",
+                                                  self.fn_kwargs["beforewait"])
+        self.last_get = None
+        self.enable_live = all(dev.values is not None for dev in gui_out_devs)
+        # flat views of the out values, indexed with sw_idx.currentFlat() (a row per point for multi devices)
+        self.flat_values = [dev.flatValues() for dev in gui_out_devs] if self.enable_live else []
+        self.publisher.reset()
+
+    def initTrace(self, trace_kwargs, gui_out_devs, buffer, start_time):
+        # time trace (src.TimeTrace): no swept device and no live arrays,
+        # the samples are in buffer (status.trace), the watermark is their number.
+        self.fn_kwargs = trace_kwargs
+        self.engine = "trace"
+        self.fn_kwargs["loop_control"] = self.loop_control
+        self.fn_kwargs["exec_after"] = self.after_sample
+        self.fn_kwargs["buffer"] = buffer
+        self.timings = None
+        self.status.sw_devs = []
+        self.status.out_devs = gui_out_devs
+        self.status.sw_idx = None
+        self.status.start_time = start_time
+        self.status.timings = None
+        self.status.eta = None
+        self.status.iteration = [None, None]
+        self.status.datas = None
+        self.status.watermark = 0
+        self.status.trace = buffer
+        self.enable_live = False
+        self.flat_values = []
+        self.publisher.reset()
+
+    def initQueue(self, configs, prepare_queued):
+        self.queue = list(configs)
+        self.prepare_queued = prepare_queued
 
     def run(self):
+        self.abort_time = None
+        self.abort_durations = None
+        # once for the sweep or the whole queue: the engines do not reset it,
+        # so an abort while a queued sweep is prepared is not lost
+        self.loop_control.abort_enabled = False
+        self.loop_control.pause_enabled = False
         try:
-            sweep_multi(**self.fn_kwargs)  # THE SWEEP
+            if self.queue:
+                self._runQueue()
+            else:
+                self._runSweep()
+        finally:
+            self.sig_finished.emit()
+            if self.abort_durations is not None and self.sig_aborted is not None:
+                self.sig_aborted.emit(*self.abort_durations)
+
+    def _runSweep(self):
+        # return the exception of the sweep, if any
+        try:
+            # THE SWEEP
+            if self.engine == "native":
+                NativeSweep(**self.fn_kwargs).run()
+            elif self.engine == "trace":
+                TimeTrace(**self.fn_kwargs).run()
+            else:
+                sweep_multi(**self.fn_kwargs)
         except Exception as e:
             self.sig_error.emit(e)
+            return e
         finally:
-            self.raz_sw_devs()
-            self.sig_finished.emit()
+            t_stopped = time.perf_counter()
+            self.publisher.flush(self.status)
+            self._returnToSafe(t_stopped)
+
+    def _returnToSafe(self, t_stopped):
+        # raz of the swept devices, all at the same time, returns once they are done
+        # t_stopped: end of the sweep loop, for the abort durations
+        self.raz_sw_devs()
+        if self.abort_time is not None:
+            self.abort_durations = (t_stopped - self.abort_time, time.perf_counter() - self.abort_time)
+
+    def _setQueueState(self, config, state):
+        config["state"] = state
+        self.sig_queueChanged.emit()
+
+    def _runQueue(self):
+        # run the queued sweeps one after the other, until the queue
+        # is empty or a sweep is aborted. A sweep that fails is skipped.
+        while self.queue and not self.loop_control.abort_enabled:
+            config = self.queue.pop(0)
+            self._setQueueState(config, "running")
+            self.status.sw_devs = []  # an abort while preparing must not stop the devices of the previous sweep
+            try:
+                sweep_kwargs, gui_sw_devs, gui_out_devs, sw_idx, self.raz_sw_devs = self.prepare_queued(config)
+            except Exception as e:
+                self._setQueueState(config, f"error: {e}")
+                self.sig_error.emit(e)
+                continue
+            if self.loop_control.abort_enabled:
+                # aborted while preparing (pre-set ramps, log reads): no sweep, end of the queue
+                self._setQueueState(config, "aborted")
+                self._returnToSafe(time.perf_counter())
+                break
+            self.initSweepKwargs(sweep_kwargs)
+            self.initSweepStatus(gui_sw_devs, gui_out_devs, sw_idx, time.time())
+            self.sig_started.emit(self.status)
+
+            exception = self._runSweep()
+            if exception is not None:
+                self._setQueueState(config, f"error: {exception}")
+            elif self.loop_control.abort_enabled:
+                self._setQueueState(config, "aborted")
+            else:
+                self._setQueueState(config, "done")
+        self.queue = []
+        self.raz_sw_devs = lambda: None
 
     def after_get(self, datas):
         # exec between set and get
         # datas is a dict detailed in pyHegel.commands._Sweep
+        t_start = time.perf_counter()
 
         self.status.iteration[0] = datas["iter_part"]
         self.status.iteration[1] = datas["iter_total"] 
@@ -63,19 +304,43 @@ class SweepThread(QThread):
         # this used to be done in the main thread,
         # but it led to a bug where it sometimes
         # missed some points
+        nb = datas.get("nb_points", 1)  # a whole line with a buffered fast axis (native engine)
         if self.enable_live:
-            for out_dev, val in zip(self.status.out_devs, datas["read_vals"]):
-                out_dev.values[out_dev.sw_idx.current()] = val
+            sw_idx = self.status.sw_idx
+            flat_idx = sw_idx.currentFlat() if nb == 1 else sw_idx.currentFlats(nb)
+            for flat_values, val in zip(self.flat_values, datas["read_vals"]):
+                flat_values[flat_idx] = val
     
         #if self.retroaction_loop_dict['enabled']:
             #self.do_retroaction(self.status)
         
-        [out_dev.sw_idx.next() for out_dev in self.status.out_devs]
+        self.status.sw_idx.next(nb)
+        self.status.watermark = self.status.sw_idx.cursor  # after the values (LiveSnapshot)
 
-        # emit self.progress
-        self.sig_progress.emit(self.status)
+        # emit self.progress (throttled)
+        # (the last point and the point before a pause are always sent)
+        force = datas["iter_part"] == datas["iter_total"] or self.loop_control.pause_enabled
+        self.publisher.publish(self.status, force=force)
+
+        i, now = datas["iter_part"] - 1, time.perf_counter()
+        if self.engine != "native" and i < self.timings.nb_points:
+            # the native engine times all the phases itself
+            self.timings.setPhase(i, self.timings.phase("publish"), now - t_start)
+            if self.last_get is not None:
+                self.timings.setPhase(i, self.timings.phase("point"), now - self.last_get)
+            # the time of the next point would include the pause
+            self.last_get = now if not self.loop_control.pause_enabled else None
     
 
+    def after_sample(self, datas):
+        # exec_after of a time trace, the samples are already in status.trace
+        self.status.iteration[0] = datas["iter_part"]
+        self.status.iteration[1] = datas["iter_total"]
+        self.status.datas = datas
+        self.status.watermark = datas["iter_part"]
+        force = datas["iter_part"] == datas["iter_total"] or self.loop_control.pause_enabled
+        self.publisher.publish(self.status, force=force)
+
     def do_retroaction(self, sweep_status):
         vds_dev = self.retroaction_loop_dict['vds_dev']
         ids_dev = self.retroaction_loop_dict['ids_dev']
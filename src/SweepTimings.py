@@ -0,0 +1,157 @@
+import math
+import threading
+import numpy as np
+
+
+class SweepTimings:
+    # Duration (s) of every phase of the points of a sweep, filled by the sweep loop.
+    # Compact enough to stay on for any sweep: its size does not depend on the number of points.
+    #   phases: set: setting the swept devices (ramps included), wait: beforewait,
+    #     read: reading the out devices, publish: exec_after (gui bookkeeping),
+    #     write: queuing the row for the file writer,
+    #     point: whole point, from its set to the set of the next one (pauses excluded)
+    #   devices: set (swept devices) or get (out devices) of dev_names[j]
+    # The last RING points are kept (ring buffer, NaN when not measured) for the ETA and the
+    # pipelined point time. Every phase also has running aggregates (count, sum, max) and a
+    # histogram on fixed log spaced bins: the sweep thread folds the points of the ring into
+    # them by blocks of FLUSH points (vectorized, so a point only costs its writes in the ring),
+    # a line at once for the buffered engine. Every device has running aggregates too.
+    # The gui only reads them, with the few points not folded yet.
+    # The pyHegel engine (sweep_multi) only gives publish and point.
+
+    PHASES = ["set", "wait", "read", "publish", "write", "point"]
+    RING = 65536  # points kept
+    FLUSH = 4096  # points folded at once into the aggregates
+    BINS_PER_DECADE = 20
+    MIN_DECADE, MAX_DECADE = -7, 4  # histogram from 100 ns to 10^4 s
+
+    def __init__(self, nb_points, dev_names):
+        self.nb_points = nb_points
+        self.dev_names = list(dev_names)
+        nb_phases = len(self.PHASES)
+        self.ring = np.full((self.RING, nb_phases), np.nan, dtype=np.float32)
+        self.ring_rows = np.full(self.RING, -1, dtype=np.int64)  # point held by every slot
+        self.last_row = -1  # last point written
+        # aggregates of the points before folded: [phase]: count, sum, max and histogram counts
+        self.lock = threading.Lock()
+        self.folded = 0
+        self.phase_stats = np.zeros((nb_phases, 3))
+        self.nb_bins = (self.MAX_DECADE - self.MIN_DECADE) * self.BINS_PER_DECADE
+        self.counts = np.zeros((nb_phases, self.nb_bins), dtype=np.int64)
+        # [device]: [count, sum, max] (python lists: updated at every point, faster than numpy)
+        self.device_stats = [[0, 0., 0.] for _ in self.dev_names]
+
+    def phase(self, name):
+        # index of a phase
+        return self.PHASES.index(name)
+
+    # -- recording (sweep thread) --
+
+    def setPhase(self, i, phase, duration, nb=1):
+        # duration of phase (index) for the points i:i + nb (a whole line shares its time)
+        if nb == 1:
+            slot = i % self.RING
+            if self.ring_rows.item(slot) != i:  # a new point: empty its slot
+                if i - self.folded > self.FLUSH:
+                    self._fold(i - 1)  # the point before can still get its point time
+                self.ring[slot] = np.nan
+                self.ring_rows[slot] = i
+                if i > self.last_row: self.last_row = i
+            self.ring[slot, phase] = duration
+            return
+        with self.lock:
+            self._foldRows(self.folded, i)
+            self.folded = max(self.folded, i + nb)
+            self._addStats(self.phase_stats, self.counts, phase, np.array([duration]), nb)
+        rows = np.arange(max(i, i + nb - self.RING), i + nb)
+        slots = rows % self.RING
+        old = self.ring_rows[slots] != rows
+        self.ring[slots[old]] = np.nan
+        self.ring_rows[slots] = rows
+        self.ring[slots, phase] = duration
+        self.last_row = max(self.last_row, i + nb - 1)
+
+    def getPhase(self, i, phase):
+        # duration of phase for the point i, NaN if not measured or not in the ring any more
+        slot = i % self.RING
+        return self.ring.item(slot, phase) if self.ring_rows.item(slot) == i else math.nan
+
+    def setDevice(self, j, duration):
+        if duration is None or not math.isfinite(duration): return
+        stats = self.device_stats[j]
+        stats[0] += 1
+        stats[1] += duration
+        if duration > stats[2]: stats[2] = duration
+
+    def _fold(self, stop):
+        with self.lock:
+            self._foldRows(self.folded, stop)
+            self.folded = max(self.folded, stop)
+
+    def _foldRows(self, start, stop, phase_stats=None, counts=None):
+        # adds the points start:stop still in the ring to the aggregates (or to the ones given)
+        if stop <= start: return
+        rows = np.arange(max(start, stop - self.RING), stop)
+        slots = rows % self.RING
+        values = self.ring[slots[self.ring_rows[slots] == rows]]
+        for phase in range(len(self.PHASES)):
+            self._addStats(self.phase_stats if phase_stats is None else phase_stats,
+                           self.counts if counts is None else counts, phase, values[:, phase])
+
+    def _addStats(self, phase_stats, counts, phase, values, nb=1):
+        # adds values (each for nb points) of phase, NaN skipped
+        values = values[np.isfinite(values)].astype(float)
+        if len(values) == 0: return
+        stats = phase_stats[phase]
+        stats[0] += len(values) * nb
+        stats[1] += values.sum() * nb
+        stats[2] = max(stats[2], values.max())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bins = (np.log10(values) - self.MIN_DECADE) * self.BINS_PER_DECADE
+        bins = np.clip(np.nan_to_num(bins, nan=0., neginf=0.), 0, self.nb_bins - 1).astype(int)
+        counts[phase] += np.bincount(bins, minlength=self.nb_bins) * nb
+
+    # -- reading (gui thread) --
+
+    def _aggregates(self):
+        # (phase_stats, counts) including the points not folded yet
+        with self.lock:
+            phase_stats, counts = self.phase_stats.copy(), self.counts.copy()
+            self._foldRows(self.folded, self.last_row + 1, phase_stats, counts)
+        return phase_stats, counts
+
+    def recent(self, rows, phase):
+        # durations of phase for the points in rows (array), NaN if not measured or not in the ring any more
+        slots = rows % self.RING
+        return np.where(self.ring_rows[slots] == rows, self.ring[slots, phase], np.nan)
+
+    def count(self, name):
+        return int(self._aggregates()[0][self.phase(name), 0])
+
+    def total(self, name):
+        # time spent in a phase (s)
+        return float(self._aggregates()[0][self.phase(name), 1])
+
+    def mean(self, name):
+        count, total, _ = self._aggregates()[0][self.phase(name)]
+        return total / count if count else math.nan
+
+    def histogram(self, name):
+        # (counts, edges) of the measured durations of a phase, edges in s (log spaced),
+        # from the first to the last bin with counts
+        counts = self._aggregates()[1][self.phase(name)]
+        filled = np.flatnonzero(counts)
+        if len(filled) == 0:
+            return np.zeros(0), np.zeros(0)
+        first, last = filled[0], filled[-1] + 1
+        edges = 10**(self.MIN_DECADE + np.arange(first, last + 1) / self.BINS_PER_DECADE)
+        return counts[first:last], edges
+
+    def slowestDevices(self):
+        # [(name, mean, max, count), ...] sorted by total time spent, the slowest first
+        stats = []
+        for name, (count, total, max_) in zip(self.dev_names, [list(stats) for stats in self.device_stats]):
+            if count == 0: continue
+            stats.append((name, total / count, max_, int(count), total))
+        stats.sort(key=lambda stat: stat[4], reverse=True)
+        return [stat[:4] for stat in stats]
@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+from src.SweepEngine import WriterThread, ReadPool, devKw, columnNames
+from src.SweepFile import TextSweepWriter, flatRow
+
+
+class ChunkedBuffer:
+    # Growable (nb_rows, nb_columns) float64 buffer, made of chunks of chunk_size rows:
+    # appending never copies the rows already there.
+    # Past max_memory bytes, the oldest full chunks are spilled to .npy files
+    # (in spill_dir, a temporary folder by default) and read back as memmaps,
+    # so a long recording is not limited by the memory.
+    # One thread appends, the others can read the rows before len() at any time.
+
+    def __init__(self, chunk_size=65536, max_memory=256 * 2**20, spill_dir=None):
+        self.chunk_size = chunk_size
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.nb_columns = None  # from the first row
+        self.chunks = []  # arrays in memory or memmaps on disk
+        self.nb_spilled = 0  # the first chunks are on disk
+        self.nb_rows = 0
+
+    def __len__(self):
+        return self.nb_rows
+
+    def _newChunk(self):
+        self.chunks.append(np.full((self.chunk_size, self.nb_columns), np.nan))
+        max_chunks = max(1, self.max_memory // (self.chunk_size * self.nb_columns * 8))
+        while len(self.chunks) - self.nb_spilled > max_chunks:
+            self._spill(self.nb_spilled)
+
+    def _spill(self, k):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="hegellab_trace_")
+        path = os.path.join(self.spill_dir, f"chunk{k:06d}.npy")
+        np.save(path, self.chunks[k])
+        self.chunks[k] = np.load(path, mmap_mode="r")  # readers keep the array they already have
+        self.nb_spilled += 1
+
+    def append(self, row):
+        if self.nb_columns is None:
+            self.nb_columns = len(row)
+        k, i = divmod(self.nb_rows, self.chunk_size)
+        if k == len(self.chunks):
+            self._newChunk()
+        self.chunks[k][i] = row
+        self.nb_rows += 1  # after the row: readers only see complete rows
+
+    def get(self, start, stop, columns=slice(None)):
+        # copy of the rows start:stop (of columns)
+        stop = min(stop, self.nb_rows)
+        start = max(min(start, stop), 0)
+        if self.nb_columns is None:  # nothing appended yet
+            return np.zeros((0, 0 if isinstance(columns, slice) else len(columns)))
+        if start == stop:
+            return np.zeros((0, self.nb_columns))[:, columns]
+        first, last = start // self.chunk_size, (stop - 1) // self.chunk_size
+        parts = []
+        for k in range(first, last + 1):
+            begin = start - k * self.chunk_size if k == first else 0
+            end = stop - k * self.chunk_size if k == last else self.chunk_size
+            parts.append(self.chunks[k][begin:end, columns])
+        return np.concatenate(parts)
+
+    def last(self, nb, columns=slice(None)):
+        nb_rows = self.nb_rows
+        return self.get(nb_rows - nb, nb_rows, columns)
+
+    def close(self):
+        # forget the data, remove the spilled chunks
+        self.chunks = []
+        self.nb_spilled = self.nb_rows = 0
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+
+class TimeTrace:
+    # Time series of the out devices, without swept device (engine "trace" of the SweepThread).
+    # The out devices are read as fast as possible (rate 0) or at rate Hz on a fixed schedule
+    # (missed samples are skipped), for duration s (0: until abort).
+    # Every sample is timestamped (s from the start, middle of the read), appended to
+    # buffer (ChunkedBuffer, first column the time) and written in the file (WriterThread).
+    # exec_after gets the datas of every sample like a sweep point, with iter_total None
+    # when the number of samples is not known.
+
+    def __init__(self, out, filename, extra_conf=None, rate=0., duration=0., buffer=None,
+                 exec_after=None, loop_control=None, parallel_read=False, out_instr=None,
+                 out_multi=None, write_queue_size=10000, fsync_interval=1., **kwargs):
+        self.out_devs = list(out)
+        self.filename = filename
+        self.extra_conf = list(extra_conf) if extra_conf is not None else []
+        self.rate = rate
+        self.duration = duration
+        self.buffer = buffer if buffer is not None else ChunkedBuffer()
+        self.exec_after = exec_after
+        self.loop_control = loop_control
+        self.out_multi = list(out_multi) if out_multi is not None else [None] * len(self.out_devs)
+        self.write_queue_size = write_queue_size
+        self.fsync_interval = fsync_interval
+        self.read_pool = None
+        if parallel_read:
+            out_instr = out_instr if out_instr is not None else list(range(len(self.out_devs)))
+            self.read_pool = ReadPool(self.out_devs, out_instr)
+        self.nb_samples = int(rate * duration) if rate > 0 and duration > 0 else None
+
+    def _aborted(self):
+        return self.loop_control is not None and self.loop_control.abort_enabled
+
+    def _paused(self):
+        return self.loop_control is not None and self.loop_control.pause_enabled
+
+    def _read(self):
+        if self.read_pool is not None:
+            return self.read_pool.read()
+        read_vals = []
+        for dev in self.out_devs:
+            dev, kw = devKw(dev)
+            read_vals.append(dev.get(**kw))
+        return read_vals
+
+    def run(self):
+        # loop_control is reset by the caller (SweepThread.run)
+        columns = ["time"]
+        for dev, multi in zip(self.out_devs, self.out_multi):
+            columns += columnNames(dev, multi)
+        writer = WriterThread(TextSweepWriter(self.filename, columns, self.extra_conf),
+                              self.write_queue_size, self.fsync_interval)
+        writer.start()
+        period = 1. / self.rate if self.rate > 0 else 0.
+        t_start = t_sched = time.perf_counter()
+        paused = 0.  # time spent in pause, not part of the trace duration
+        i = 0
+        try:
+            while not self._aborted():
+                if self._paused():
+                    t_pause = time.perf_counter()
+                    while self._paused() and not self._aborted():
+                        time.sleep(0.05)
+                    paused += time.perf_counter() - t_pause
+                    t_sched = time.perf_counter()  # no burst of samples after a pause
+                    continue
+                now = time.perf_counter()
+                if self.duration > 0 and now - t_start - paused >= self.duration: break
+                if now < t_sched:
+                    time.sleep(min(t_sched - now, 0.01))  # interruptible
+                    continue
+                t0 = time.perf_counter()
+                read_vals = self._read()
+                t1 = time.perf_counter()
+                row = [(t0 + t1) / 2 - t_start] + flatRow(read_vals)
+                self.buffer.append(row)
+                writer.put(row)
+                i += 1
+                if self.exec_after is not None:
+                    self.exec_after(dict(iter_part=i, iter_total=self.nb_samples, set_vals=[],
+                                         read_vals=read_vals, time=row[0],
+                                         write_queue=writer.depth(), write_latency=writer.write_latency))
+                if period > 0:
+                    t_sched += period
+                    if (late := time.perf_counter() - t_sched) > 0:
+                        t_sched += (int(late // period) + 1) * period  # skip the missed samples
+        finally:
+            if self.read_pool is not None:
+                self.read_pool.close()
+            writer.close()
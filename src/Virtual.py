@@ -0,0 +1,152 @@
+from pyHegel import instruments_base
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from src.SweepEngine import devKw, devName
+
+
+# Virtual gates: linear combinations of real gate devices (of other instruments),
+# defined by the cross-capacitance matrix CC (virtual = CC @ real, real = CC^-1 @ virtual).
+# Load it with ph_class "Virtual.VirtualGatesInstrument" and driver "Drivers.VirtualGates"
+# (the driver window sets the gates and the matrix).
+#
+# vg1, vg2, ...: one device per virtual gate, every set computes the real values (CC^-1 @ virtual).
+# sweep_x, sweep_y: a virtual gate chosen with setAxis, on a precomputed path:
+#   the real values of the whole (x, y) map are computed at once (one matrix product, _makeGrid),
+#   a point of the map is then a lookup in that grid. Values out of the grid are computed like vg.
+# The real gates whose value changes are set concurrently (ramps in parallel).
+# The real gates should only be set through the virtual gates while they are used (values kept here).
+
+
+class VirtualGateDevice(instruments_base.BaseDevice):
+    # virtual gate number gate of the instrument
+
+    def __init__(self, gate, **kwarg):
+        super().__init__(**kwarg)
+        self._getdev_p = True
+        self._setdev_p = True
+        self.gate = gate
+
+    def _getdev(self, **kwarg):
+        return float(self.instr._virtual[self.gate])
+
+    def _setdev(self, val, **kwarg):
+        self.instr._setVirtual(self.gate, val)
+
+
+class VirtualAxisDevice(instruments_base.BaseDevice):
+    # the virtual gate of axis ('x' or 'y'), set from the precomputed path
+
+    def __init__(self, axis, **kwarg):
+        super().__init__(**kwarg)
+        self._getdev_p = True
+        self._setdev_p = True
+        self.axis = axis
+
+    def _getdev(self, **kwarg):
+        if self.axis not in self.instr._axes: return np.nan
+        return float(self.instr._virtual[self.instr._axes[self.axis][0]])
+
+    def _setdev(self, val, **kwarg):
+        self.instr._setAxisValue(self.axis, val)
+
+
+class VirtualGatesInstrument(instruments_base.BaseInstrument):
+
+    def __init__(self, gates=[], matrix=None, inverse=False):
+        # gates: real pyHegel devices (or (dev, kwargs) tuples)
+        # matrix: CC (or CC^-1 if inverse), nb_gates x nb_gates, identity by default
+        self._gates = list(gates)
+        n = len(self._gates)
+        self._real = np.array([float(devKw(gate)[0].getcache()) for gate in self._gates])
+        self._axes = {}  # axis: (gate, values)
+        self._grid = None  # real values of the map, shape (nx[, ny], nb_gates)
+        self._pool = ThreadPoolExecutor(max_workers=max(n, 1))
+        self.setMatrix(np.eye(n) if matrix is None else matrix, inverse)
+        super().__init__()
+
+    def setMatrix(self, matrix, inverse=False):
+        matrix = np.array(matrix, dtype=float)
+        if matrix.shape != (len(self._gates), len(self._gates)):
+            raise ValueError(f"The matrix must be {len(self._gates)}x{len(self._gates)}, not {matrix.shape}.")
+        self._cc, self._inv = (np.linalg.inv(matrix), matrix) if inverse else (matrix, np.linalg.inv(matrix))
+        self._virtual = self._cc @ self._real
+        self._grid = None
+
+    def setAxis(self, axis, gate, start, stop, npts):
+        # the virtual gate (index) swept by sweep_x/sweep_y and its values
+        other = [g for a, (g, _) in self._axes.items() if a != axis]
+        if gate in other:
+            raise ValueError(f"vg{gate+1} is already the gate of the other axis.")
+        self._axes[axis] = (gate, np.linspace(start, stop, npts))
+        self._grid = None
+
+    def _axisGate(self, axis):
+        if axis not in self._axes:
+            raise ValueError(f"No virtual gate for sweep_{axis}, use setAxis.")
+        return self._axes[axis][0]
+
+    def _gridIndex(self, axis, value):
+        # index of value on the path of axis, None if it is not on it
+        values = self._axes[axis][1]
+        step = values[1] - values[0] if len(values) > 1 else 1.
+        i = int(round((value - values[0]) / step)) if step != 0 else 0
+        if 0 <= i < len(values) and abs(values[i] - value) <= 1e-9 * max(abs(step), abs(value)):
+            return i
+        return None
+
+    def _makeGrid(self):
+        # real values of every point of the map: (base + axes values) @ CC^-1.T, one matrix product
+        axes = sorted(self._axes)
+        base = self._virtual.copy()
+        for axis in axes:
+            base[self._axes[axis][0]] = 0.
+        shape = tuple(len(self._axes[axis][1]) for axis in axes)
+        virtual = np.broadcast_to(base, shape + base.shape).copy()
+        for k, axis in enumerate(axes):
+            gate, values = self._axes[axis]
+            virtual[..., gate] += values.reshape([-1 if j == k else 1 for j in range(len(axes))])
+        self._grid = virtual @ self._inv.T
+
+    def _setReal(self, real):
+        # set the real gates that change, at the same time
+        changed = np.nonzero(real != self._real)[0]
+        def setGate(k):
+            dev, kw = devKw(self._gates[k])
+            dev.set(float(real[k]), **kw)
+            self._real[k] = real[k]
+        futures = [self._pool.submit(setGate, k) for k in changed]
+        for future in futures:
+            future.result()  # raises the first error
+
+    def _setVirtual(self, gate, val):
+        virtual = self._virtual.copy()
+        virtual[gate] = val
+        self._setReal(self._inv @ virtual)
+        if gate not in [g for g, _ in self._axes.values()]:
+            self._grid = None  # the base of the map changed
+        self._virtual = virtual
+
+    def _setAxisValue(self, axis, val):
+        gate = self._axisGate(axis)
+        virtual = self._virtual.copy()
+        virtual[gate] = val
+        idx = tuple(self._gridIndex(a, virtual[self._axes[a][0]]) for a in sorted(self._axes))
+        if None in idx:
+            self._setVirtual(gate, val)
+            return
+        if self._grid is None:
+            self._makeGrid()
+        self._setReal(self._grid[idx])
+        self._virtual = virtual
+
+    def _current_config(self, dev_obj=None, options={}):
+        gates = ", ".join(devName(gate) for gate in self._gates)
+        return [f"gates=[{gates}]", "CC=" + repr(self._cc.tolist())]
+
+    def _create_devs(self):
+        for k in range(len(self._gates)):
+            setattr(self, f"vg{k+1}", VirtualGateDevice(k, doc=f'virtual gate {k+1}'))
+        self.sweep_x = VirtualAxisDevice('x', doc='virtual gate of the x axis (setAxis), precomputed path')
+        self.sweep_y = VirtualAxisDevice('y', doc='virtual gate of the y axis (setAxis), precomputed path')
+        super()._create_devs()
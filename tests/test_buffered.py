@@ -0,0 +1,33 @@
+import pytest
+
+pytest.importorskip("pyHegel")
+
+from src import Drivers
+from src.Simulated import SimulatedInstrument
+from src.SweepEngine import NativeSweep, BufferedLine
+
+
+class LogicalDevice:
+    # stands for the ramp/limit devices around the fast gate: records its sets
+    def __init__(self, basedev):
+        self.basedev = basedev
+        self.sets = []
+
+    def getfullname(self):
+        return self.basedev.getfullname()
+
+    def set(self, value):
+        self.sets.append(value)
+        self.basedev.set(value)
+
+
+@pytest.mark.parametrize("updown", [False, "alternate"])
+def test_line_starts_through_the_logical_device(tmp_path, updown):
+    instr = SimulatedInstrument(nb_sources=2, latency=0)
+    fast = LogicalDevice(instr.source2)
+    buffered = BufferedLine([(Drivers.SimulatedDriver, instr, instr.source2, [0])], [instr.readval])
+    NativeSweep(dev=[instr.source1, fast], start=[0, 0], stop=[1, 1], npts=[3, 5], out=[instr.readval],
+                filename=str(tmp_path / "sweep.txt"), beforewait=0, updown=updown, buffered=buffered).run()
+    # every line starts with a set of its first value (the previous line ended at its last one)
+    first_values = [0., 1., 0.] if updown == "alternate" else [0., 0., 0.]
+    assert fast.sets == first_values
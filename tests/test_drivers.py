@@ -0,0 +1,36 @@
+import json
+import pytest
+
+pytest.importorskip("pyHegel")
+from PyQt5.QtCore import QCoreApplication, QEventLoop, QTimer
+
+from src import Drivers, Simulated
+from src.GuiInstrument import GuiInstrument
+
+
+def simulatedEntry():
+    with open("default_instruments.json") as f:
+        instruments = json.load(f)["instruments"]
+    return next(entry for entry in instruments if entry["name"] == "simulated")
+
+
+def test_load_simulated_rack_entry():
+    # loaded like HegelLab.loadGuiInstrument: eval of the driver, then its load
+    app = QCoreApplication.instance() or QCoreApplication([])
+    entry = simulatedEntry()
+    gui_instr = GuiInstrument("sim_test", entry["ph_class"], entry["driver"], entry["address"])
+    gui_instr.instr_dict = entry
+    driver = eval(gui_instr.driver, {"Drivers": Drivers})
+    assert driver.buffered
+
+    loop = QEventLoop()
+    result = []
+    def onFinished(gui_instr, err):
+        result.append(err)
+        loop.quit()
+    QTimer.singleShot(10000, loop.quit)
+    driver.load(None, gui_instr, onFinished)
+    loop.exec_()
+
+    assert result == [None]
+    assert isinstance(gui_instr.ph_instr, Simulated.SimulatedInstrument)
@@ -0,0 +1,36 @@
+import time
+
+from src.FeedbackLoop import FeedbackLoop
+
+
+class SlowDevice:
+    # set back to the first value is a slow ramp
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        if value == 0.:
+            time.sleep(0.3)
+        self.value = value
+
+
+def test_stop_does_not_wait_for_the_restore():
+    st = SlowDevice(0.)
+    loop = FeedbackLoop(st, None, [(0, 2.)], rate=100.)
+    loop.setSetpoints([1.])
+    loop.start()
+    time.sleep(0.1)
+    assert st.value == 2.
+    t0 = time.perf_counter()
+    loop.stopLoop()
+    assert time.perf_counter() - t0 < 0.1
+    # the next loop reads ST once the previous one has set it back
+    next_loop = FeedbackLoop(st, None, [], rate=100., previous=loop)
+    next_loop.start()
+    assert loop.wait(2000) and st.value == 0.
+    next_loop.stopLoop()
+    assert next_loop.wait(2000)
+    assert next_loop.st_first_val == 0.
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from src.GuiInstrument import GuiInstrument, GuiDevice
+from src.SweepEngine import columnNames
+
+
+class FakeDev:
+    def getfullname(self):
+        return "instr.dev"
+
+
+def makeDevice(multi):
+    gui_dev = GuiDevice("dev", "dev", {}, GuiInstrument("instr", "", "Drivers.Default", ""))
+    gui_dev.multi = multi
+    return gui_dev
+
+
+@pytest.mark.parametrize("multi", [None, False, True])
+def test_one_value(multi):
+    # pyHegel getformat()['multi'] is False for a device of one value
+    gui_dev = makeDevice(multi)
+    assert gui_dev.multiShape() == ()
+    assert gui_dev.channelNames() is None
+    gui_dev.values = np.full([3, 4] + list(gui_dev.multiShape()), np.nan)
+    assert gui_dev.flatValues().shape == (12,)
+    assert columnNames(FakeDev(), multi) == ["instr.dev"]
+
+
+def test_named_values():
+    gui_dev = makeDevice(["a", "b"])
+    assert gui_dev.multiShape() == (2,)
+    assert gui_dev.channelNames() == ["a", "b"]
+    gui_dev.values = np.full([3, 4] + list(gui_dev.multiShape()), np.nan)
+    assert gui_dev.flatValues().shape == (12, 2)
+    assert columnNames(FakeDev(), ["a", "b"]) == ["instr.dev.a", "instr.dev.b"]
+
+
+def test_array():
+    gui_dev = makeDevice((2, 3))
+    assert gui_dev.multiShape() == (2, 3)
+    assert gui_dev.channelNames() is None
+    assert len(columnNames(FakeDev(), (2, 3))) == 6
+
+
+def test_alloc_data_multi_false():
+    pytest.importorskip("pyHegel")
+    pytest.importorskip("qtconsole")  # imported by the HegelLab windows
+    from HegelLab import HegelLab
+    gui_dev = makeDevice(False)
+    sw_idx = HegelLab._allocData(None, [gui_dev], [0], [1], [5], False)
+    assert gui_dev.values.shape == (5, 1)
+    assert gui_dev.sw_idx is sw_idx
+
+
+def test_multi_needs_the_native_engine():
+    pytest.importorskip("pyHegel")
+    pytest.importorskip("qtconsole")  # imported by the HegelLab windows
+    from HegelLab import HegelLab
+
+    class Lab:
+        class pop:
+            refused = []
+            @classmethod
+            def multiNeedsNativeEngine(cls, names):
+                cls.refused.append(names)
+
+    devices = [makeDevice(False), makeDevice(["a", "b"])]
+    assert not HegelLab._multiEngineError(Lab(), devices, True)
+    assert not HegelLab._multiEngineError(Lab(), devices[:1], False)
+    assert HegelLab._multiEngineError(Lab(), devices, False)
+    assert Lab.pop.refused == [["dev"]]
@@ -0,0 +1,21 @@
+import numpy as np
+
+from src.SweepEta import EtaModel
+from src.SweepTimings import SweepTimings
+
+
+def test_cursor_waits_for_the_point_time():
+    eta = EtaModel([[0., 1., 10]])
+    timings = SweepTimings(10, [])
+    point = timings.phase("point")
+    for i in range(1, 5):
+        timings.setPhase(i, point, 1.)
+    timings.setPhase(5, timings.phase("set"), 0.1)  # point 5 done, its point time not known yet
+    eta.update(timings, 6)
+    assert eta.cursor == 5 and eta.cost[0] == 1.
+    timings.setPhase(5, point, 3.)
+    eta.update(timings, 6)
+    assert eta.cursor == 6 and eta.cost[0] > 1.
+    eta.update(timings, 8)  # nothing measured yet: the cursor stays
+    assert eta.cursor == 6
+    assert np.isclose(eta.remaining(), 4 * eta.cost[0])
@@ -0,0 +1,24 @@
+import numpy as np
+
+from src.SweepFile import TextSweepWriter, BinarySweepWriter, readSweepRows
+
+
+def test_text_rows_before_the_journal_offset(tmp_path):
+    writer = TextSweepWriter(str(tmp_path / "sweep.txt"), ["x", "y[0]", "y[1]"], ["some conf"])
+    writer.writeRows([[0., 1., 2.], [1., np.nan, 4.], [2., 5.]])  # the last one is malformed
+    writer.flush()
+    offset = writer.tell()  # the journal
+    writer.writeRows([[3., 7., 8.]])  # after the journal: dropped on resume
+    writer.close()
+    rows = readSweepRows(writer.filename, "txt", 4, offset)
+    assert rows.shape == (4, 3)
+    assert np.array_equal(rows[:2], [[0., 1., 2.], [1., np.nan, 4.]], equal_nan=True)
+    assert np.isnan(rows[2:]).all()
+
+
+def test_binary_rows(tmp_path):
+    writer = BinarySweepWriter(str(tmp_path / "sweep.npy"), ["x", "y"], nb_points=5)
+    writer.writeRows([[0., 1.], [1., 2.], [2., 3.]])
+    writer.sync()
+    rows = readSweepRows(writer.filename, "npy", 2)
+    assert np.array_equal(rows, [[0., 1.], [1., 2.]])
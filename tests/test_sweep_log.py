@@ -0,0 +1,26 @@
+import time
+
+from src.SweepLog import readLogDevices
+
+
+class FakeDev:
+    def __init__(self, name, duration):
+        self.name = name
+        self.duration = duration
+
+    def getfullname(self):
+        return self.name
+
+
+def test_stuck_instrument_is_not_read_after_timeout():
+    calls = []
+    def get(dev):
+        calls.append(dev.name)
+        time.sleep(dev.duration)
+        return 1.
+    devs = [FakeDev("a", 0), FakeDev("b", 0.5), FakeDev("c", 0), FakeDev("d", 0)]
+    log_vals, log_errors = readLogDevices(devs, [1, 1, 1, 2], get, timeout=0.1)
+    assert log_vals == {"a": 1., "d": 1.}
+    assert set(log_errors) == {"b", "c"}
+    time.sleep(0.6)  # "b" is done, its thread must stop there
+    assert sorted(calls) == ["a", "b", "d"]
@@ -0,0 +1,41 @@
+import time
+import pytest
+
+pytest.importorskip("pyHegel")
+from PyQt5.QtCore import QObject, pyqtSignal
+from pyHegel.commands import Loop_Control
+
+from src.SweepThread import SweepThread, SweepStatus
+
+
+class Signals(QObject):
+    sig_progress = pyqtSignal(SweepStatus)
+    sig_error = pyqtSignal(Exception)
+    sig_finished = pyqtSignal()
+    sig_started = pyqtSignal(SweepStatus)
+    sig_queueChanged = pyqtSignal()
+
+
+def test_abort_while_preparing_stops_the_queue():
+    signals = Signals()
+    loop_control = Loop_Control()
+    thread = SweepThread(loop_control, signals.sig_progress, signals.sig_error, signals.sig_finished,
+                         signals.sig_started, signals.sig_queueChanged)
+    thread.status.sw_devs = ["previous sweep device"]
+    raz = []
+    seen = []
+
+    def prepare(config):
+        # pre-set ramps of the queued sweep, the abort comes meanwhile
+        seen.append(list(thread.status.sw_devs))
+        loop_control.abort_enabled = True
+        return None, [], [], None, lambda: raz.append(config["name"])
+
+    configs = [{"name": "first"}, {"name": "second"}]
+    thread.initQueue(configs, prepare)
+    thread.start()
+    thread.wait(5000)
+
+    assert seen == [[]]  # abortSweep does not see the devices of the previous sweep
+    assert [config.get("state") for config in configs] == ["aborted", None]
+    assert raz == ["first"]
@@ -0,0 +1,37 @@
+import numpy as np
+
+from src.SweepTimings import SweepTimings
+
+
+def test_size_does_not_depend_on_the_sweep():
+    small, large = SweepTimings(10, ["a"]), SweepTimings(10**7, ["a"])
+    assert small.ring.nbytes == large.ring.nbytes
+
+
+def test_aggregates_and_histogram():
+    timings = SweepTimings(10**6, ["swept", "out"])
+    read = timings.phase("read")
+    durations = np.random.default_rng(0).uniform(1e-3, 2e-3, SweepTimings.RING + 100)
+    for i, duration in enumerate(durations):
+        timings.setPhase(i, read, duration)
+        timings.setDevice(1, duration)
+    timings.setPhase(len(durations), read, np.nan)  # not measured: not in the aggregates
+    assert timings.count("read") == len(durations)
+    assert np.isclose(timings.mean("read"), durations.mean())
+    counts, edges = timings.histogram("read")
+    assert counts.sum() == len(durations)
+    assert edges[0] <= durations.min() and durations.max() <= edges[-1]
+    assert timings.slowestDevices()[0][0] == "out"
+    # the ring keeps the last points only
+    rows = np.array([0, len(durations) - 1])
+    recent = timings.recent(rows, read)
+    assert np.isnan(recent[0]) and np.isclose(recent[1], durations[-1])
+
+
+def test_line():
+    timings = SweepTimings(100, [])
+    timings.setPhase(10, timings.phase("point"), 0.5, nb=20)
+    assert timings.count("point") == 20
+    assert np.isclose(timings.total("point"), 10.)
+    assert np.isclose(timings.getPhase(29, timings.phase("point")), 0.5)
+    assert np.isnan(timings.getPhase(30, timings.phase("point")))
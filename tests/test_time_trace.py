@@ -0,0 +1,14 @@
+import os
+
+from src.TimeTrace import ChunkedBuffer
+
+
+def test_close_removes_the_spilled_chunks():
+    buffer = ChunkedBuffer(chunk_size=4, max_memory=4 * 2 * 8)  # one chunk in memory
+    for i in range(10):
+        buffer.append([i, 2 * i])
+    assert buffer.nb_spilled == 2 and os.path.isdir(buffer.spill_dir)
+    assert buffer.get(0, 10)[:, 1].tolist() == [2 * i for i in range(10)]
+    spill_dir = buffer.spill_dir
+    buffer.close()
+    assert not os.path.exists(spill_dir)
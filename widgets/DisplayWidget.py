@@ -1,4 +1,4 @@
-from PyQt5.QtWidgets import QMainWindow, QLabel, QComboBox, QToolBar
+from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QComboBox, QToolBar, QSpinBox, QWidget, QHBoxLayout
 from PyQt5.QtCore import QPoint
 from PyQt5 import uic, QtCore
 import pyqtgraph as pg
@@ -6,7 +6,12 @@ import numpy as np
 from scipy.ndimage import gaussian_filter1d
 from pyHegel.gui import ScientificSpinBox
 
+from src.ImagePyramid import ImagePyramid
+from src.ColorMapThread import ColorMapThread
+
 class DisplaySweepData:
+    CACHE_SIZE = 4  # filtered images kept, one per (filter_state, sigma)
+
     def __init__(self):
         self.filter_state = "no" # "dx", "dy"
         self.sigma = 1
@@ -22,6 +27,55 @@ class DisplaySweepData:
         self.label_y = "y"
         self.label_out = "out"
         self.transpose = False
+        # N-D sweeps: the image is a 2D slice of the data
+        self.all_ranges = [[0, 1, 1], [0, 1, 1]] # sweep_range of every swept device
+        self.all_labels = ["x", "y"]
+        self.axes = [0, 1] # displayed axes (x, y)
+        self.slice_idx = [-1, -1] # index of the other axes, -1 to follow the sweep
+        # filtered images of the live raw_data, kept up to date point by point (see filteredData):
+        # (filter_state, sigma): (filtered image, snapshot watermark it is computed at)
+        self.cache = {}
+        self.cache_source = None  # what raw_data is a slice of, the cache is emptied when it changes
+        # lines of data changed by the last filteredData, (axis, indexes) or None for all (new image)
+        self.changed = None
+        self.shown = None  # (cache_source, cache key, transpose) of data
+
+    def initAxes(self, ranges, labels):
+        # ranges and labels for every axis of the data
+        self.all_ranges = list(ranges)
+        self.all_labels = list(labels)
+        self.slice_idx = [-1] * len(ranges)
+        nb_axes = len(ranges)
+        self.setAxes(nb_axes - 2, nb_axes - 1) # the two fastest by default
+
+    def setAxes(self, axis_x, axis_y):
+        self.axes = [axis_x, axis_y]
+        self.sweep_range = [self.all_ranges[axis_x], self.all_ranges[axis_y]]
+        self.label_x, self.label_y = self.all_labels[axis_x], self.all_labels[axis_y]
+        self.makeImageRect()
+
+    def sliceIndex(self, values, current=None):
+        # index of the 2D slice of values along self.axes (slice(None) on the displayed axes)
+        # current: sweep index, used for the axes following the sweep
+        index = []
+        for k, n in enumerate(values.shape):
+            if k in self.axes:
+                index.append(slice(None))
+                continue
+            i = self.slice_idx[k]
+            if i == -1:
+                i = current[k] if current is not None else 0
+            index.append(min(max(i, 0), n - 1))
+        return tuple(index)
+
+    def sliceData(self, values, current=None):
+        # return the 2D slice of values along self.axes
+        if values.ndim == 2 and self.axes == [0, 1]:
+            return values
+        data = values[self.sliceIndex(values, current)]
+        if self.axes[0] > self.axes[1]:
+            data = np.transpose(data)
+        return data
     
     def makeImageRect(self):
         start1, stop1, nbpts1 = self.sweep_range[0]
@@ -35,31 +89,95 @@ class DisplaySweepData:
                            np.abs(stop1-start1)+step1,
                            np.abs(stop2-start2)+step2]
     
-    def filteredData(self, gui_dev):
+    def filteredData(self, gui_dev, snapshot=None, channel=None):
+        # snapshot: LiveSnapshot, the values of gui_dev up to the last frame
+        # channel: index of the value of a multi device (its trailing axes flattened)
+        # With a snapshot, the filtered image is cached and only its lines holding points
+        # added since it was computed are filtered again (the filter works line by line).
+        live = None
         if gui_dev is not None:
-            self.raw_data = gui_dev.values
+            if snapshot is not None and (live := snapshot.get(gui_dev)) is not None:
+                values, current = live
+            else:
+                values = gui_dev.values
+                current = gui_dev.sw_idx.current() if gui_dev.sw_idx is not None else None
             self.label_out = gui_dev.getDisplayName("short", with_instr=True)
+            if channel is not None:
+                nb_axes = values.ndim - len(gui_dev.multiShape())
+                values = values.reshape(values.shape[:nb_axes] + (-1,))[..., channel]  # a view
+                names = gui_dev.channelNames()
+                self.label_out += f" {names[channel]}" if names is not None else f" [{channel}]"
+            self.raw_data = self.sliceData(values, current)
         else:
             self.label_out = "out"
 
-        axis = {"dx": 0, "dy": 1}.get(self.filter_state, -1)
-        if axis == -1 or self.raw_data.shape[axis] == 1:
-            self.data = np.copy(self.raw_data)
+        source = None
+        if live is not None:
+            source = (gui_dev, channel, tuple(self.axes), self.sliceIndex(values, current), snapshot.sw_idx)
+        if source is None or source != self.cache_source:
+            self.cache = {}
+            self.cache_source = source
+        key = (self.filter_state, self.sigma)
+        cached = self.cache.pop(key, None)
+        shown, self.shown = self.shown, (source, key, self.transpose)
+        self.changed = None
+        if cached is None or cached[1] > snapshot.watermark:
+            data = self._filter(self.raw_data)
         else:
-            self.data = gaussian_filter1d(self.raw_data, sigma=self.sigma, axis=axis, mode="nearest")
-            self.data = np.gradient(self.data, axis=axis)
-        if self.transpose:
-            self.data = np.transpose(self.data)
+            data, watermark = cached
+            lines = np.zeros(0, dtype=int)
+            if snapshot.watermark > watermark:
+                lines = self._touchedLines(snapshot.sw_idx, watermark, snapshot.watermark, source[3])
+                self._filter(self.raw_data, data, lines)
+            if shown == self.shown:  # the same image as the previous call, up to the lines
+                axis = 1 - self._filterAxis()
+                self.changed = (1 - axis if self.transpose else axis, lines)
+        if source is not None:
+            self.cache[key] = (data, snapshot.watermark)  # last used at the end
+            if len(self.cache) > self.CACHE_SIZE:
+                del self.cache[next(iter(self.cache))]
+        # transposed: a view, the cache is shared by both orientations
+        self.data = np.transpose(data) if self.transpose else data
         return self.data
 
+    def _filterAxis(self):
+        # axis of raw_data the filter works along (each line along it is filtered alone)
+        return {"dx": 0, "dy": 1}.get(self.filter_state, 0)
+
+    def _filter(self, raw_data, data=None, lines=None):
+        # filtered raw_data, in data (new array if None) for the lines given (all if None)
+        axis = self._filterAxis()
+        if lines is not None:
+            lines = (slice(None), lines) if axis == 0 else (lines, slice(None))
+            raw_data = raw_data[lines]
+        if self.filter_state == "no" or raw_data.shape[axis] == 1:
+            new = np.copy(raw_data)
+        else:
+            new = gaussian_filter1d(raw_data, sigma=self.sigma, axis=axis, mode="nearest")
+            new = np.gradient(new, axis=axis)
+        if data is None: return new
+        data[lines] = new
+        return data
+
+    def _touchedLines(self, sw_idx, start, stop, index):
+        # lines of the slice index (see _filter) holding the points start:stop of the sweep
+        points = np.unravel_index(sw_idx.table[start:stop], sw_idx.shape)
+        inside = np.ones(stop - start, dtype=bool)
+        for k, i in enumerate(index):
+            if k not in self.axes:
+                inside &= points[k] == i
+        return np.unique(points[self.axes[1 - self._filterAxis()]][inside])
+
 
 class DisplayWidget(QMainWindow):
+    TRACE_POINTS = 200000  # time trace: number of samples shown (the last ones)
+
     def __init__(self, view):
         super().__init__()
         uic.loadUi("ui/DisplayWindow.ui", self)
         self.view = view
         self.disp_data = DisplaySweepData()
-        self.disable = False # True when sweeping more than 2 device
+        self.nb_frames = 0 # number of progress frames received in the current sweep
         self.live_trace = True
         self.last_mouse_pos = QPoint(0,0)
         self.target_color = 0
@@ -72,13 +190,35 @@ class DisplayWidget(QMainWindow):
         self.main.hideButtons()
         self.image = pg.ImageItem()
         self.main.addItem(self.image)
-        # histogram lut
-        self.hist = pg.HistogramLUTItem(image=self.image)
-        self.hist.setImageItem(self.image)
+        # the image shown is the level of the pyramid of disp_data.data matching the zoom
+        self.pyramid = ImagePyramid()
+        self.image_level = None
+        # its colours are computed in color_map, from render_image (the level shown)
+        self.render_image = None
+        self.render_rect = None
+        self.render_levels = None  # levels of the last request
+        self.render_id = 0  # results of the previous sweeps are dropped
+        self.color_map = ColorMapThread()
+        self.color_map.sig_done.connect(self.gui_onColorsDone)
+        QApplication.instance().aboutToQuit.connect(self.color_map.stop)
+        self.color_map.start()
+        self.main.vb.sigRangeChanged.connect(lambda *args: self._renderImage(new_data=False))
+        self.main.vb.sigResized.connect(lambda *args: self._renderImage(new_data=False))
+        # time trace (no swept device): the samples of the out device against time
+        self.trace = None  # ChunkedBuffer of the time trace shown, None for a sweep
+        self.trace_columns = {}  # gui_dev: its first column in self.trace
+        self.trace_curve = self.main.plot()
+        self.trace_curve.setDownsampling(auto=True, method="peak")
+        self.trace_curve.setClipToView(True)
+        # histogram lut, of hist_image (not shown) holding render_image: the image gets RGBA from color_map
+        self.hist_image = pg.ImageItem()
+        self.hist = pg.HistogramLUTItem(image=self.hist_image)
         self.hist.axis.setWidth(50)
         self.hist.autoHistogramRange()
         self.hist.gradient.sigGradientChanged.connect(lambda: self.hist.gradient.showTicks(False))
         self.hist.gradient.menu.actions()[-4].trigger() # pick the last colormap
+        self.hist.sigLevelsChanged.connect(self.onHistLevelsChanged)
+        self.hist.sigLookupTableChanged.connect(lambda: self._requestColors())
         self.graph.addItem(self.hist, row=0, col=2)
         # vertical plot
         self.vertical = self.graph.addPlot(row=1, col=1)
@@ -119,6 +259,11 @@ class DisplayWidget(QMainWindow):
         self.cb_out.setMinimumWidth(250)
         self.cb_out.currentIndexChanged.connect(self.onCbOutChanged)
         self.toolBar.addWidget(self.cb_out)
+        # index of the value shown for the out devices returning an array
+        self.sb_index = QSpinBox()
+        self.sb_index.valueChanged.connect(self.onCbOutChanged)
+        self.act_index = [self.toolBar.addWidget(QLabel(" Index:")), self.toolBar.addWidget(self.sb_index)]
+        [act.setVisible(False) for act in self.act_index]
         self.toolBar.addSeparator()
         # tb1 button reset view:
         self.btn_reset_view = self.toolBar.addAction("Recenter")
@@ -140,6 +285,28 @@ class DisplayWidget(QMainWindow):
         self.sb_sigma.setRange(1, 100)
         self.toolBar2.addWidget(self.sb_sigma)
         self.sb_sigma.valueChanged.connect(self.onFilterChanged)
+        # tb3 slice selection (more than 2 swept devices):
+        self.toolBar3 = QToolBar()
+        self.addToolBarBreak()
+        self.addToolBar(self.toolBar3)
+        self.toolBar3.setContextMenuPolicy(QtCore.Qt.PreventContextMenu)
+        self.toolBar3.setFloatable(False)
+        self.toolBar3.addWidget(QLabel("Slice x:"))
+        self.cb_slice_x = QComboBox()
+        self.toolBar3.addWidget(self.cb_slice_x)
+        self.toolBar3.addWidget(QLabel(" y:"))
+        self.cb_slice_y = QComboBox()
+        self.toolBar3.addWidget(self.cb_slice_y)
+        self.cb_slice_x.currentIndexChanged.connect(self.onSliceAxesChanged)
+        self.cb_slice_y.currentIndexChanged.connect(self.onSliceAxesChanged)
+        # one spinbox per axis, for the index of the axes not displayed
+        self.slice_widget = QWidget()
+        self.slice_layout = QHBoxLayout()
+        self.slice_layout.setContentsMargins(0, 0, 0, 0)
+        self.slice_widget.setLayout(self.slice_layout)
+        self.toolBar3.addWidget(self.slice_widget)
+        self.sb_slice = []
+        self.toolBar3.setVisible(False)
 
         # -- statusbar --
         self.lbl_mouse_coord = QLabel()
@@ -212,11 +379,12 @@ class DisplayWidget(QMainWindow):
         self.main.autoRange(padding=0)
 
     def resetHist(self):
-        data = self.disp_data.data
-        if np.all(np.isnan(data)): return
-        mini, maxi = np.nanmin(data), np.nanmax(data)
-        self.hist.setLevels(mini, maxi)
-        self.hist.vb.autoRange()
+        # levels computed with the colours (color_map)
+        self._requestColors(auto_levels=True)
+
+    def onHistLevelsChanged(self):
+        if tuple(self.hist.getLevels()) != self.render_levels:
+            self._requestColors()
 
     def onTranspose(self):
         self.disp_data.transpose = not self.disp_data.transpose
@@ -225,7 +393,19 @@ class DisplayWidget(QMainWindow):
         self._updateImage()
         self.recenter()
 
+    def _currentOut(self):
+        # (gui_dev, channel) shown, channel is None for a device of one value
+        gui_dev, channel = self.cb_out.currentData() or (None, None)
+        if gui_dev is not None and channel is not None and gui_dev.channelNames() is None:
+            channel = self.sb_index.value()  # an array: its value chosen with sb_index
+        return gui_dev, channel
+
     def onCbOutChanged(self):
+        gui_dev, channel = self.cb_out.currentData() or (None, None)
+        array = gui_dev is not None and channel is not None and gui_dev.channelNames() is None
+        [act.setVisible(array) for act in self.act_index]
+        if array:
+            self.sb_index.setMaximum(int(np.prod(gui_dev.multiShape())) - 1)
         self._updateImage()
         self.resetHist()
     
@@ -235,6 +415,62 @@ class DisplayWidget(QMainWindow):
         self._updateImage()
         self.resetHist()
     
+    def onSliceAxesChanged(self):
+        axis_x, axis_y = self.cb_slice_x.currentData(), self.cb_slice_y.currentData()
+        if axis_x is None or axis_y is None: return
+        if axis_x == axis_y:
+            # not a 2D slice, put back the previous axes
+            self._setSliceCombobox()
+            return
+        self.disp_data.setAxes(axis_x, axis_y)
+        self._showSliceSpinboxes()
+        self.removeAllTargets()
+        self._updateImage()
+        self.recenter()
+        self.resetHist()
+
+    def onSliceIdxChanged(self, axis, value):
+        self.disp_data.slice_idx[axis] = value
+        self._updateImage()
+        self.resetHist()
+
+    def _setSliceCombobox(self):
+        for cb, axis in zip([self.cb_slice_x, self.cb_slice_y], self.disp_data.axes):
+            cb.blockSignals(True)
+            cb.setCurrentIndex(axis)
+            cb.blockSignals(False)
+
+    def _showSliceSpinboxes(self):
+        for k, sb in enumerate(self.sb_slice):
+            sb.setVisible(k not in self.disp_data.axes)
+
+    def _initSliceToolbar(self):
+        # rebuild the slice toolbar for the current sweep
+        labels, ranges = self.disp_data.all_labels, self.disp_data.all_ranges
+        for cb in [self.cb_slice_x, self.cb_slice_y]:
+            cb.blockSignals(True)
+            cb.clear()
+            for k, label in enumerate(labels):
+                cb.addItem(label, k)
+            cb.blockSignals(False)
+        self._setSliceCombobox()
+
+        for sb in self.sb_slice:
+            self.slice_layout.removeWidget(sb)
+            sb.deleteLater()
+        self.sb_slice = []
+        for k, (label, sweep_range) in enumerate(zip(labels, ranges)):
+            sb = QSpinBox()
+            sb.setRange(-1, sweep_range[2] - 1)
+            sb.setPrefix(label + ": ")
+            sb.setSpecialValueText(label + ": live") # -1: follow the sweep
+            sb.setValue(-1)
+            sb.valueChanged.connect(lambda value, k=k: self.onSliceIdxChanged(k, value))
+            self.slice_layout.addWidget(sb)
+            self.sb_slice.append(sb)
+        self._showSliceSpinboxes()
+        self.toolBar3.setVisible(len(ranges) > 2)
+    
     def addTarget(self):
         x, y = self.vLine.pos().x(), self.hLine.pos().y()
         self.targets.append(Target(self, (x, y)))
@@ -278,17 +514,68 @@ class DisplayWidget(QMainWindow):
         if len(np.unique(vert_trace)) > 2:
             self.vertical.autoRange()
 
-    def _updateImage(self):
-        gui_dev = self.cb_out.currentData()
-        to_display = self.disp_data.filteredData(gui_dev)
-        if not np.all(np.isnan(to_display)):
-            self.image.setImage(to_display, autoLevels=False)
-            self.image.setRect(self.disp_data.image_rect)
+    def _updateTrace(self):
+        gui_dev, channel = self._currentOut()
+        if gui_dev is None: return
+        column = self.trace_columns[gui_dev] + (channel or 0)
+        samples = self.trace.last(self.TRACE_POINTS, [0, column])
+        self.trace_curve.setData(samples[:, 0], samples[:, 1])
+        self.disp_data.label_out = self.cb_out.currentText()
+        self.disp_data.label_x, self.disp_data.label_y = "time (s)", self.disp_data.label_out
+        self._setLabels()
+
+    def _updateImage(self, auto_levels=False):
+        if self.trace is not None:
+            self._updateTrace()
+            return
+        gui_dev, channel = self._currentOut()
+        to_display = self.disp_data.filteredData(gui_dev, self.view.snapshot, channel)
+        self.pyramid.update(to_display, self.disp_data.changed)
+        self._renderImage(auto_levels=auto_levels)
 
         self._setLabels()
         self.onMouseMoved(self.last_mouse_pos)
         [t.onTargetMove() for t in self.targets]
 
+    def _renderImage(self, new_data=True, auto_levels=False):
+        # show the level of the pyramid matching the screen resolution
+        # (new_data False: the view changed, only if it is another level)
+        image = self.pyramid.image
+        if self.trace is not None or image is None: return
+        rect = self.disp_data.image_rect
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pixel_ratio = np.min(np.array(self.main.vb.viewPixelSize()) / (np.array(rect[2:]) / image.shape))
+        level = self.pyramid.levelFor(pixel_ratio)
+        if not new_data and level == self.image_level: return
+        if self.pyramid.range() is None: return  # nothing to show yet
+        to_display = self.pyramid.mean(level)
+        if level == 0:
+            to_display = np.copy(to_display)  # the next frames update the image in place
+        # the last blocks of a level can be partial: its rect goes past the image one
+        scale = np.array(to_display.shape) * 2**level / image.shape
+        self.render_rect = [rect[0], rect[1], rect[2] * scale[0], rect[3] * scale[1]]
+        self.render_image = to_display
+        self.image_level = level
+        self.hist_image.setImage(to_display, autoLevels=False)  # histogram of the colorbar
+        self._requestColors(auto_levels)
+
+    def _requestColors(self, auto_levels=False):
+        # colours of render_image, with the levels of the colorbar or computed (auto_levels)
+        if self.render_image is None: return
+        self.render_levels = None if auto_levels else tuple(self.hist.getLevels())
+        lut = self.hist.gradient.getLookupTable(256, alpha=True)
+        self.color_map.request(self.render_image, lut, self.render_levels, (self.render_id, self.render_rect))
+
+    def gui_onColorsDone(self, rgba, levels, info):
+        render_id, rect = info
+        if render_id != self.render_id: return
+        self.image.setImage(rgba, autoLevels=False)
+        self.image.setRect(rect)
+        if levels != self.render_levels:  # computed
+            self.render_levels = levels
+            self.hist.setLevels(*levels)
+            self.hist.vb.autoRange()
+
     def _setLabels(self):
         new_lbls = [self.disp_data.label_x, self.disp_data.label_y, self.disp_data.label_out]
         axes_x = [self.main.getAxis("bottom"), self.horizontal.getAxis("bottom")]
@@ -304,42 +591,69 @@ class DisplayWidget(QMainWindow):
         # set labels, cb and range
 
         self.disp_data.resetData()
-        self.disable = False
+        self.nb_frames = 0
         self.removeAllTargets()
 
-        if len(sweep_devs) > 2:
-            self.disable = True
-            return
-        
-        gui_dev1 = sweep_devs[0]
-        start1, stop1, nbpts1 = gui_dev1.sweep
-        self.disp_data.sweep_range[0] = gui_dev1.sweep
-        self.disp_data.label_x = gui_dev1.getDisplayName("short", with_instr=True)
-        
-        if len(sweep_devs) == 2:
-            gui_dev2 = sweep_devs[1]
-            start2, stop2, nbpts2 = gui_dev2.sweep
-            self.disp_data.label_y = gui_dev2.getDisplayName("short", with_instr=True)
-            self.disp_data.sweep_range[1] = gui_dev2.sweep
-        
-        self.disp_data.makeImageRect()
+        # one axis per swept device, the displayed ones are chosen in toolBar3
+        ranges = [gui_dev.sweep for gui_dev in sweep_devs]
+        labels = [gui_dev.getDisplayName("short", with_instr=True) for gui_dev in sweep_devs]
+        if len(sweep_devs) == 1:
+            ranges.append([0, 1, 1])
+            labels.append("y")
+        self.disp_data.initAxes(ranges, labels)
+        self._initSliceToolbar()
         self.hPlot.clear()
         self.vPlot.clear()
         self.image.clear()
-        self.cb_out.clear()
+        self.pyramid.reset(None)
+        self.render_image = None
+        self.render_id += 1
+        self.trace = None
+        self.trace_curve.clear()
+        self._fillCbOut(out_devs)
+
+    def initTrace(self, out_devs, buffer):
+        # time trace: buffer holds the time then the values of out_devs (multi devices: one column per value)
+        self.disp_data.resetData()
+        self.nb_frames = 0
+        self.removeAllTargets()
+        self.toolBar3.setVisible(False)
+        self.hPlot.clear()
+        self.vPlot.clear()
+        self.image.clear()
+        self.pyramid.reset(None)
+        self.render_image = None
+        self.render_id += 1
+        self.trace = buffer
+        self.trace_columns = {}
+        column = 1
+        for gui_dev in out_devs:
+            self.trace_columns[gui_dev] = column
+            column += int(np.prod(gui_dev.multiShape()))
+        self._fillCbOut(out_devs)
 
+    def _fillCbOut(self, out_devs):
+        # the out devices to choose from, then shows the first one
+        self.cb_out.blockSignals(True)
+        self.cb_out.clear()
         for gui_dev in out_devs:
-            self.cb_out.addItem(gui_dev.getDisplayName("short", with_instr=True), gui_dev)
+            # one entry per named value of a multi device, one for a device returning an array
+            name = gui_dev.getDisplayName("short", with_instr=True)
+            if (names := gui_dev.channelNames()) is not None:
+                for k, channel in enumerate(names):
+                    self.cb_out.addItem(f"{name} {channel}", (gui_dev, k))
+            else:
+                self.cb_out.addItem(name, (gui_dev, 0 if gui_dev.multiShape() else None))
         self.cb_out.setCurrentIndex(0)
-    
-        self._updateImage()
+        self.cb_out.blockSignals(False)
+        self.onCbOutChanged()
     
     def progressSweep(self, sweep_status):
-        self._updateImage()
-        current_pts = sweep_status.iteration[0]
-        if current_pts == 1: self.recenter()
-        if current_pts % 10 == 1:
-            self.resetHist()
+        # one call per frame, a frame can hold several new points
+        # (the colorbar levels are computed again every 10 frames)
+        self._updateImage(auto_levels=self.nb_frames % 10 == 0)
+        if self.nb_frames == 0: self.recenter()
+        self.nb_frames += 1
 
 
 class Target(pg.TargetItem):
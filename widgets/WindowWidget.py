@@ -47,6 +47,8 @@ class Window(QMainWindow):
         self.short("w, s", lab.showMain)
         self.short("w, w", lab.showMain)
         self.short("w, c", lab.showConsole)
+        self.short("w, u", lab.showQueue)
+        self.short("w, p", lab.showProfile)
 
         self.short("t, s", lab.view_main.focusTreeSw)
         self.short("t, o", lab.view_main.focusTreeOut)
@@ -11,6 +11,7 @@ import matplotlib.cm as mplcm
 import numpy as np
 
 from widgets.WindowWidget import Window
+from src.SweepThread import LiveSnapshot
 
 class DisplayWindow(Window):
     def __init__(self, lab):
@@ -23,6 +24,7 @@ class DisplayWindow(Window):
         self._setupGradientList()
 
         self.dual = False
+        self.snapshot = LiveSnapshot()  # values shown, updated once per frame for both displays
         self.displays = [DisplayWidget.DisplayWidget(self),
                          DisplayWidget.DisplayWidget(self),]
 
@@ -86,10 +88,16 @@ class DisplayWindow(Window):
     def gui_onSweepStarted(self, sweep_status):
         out_devs = sweep_status.out_devs
         sweep_devs = sweep_status.sw_devs
+        self.snapshot.reset(sweep_status)
+        if sweep_status.trace is not None:
+            self.displays[0].initTrace(out_devs, sweep_status.trace)
+            self.displays[1].initTrace(out_devs, sweep_status.trace)
+            return
         self.displays[0].initSweep(out_devs, sweep_devs)
         self.displays[1].initSweep(out_devs, sweep_devs)
 
     def gui_onSweepProgress(self, sweep_status):
+        self.snapshot.update(sweep_status)
         self.displays[0].progressSweep(sweep_status)
         self.displays[1].progressSweep(sweep_status)
     
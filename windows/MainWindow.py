@@ -1,4 +1,3 @@
-import time
 from PyQt5.QtWidgets import (
     QLineEdit,
     QTreeWidgetItem,
@@ -7,12 +6,22 @@ from PyQt5.QtWidgets import (
     QMenu,
     QAction,
     QFileDialog,
+    QSpinBox,
+    QCheckBox,
+    QComboBox,
+    QWidget,
+    QHBoxLayout,
+    QGroupBox,
+    QFormLayout,
 )
 from PyQt5 import QtGui, uic
 from PyQt5.QtCore import Qt
 from widgets.WindowWidget import Window
 from PyQt5.QtCore import pyqtSignal
+from pyHegel.gui.ScientificSpinBox import PyScientificSpinBox
 from src.GuiInstrument import GuiDevice, GuiInstrument
+from src.SweepEta import EtaModel
+from src.SweepPlanner import SweepPlan
 
 
 class MainWindow(Window):
@@ -32,6 +41,22 @@ class MainWindow(Window):
         self.abort_button = QPushButton("Abort", enabled=False)
         self.toolBar.addWidget(self.pause_button)
         self.toolBar.addWidget(self.abort_button)
+        # resume an aborted/crashed sweep from its journal (native engine)
+        self.actionResumeSweep = QAction(QtGui.QIcon("resources/play.svg"), "Resume sweep")
+        self.actionResumeSweep.setToolTip("Resume a sweep from its journal file (native engine)")
+        self.toolBar.addAction(self.actionResumeSweep)
+        # sweep queue: add the current sweep, show the queue window
+        menu_queue = QMenu()
+        self.actionQueue = QAction(QtGui.QIcon("resources/list-add.svg"), "Queue")
+        self.actionQueue.setToolTip("Add this sweep to the sweep queue")
+        self.actionShowQueue = QAction(QtGui.QIcon("resources/list-add.svg"), "Show queue")
+        menu_queue.addAction(self.actionShowQueue)
+        self.actionQueue.setMenu(menu_queue)
+        self.toolBar.addAction(self.actionQueue)
+        # time trace: the out devices against time, no swept device
+        self.actionTimeTrace = QAction(QtGui.QIcon("resources/monitor.svg"), "Time trace")
+        self.actionTimeTrace.setToolTip("Record the out devices against time (the swept devices are ignored)")
+        self.toolBar.addAction(self.actionTimeTrace)
         # add a line edit in the toolbar for filename (not possible from designer):
         self.toolBar.addSeparator()
         self.filename_edit = QLineEdit()
@@ -58,6 +83,11 @@ class MainWindow(Window):
         menu_display.addAction(self.two_display_action)
         self.btn_display.setMenu(menu_display)
         self.toolBar.insertAction(self.toolBar.actions()[1], self.btn_display) # insert before the separator
+        # sweep profile (time spent in every phase of the points)
+        self.actionProfile = QAction(QtGui.QIcon("resources/graphs.svg"), "Profile")
+        self.actionProfile.triggered.connect(lab.showProfile)
+        actions = self.toolBar.actions()
+        self.toolBar.insertAction(actions[actions.index(self.actionStartSweep) - 1], self.actionProfile) # before the separator
         # StatusBar: add label for sweep status
         self.statusBar().addWidget(QLabel("Sweep status: "))
         self.sweep_status = QLabel("Ready")
@@ -66,10 +96,73 @@ class MainWindow(Window):
         self.statusBar().addWidget(self.sweep_iteration)
         self.sweep_estimation = QLabel()
         self.statusBar().addWidget(self.sweep_estimation)
+        self.sweep_writer = QLabel()  # file writer queue (native engine)
+        self.statusBar().addWidget(self.sweep_writer)
         # width for first column for tree:
         self.tree_sw.setColumnWidth(0, 340)
         # before_wait:
         self.sb_before_wait.setMinimum(0)
+        self.sb_before_wait.valueChanged.connect(lambda: self._setEstimate())
+        self.cb_alternate.toggled.connect(lambda: self._setEstimate())
+        # max refresh rate of the live display:
+        self.sb_max_fps = QSpinBox()
+        self.sb_max_fps.setRange(1, 100)
+        self.sb_max_fps.setValue(30)
+        self.formLayout.addRow(QLabel("Display refresh (Hz):"), self.sb_max_fps)
+        # sweep engine: pyHegel sweep_multi or the HegelLab pipelined one
+        self.cb_native = QCheckBox()
+        self.cb_native.setToolTip("Use the HegelLab sweep engine instead of pyHegel sweep_multi")
+        self.formLayout.addRow(QLabel("Native engine:"), self.cb_native)
+        # read the out devices of different instruments at the same time (native engine only)
+        self.cb_parallel_read = QCheckBox()
+        self.cb_parallel_read.setToolTip("Read the out devices of different instruments in parallel (native engine)")
+        self.cb_parallel_read.toggled.connect(lambda boo: boo and self.cb_native.setChecked(True))
+        self.cb_native.toggled.connect(lambda boo: boo or self.cb_parallel_read.setChecked(False))
+        self.formLayout.addRow(QLabel("Parallel read:"), self.cb_parallel_read)
+        # fastest swept device taken a whole line at a time by the instruments (native engine only)
+        self.cb_buffered = QCheckBox()
+        self.cb_buffered.setToolTip("Arm, trigger and fetch a whole line of the fastest swept device\n"
+                                    "(native engine, instruments with a buffered driver)")
+        self.cb_buffered.toggled.connect(lambda boo: boo and self.cb_native.setChecked(True))
+        self.cb_native.toggled.connect(lambda boo: boo or self.cb_buffered.setChecked(False))
+        self.formLayout.addRow(QLabel("Buffered fast axis:"), self.cb_buffered)
+        # file format, the binary one is written by the native engine
+        self.cb_file_format = QComboBox()
+        self.cb_file_format.addItem("Text (.txt)", "txt")
+        self.cb_file_format.addItem("Binary (.npy)", "npy")
+        self.cb_file_format.currentIndexChanged.connect(
+            lambda: self.cb_file_format.currentData() == "npy" and self.cb_native.setChecked(True))
+        self.cb_native.toggled.connect(lambda boo: boo or self.cb_file_format.setCurrentIndex(0))
+        self.formLayout.addRow(QLabel("File format:"), self.cb_file_format)
+        # time trace: sampling rate (0: as fast as possible) and duration (0: until abort)
+        self.sb_trace_rate = PyScientificSpinBox()
+        self.sb_trace_rate.setRange(0., 1e6)
+        self.sb_trace_rate.setSpecialValueText("as fast as possible")
+        self.sb_trace_duration = PyScientificSpinBox()
+        self.sb_trace_duration.setRange(0., 1e7)
+        self.sb_trace_duration.setSpecialValueText("until abort")
+        trace_layout = QHBoxLayout()
+        trace_layout.setContentsMargins(0, 0, 0, 0)
+        trace_layout.addWidget(QLabel("rate (Hz)"))
+        trace_layout.addWidget(self.sb_trace_rate, stretch=1)
+        trace_layout.addWidget(QLabel("duration (s)"))
+        trace_layout.addWidget(self.sb_trace_duration, stretch=1)
+        trace_widget = QWidget()
+        trace_widget.setLayout(trace_layout)
+        self.formLayout.addRow(QLabel("Time trace:"), trace_widget)
+        # order of the swept devices and alternate minimising the ramp times (src.SweepPlanner)
+        self.lbl_ramp_plan = QLabel()
+        self.btn_ramp_plan = QPushButton("Apply", enabled=False)
+        self.btn_ramp_plan.setToolTip("Reorder the swept devices and set alternate as suggested")
+        self.btn_ramp_plan.clicked.connect(self.onApplyRampPlan)
+        ramp_plan_layout = QHBoxLayout()
+        ramp_plan_layout.setContentsMargins(0, 0, 0, 0)
+        ramp_plan_layout.addWidget(self.lbl_ramp_plan, stretch=1)
+        ramp_plan_layout.addWidget(self.btn_ramp_plan)
+        ramp_plan_widget = QWidget()
+        ramp_plan_widget.setLayout(ramp_plan_layout)
+        self.formLayout.addRow(QLabel("Ramp plan:"), ramp_plan_widget)
+        self.ramp_plan = None
         # -- end ui setup --
 
         self.lab = lab
@@ -103,6 +196,10 @@ class MainWindow(Window):
 
         # sweep:
         self.actionStartSweep.triggered.connect(self.onTriggerStartSweep)
+        self.actionResumeSweep.triggered.connect(lambda: self.lab.resumeSweepFromJournal())
+        self.actionQueue.triggered.connect(self.onTriggerQueueSweep)
+        self.actionTimeTrace.triggered.connect(self.onTriggerTimeTrace)
+        self.actionShowQueue.triggered.connect(self.lab.showQueue)
         self.pause_button.clicked.connect(self.lab.pauseSweep)
         self.abort_button.clicked.connect(self.lab.abortSweep)
 
@@ -181,6 +278,7 @@ class MainWindow(Window):
             name = gui_dev.getDisplayName("long", with_instr=True)
             name = {0:'x: ', 1:'y: '}.get(i,'') + name
             item.setText(0, name)
+        self._setEstimate()
     def gui_updateOutDevice(self, gui_dev, boo):
         if not boo: self.gui_onDeviceRemoved(gui_dev, self.tree_out)
         else: self._makeOrUpdateItem(self.tree_out, gui_dev)
@@ -214,31 +312,112 @@ class MainWindow(Window):
         log_devs = [self.tree_log.getData(item) for item in self.tree_log]
         self.lab.startSweep(sw_devs, out_devs, log_devs)
 
+    def onTriggerQueueSweep(self):
+        sw_devs = [self.tree_sw.getData(item) for item in self.tree_sw]
+        out_devs = [self.tree_out.getData(item) for item in self.tree_out]
+        log_devs = [self.tree_log.getData(item) for item in self.tree_log]
+        self.lab.queueSweep(sw_devs, out_devs, log_devs)
+
+    def onTriggerTimeTrace(self):
+        if not self.actionTimeTrace.isEnabled(): return
+        out_devs = [self.tree_out.getData(item) for item in self.tree_out]
+        log_devs = [self.tree_log.getData(item) for item in self.tree_log]
+        self.lab.startTimeTrace(out_devs, log_devs)
+
     def gui_onSweepStarted(self, boo=True, text='Running'):
         self.pause_button.setEnabled(boo)
         self.abort_button.setEnabled(boo)
         self.actionStartSweep.setEnabled(not boo)
+        self.actionResumeSweep.setEnabled(not boo)
+        self.actionTimeTrace.setEnabled(not boo)
+        if boo: self.btn_ramp_plan.setEnabled(False)
         self.sweep_status.setText(text)
+        self.sweep_status.setToolTip("")
 
-    def _setEta(self, start_time, current_pts, total_pts):
+    def _formatDuration(self, duration):
         # display it as h:m:s:
-        if None in [start_time, current_pts, total_pts]:
+        h = duration // 3600
+        m = (duration % 3600) // 60
+        s = duration % 60
+        return f"{h:.0f}:{m:02.0f}:{s:02.0f}"
+
+    def _setEta(self, sweep_status):
+        # from the measured cost of the points (src.SweepEta), pauses not included
+        if sweep_status is None or sweep_status.eta is None or sweep_status.iteration[0] is None:
             self.sweep_estimation.setText("")
+            self.sweep_estimation.setToolTip("")
             return
+        current_pts = sweep_status.iteration[0]
+        sweep_status.eta.update(sweep_status.timings, current_pts)
+        self.sweep_estimation.setText("ETA: " + self._formatDuration(sweep_status.eta.remaining(current_pts)))
 
-        elapsed = time.time() - start_time
-        remaining = elapsed * (total_pts - current_pts) / current_pts
-
-        h = remaining // 3600
-        m = (remaining % 3600) // 60
-        s = remaining % 60
-        self.sweep_estimation.setText(f"ETA: {h:.0f}:{m:02.0f}:{s:02.0f}")
+    def _setEstimate(self):
+        # duration of the sweep in the trees, before it is started:
+        # from beforewait and the ramp rates, the read times are not known yet.
+        sw_devs = [self.tree_sw.getData(item) for item in self.tree_sw]
+        if not self.actionStartSweep.isEnabled(): return
+        self._setRampPlan(sw_devs)
+        if sw_devs == [] or any(None in gui_dev.sweep for gui_dev in sw_devs):
+            self._setEta(None)
+            return
+        eta = EtaModel.fromGuiDevices(sw_devs, self.cb_alternate.isChecked(), self.sb_before_wait.value())
+        self.sweep_estimation.setText("Estimated: > " + self._formatDuration(eta.total()))
+        self.sweep_estimation.setToolTip("beforewait and ramps only, without the read times")
+
+    def _setRampPlan(self, sw_devs):
+        # best order/mode for the ramps, and the time it would save
+        self.ramp_plan = None
+        self.btn_ramp_plan.setEnabled(False)
+        self.lbl_ramp_plan.setToolTip("")
+        if sw_devs == [] or any(None in gui_dev.sweep for gui_dev in sw_devs):
+            self.lbl_ramp_plan.setText("")
+            return
+        plan = SweepPlan.fromGuiDevices(sw_devs, self.cb_alternate.isChecked())
+        if plan.current_time == 0.:
+            self.lbl_ramp_plan.setText("no ramp")
+            return
+        if plan.isCurrent():
+            self.lbl_ramp_plan.setText(f"best already (ramps {self._formatDuration(plan.time)})")
+            return
+        names = [sw_devs[i].getDisplayName("short") for i in plan.order]
+        mode = "alternate" if plan.alternate else "raster"
+        self.lbl_ramp_plan.setText(f"{', '.join(names)} ({mode}): saves {self._formatDuration(plan.saving())}")
+        self.lbl_ramp_plan.setToolTip(f"ramps {self._formatDuration(plan.current_time)}"
+                                      f" -> {self._formatDuration(plan.time)}, the slowest device first")
+        self.ramp_plan = (plan, sw_devs)
+        self.btn_ramp_plan.setEnabled(True)
+
+    def onApplyRampPlan(self):
+        if self.ramp_plan is None: return
+        plan, sw_devs = self.ramp_plan
+        self.cb_alternate.setChecked(plan.alternate)
+        for i in plan.order:  # _reorder puts the device at the end
+            self._reorder(self.tree_sw, sw_devs[i], None)
 
     def gui_onSweepProgress(self, sweep_status):
         # update the sweep status bar
         current_pts, total_pts = sweep_status.iteration[0], sweep_status.iteration[1]
-        self._setEta(sweep_status.start_time, current_pts, total_pts)
-        self.sweep_iteration.setText(f"{current_pts}/{total_pts}")
+        self._setEta(sweep_status)
+        if total_pts is None:  # time trace until abort
+            self.sweep_iteration.setText(f"{current_pts} samples")
+        else:
+            self.sweep_iteration.setText(f"{current_pts}/{total_pts}")
+        self._setWriterStatus(sweep_status.datas)
+
+    def gui_updateFeedbackStats(self, feedback_loop):
+        # latency and jitter of the feedback loop, in the retroaction window
+        if feedback_loop is None or (stats := feedback_loop.stats()) is None: return
+        rate = f"{stats['rate']:.3g} Hz" if stats['rate'] is not None else "-"
+        self.win_retroaction.lbl_loop_stats.setText(
+            f"{stats['ticks']} ticks at {rate}, {stats['overruns']} overruns\n"
+            f"latency: {stats['latency_mean']*1e3:.3g} ms (max {stats['latency_max']*1e3:.3g} ms)\n"
+            f"jitter: {stats['jitter_std']*1e3:.3g} ms rms (max {stats['jitter_max']*1e3:.3g} ms)")
+
+    def _setWriterStatus(self, datas):
+        if datas is None or "write_queue" not in datas:
+            self.sweep_writer.setText("")
+            return
+        self.sweep_writer.setText(f"Write queue: {datas['write_queue']} ({datas['write_latency']*1e3:.1f} ms)")
 
     def _changePauseButton(self, new_text, new_onClick):
         self.pause_button.setText(new_text)
@@ -253,11 +432,25 @@ class MainWindow(Window):
         self._changePauseButton("Pause", self.lab.pauseSweep)
         self.sweep_status.setText("Running")
 
+    def gui_onSweepAborting(self):
+        # the devices are going back to their safe values, the sweep is not finished yet
+        self.pause_button.setEnabled(False)
+        self.abort_button.setEnabled(False)
+        self.sweep_status.setText("Aborting...")
+
+    def gui_onSweepAborted(self, stopped, safe):
+        # after gui_onSweepFinished: time from the abort to the end of the loop and to the safe values
+        self.sweep_status.setText(f"Aborted, safe in {safe:.2f} s")
+        self.sweep_status.setToolTip(f"Abort -> sweep stopped: {stopped:.3f} s\n"
+                                     f"Abort -> swept devices back to their safe values: {safe:.3f} s")
+
     def gui_onSweepFinished(self):
         self.gui_onSweepStarted(False, 'Ready')
         # Reset pause button (in case of Pause->Abort):
         self._changePauseButton("Pause", self.lab.pauseSweep)
-        self._setEta(None, None, None)
+        self._setEta(None)
+        self._setEstimate()
+        self._setWriterStatus(None)
     
 
     # -- Select sweep path --
@@ -279,23 +472,53 @@ class MainWindow(Window):
         uic.loadUi("ui/RetroactionWindow.ui", win)
         win.setWindowTitle("Retroaction loop")
         win.setWindowIcon(QtGui.QIcon("resources/favicon/favicon.png"))
+        # feedback loop (src.FeedbackLoop): own rate, optional PID on a measured device
+        gb_loop = QGroupBox("Feedback loop")
+        loop_layout = QFormLayout()
+        win.spin_rate = PyScientificSpinBox()
+        win.spin_rate.setRange(0.01, 1000.)
+        win.spin_rate.setValue(10.)
+        loop_layout.addRow(QLabel("Rate (Hz):"), win.spin_rate)
+        win.gb_pid = QGroupBox("PID on a measured device", checkable=True, checked=False)
+        pid_layout = QFormLayout()
+        win.combo_pv = QComboBox()
+        pid_layout.addRow(QLabel("Measure:"), win.combo_pv)
+        win.spin_target = PyScientificSpinBox()
+        pid_layout.addRow(QLabel("Target:"), win.spin_target)
+        for name in ["kp", "ki", "kd"]:
+            spin = PyScientificSpinBox()
+            spin.setRange(-1e9, 1e9)
+            setattr(win, f"spin_{name}", spin)
+            pid_layout.addRow(QLabel(name.capitalize() + ":"), spin)
+        win.gb_pid.setLayout(pid_layout)
+        loop_layout.addRow(win.gb_pid)
+        win.lbl_loop_stats = QLabel()
+        loop_layout.addRow(win.lbl_loop_stats)
+        gb_loop.setLayout(loop_layout)
+        win.gridLayout.addWidget(gb_loop, 1, 0)
         
         def onOpen():
             selected_st = win.combo_st.currentData()
             selected_p1 = win.combo_p1.currentData()
             selected_p2 = win.combo_p2.currentData()
-            index_st, index_p1, index_p2 = -1, -1, -1 # values used to save selected dev position
+            selected_pv = win.combo_pv.currentData()
+            index_st, index_p1, index_p2, index_pv = -1, -1, -1, -1 # values used to save selected dev position
             devs = self.lab.getAllGuiDevices()
             win.combo_st.clear()
             win.combo_p1.clear()
             win.combo_p2.clear()
+            win.combo_pv.clear()
             for i, dev in enumerate(devs):
                 win.combo_st.addItem(dev.getDisplayName("long", with_instr=True), dev)
                 win.combo_p1.addItem(dev.getDisplayName("long", with_instr=True), dev)
                 win.combo_p2.addItem(dev.getDisplayName("long", with_instr=True), dev)
+                win.combo_pv.addItem(dev.getDisplayName("long", with_instr=True), dev)
                 if dev is selected_st: index_st = i
                 if dev is selected_p1: index_p1 = i
                 if dev is selected_p2: index_p2 = i
+                if dev is selected_pv: index_pv = i
+            if selected_pv is not None:
+                win.combo_pv.setCurrentIndex(index_pv)
             if selected_st is not None:
                 win.combo_st.setCurrentIndex(index_st)
             elif (i := self._tryAutoFindDev(" ST ", devs)) != -1:
@@ -0,0 +1,93 @@
+from PyQt5.QtWidgets import (
+    QWidget,
+    QVBoxLayout,
+    QLabel,
+    QTreeWidget,
+    QTreeWidgetItem,
+)
+from PyQt5 import QtGui
+import pyqtgraph as pg
+import time
+
+from src.SweepTimings import SweepTimings
+from widgets.WindowWidget import Window
+
+
+class ProfileWindow(Window):
+    # Where the time of the sweep goes (sweep_status.timings, a SweepTimings):
+    # histogram of the duration of every phase of the points,
+    # and the devices where most of the time is spent.
+    # All from the aggregates kept up to date by the sweep thread, nothing is computed per point here.
+    # Refreshed at most once per second while the sweep runs.
+
+    def __init__(self, lab):
+        super().__init__()
+        self.lab = lab
+        self.timings = None
+        self.last_update = 0.
+        # -- ui setup --
+        self.setWindowTitle("Sweep profile")
+        self.setWindowIcon(QtGui.QIcon("resources/favicon/favicon.png"))
+        self.resize(800, 600)
+        self.lbl_summary = QLabel()
+        self.plot = pg.PlotWidget()
+        self.plot.setLogMode(x=True)
+        self.plot.showGrid(x=True, y=True)
+        self.plot.setLabel("bottom", "duration", units="s")
+        self.plot.setLabel("left", "points")
+        self.plot.addLegend()
+        self.curves = {}
+        for i, phase in enumerate(SweepTimings.PHASES):
+            self.curves[phase] = self.plot.plot(stepMode="center", pen=pg.intColor(i), name=phase)
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["Device", "Mean (ms)", "Max (ms)", "Calls"])
+        self.tree.setRootIsDecorated(False)
+        self.tree.setColumnWidth(0, 300)
+        layout = QVBoxLayout()
+        layout.addWidget(self.lbl_summary)
+        layout.addWidget(self.plot, stretch=2)
+        layout.addWidget(self.tree, stretch=1)
+        central = QWidget()
+        central.setLayout(layout)
+        self.setCentralWidget(central)
+        # -- end ui setup --
+
+    def updateProfile(self):
+        self.last_update = time.perf_counter()
+        timings = self.timings
+        if timings is None: return
+        # histograms
+        for phase, curve in self.curves.items():
+            counts, edges = timings.histogram(phase)
+            if len(counts) == 0: curve.clear()
+            else: curve.setData(edges, counts)
+        # share of every phase in the time of the points
+        total = timings.total("point")
+        summary = []
+        for phase in SweepTimings.PHASES[:-1]:
+            if timings.count(phase) == 0: continue
+            mean = timings.mean(phase) * 1e3
+            share = f" ({timings.total(phase) / total * 100:.0f}%)" if total > 0 else ""
+            summary.append(f"{phase}: {mean:.3g} ms{share}")
+        self.lbl_summary.setText("Mean per point - " + " | ".join(summary))
+        # slowest devices
+        self.tree.clear()
+        for name, mean, max_, count in timings.slowestDevices():
+            self.tree.addTopLevelItem(QTreeWidgetItem([name, f"{mean*1e3:.3g}", f"{max_*1e3:.3g}", str(count)]))
+
+    def focus(self):
+        super().focus()
+        self.updateProfile()
+
+    # -- called by the lab --
+
+    def gui_onSweepStarted(self, sweep_status):
+        self.timings = sweep_status.timings
+        if self.isVisible(): self.updateProfile()
+
+    def gui_onSweepProgress(self, sweep_status):
+        if self.isVisible() and time.perf_counter() - self.last_update > 1.:
+            self.updateProfile()
+
+    def gui_onSweepFinished(self):
+        if self.isVisible(): self.updateProfile()
@@ -0,0 +1,133 @@
+from PyQt5.QtWidgets import (
+    QWidget,
+    QVBoxLayout,
+    QHBoxLayout,
+    QPushButton,
+    QTreeWidget,
+    QTreeWidgetItem,
+    QInputDialog,
+)
+from PyQt5 import QtGui
+
+from widgets.WindowWidget import Window
+
+
+class QueueWindow(Window):
+    # The sweep queue (lab.sweep_queue): sweeps added from the main window,
+    # run back to back by the sweep thread with "Run queue".
+    # Every sweep can set its own values before starting (pre-sweep values).
+
+    def __init__(self, lab):
+        super().__init__()
+        self.lab = lab
+        # -- ui setup --
+        self.setWindowTitle("Sweep queue")
+        self.setWindowIcon(QtGui.QIcon("resources/favicon/favicon.png"))
+        self.resize(900, 350)
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["Name", "Sweep", "Out", "Pre-sweep values", "State"])
+        self.tree.setRootIsDecorated(False)
+        self.tree.setColumnWidth(0, 120)
+        self.tree.setColumnWidth(1, 300)
+        self.pb_presets = QPushButton("Pre-sweep values")
+        self.pb_up = QPushButton("Up")
+        self.pb_down = QPushButton("Down")
+        self.pb_pending = QPushButton("Set pending")
+        self.pb_remove = QPushButton("Remove")
+        self.pb_run = QPushButton("Run queue")
+        buttons = QHBoxLayout()
+        for button in [self.pb_presets, self.pb_up, self.pb_down, self.pb_pending, self.pb_remove]:
+            buttons.addWidget(button)
+        buttons.addStretch()
+        buttons.addWidget(self.pb_run)
+        layout = QVBoxLayout()
+        layout.addWidget(self.tree)
+        layout.addLayout(buttons)
+        central = QWidget()
+        central.setLayout(layout)
+        self.setCentralWidget(central)
+        # -- end ui setup --
+
+        self.pb_presets.clicked.connect(self.onEditPreSet)
+        self.pb_up.clicked.connect(lambda: self.onMove(-1))
+        self.pb_down.clicked.connect(lambda: self.onMove(1))
+        self.pb_pending.clicked.connect(self.onSetPending)
+        self.pb_remove.clicked.connect(self.onRemove)
+        self.pb_run.clicked.connect(self.lab.startQueue)
+
+        self.gui_updateQueue()
+
+    def _selectedRow(self):
+        item = self.tree.currentItem()
+        return self.tree.indexOfTopLevelItem(item) if item is not None else -1
+
+    def gui_updateQueue(self):
+        row = self._selectedRow()
+        self.tree.clear()
+        for config in self.lab.sweep_queue.configs:
+            sweep = "; ".join(f"{instr}.{dev} {sw}" for instr, dev, sw, _ in config["sw_devs"])
+            out = ", ".join(f"{instr}.{dev}" for instr, dev in config["out_devs"])
+            pre_set = ", ".join(f"{instr}.{dev}={val}" for instr, dev, val in config["pre_set"])
+            item = QTreeWidgetItem([config["name"], sweep, out, pre_set, config["state"]])
+            self.tree.addTopLevelItem(item)
+        if 0 <= row < self.tree.topLevelItemCount():
+            self.tree.setCurrentItem(self.tree.topLevelItem(row))
+
+    # -- edit the queue --
+    # (not while the queue is running: the sweep thread holds the configs)
+
+    def _changed(self, row=None):
+        self.lab.onQueueChanged()
+        if row is not None:
+            self.tree.setCurrentItem(self.tree.topLevelItem(row))
+
+    def onMove(self, delta):
+        if (row := self._selectedRow()) == -1: return
+        self._changed(self.lab.sweep_queue.move(row, delta))
+
+    def onSetPending(self):
+        if (row := self._selectedRow()) == -1: return
+        self.lab.sweep_queue.setPending(row)
+        self._changed(row)
+
+    def onRemove(self):
+        if (row := self._selectedRow()) == -1: return
+        self.lab.sweep_queue.remove(row)
+        self._changed()
+
+    def onEditPreSet(self):
+        # one "instrument/device = value" per line
+        if (row := self._selectedRow()) == -1: return
+        config = self.lab.sweep_queue.configs[row]
+        text = "\n".join(f"{instr}/{dev} = {val}" for instr, dev, val in config["pre_set"])
+        text, ok = QInputDialog.getMultiLineText(self, "Pre-sweep values",
+            "Set before the sweep, in this order.\nOne 'instrument/device = value' per line:", text)
+        if not ok: return
+        try:
+            config["pre_set"] = self._parsePreSet(text)
+        except Exception as e:
+            self.lab.pop.queuePreSetError(e)
+            return
+        self._changed(row)
+
+    @staticmethod
+    def _parsePreSet(text):
+        pre_set = []
+        for line in text.splitlines():
+            if line.strip() == "": continue
+            dev_id, val = line.rsplit("=", 1)
+            instr, dev = dev_id.split("/", 1)
+            val = val.strip()
+            try: val = float(val)
+            except ValueError: pass  # choice devices take strings
+            pre_set.append([instr.strip(), dev.strip(), val])
+        return pre_set
+
+    # -- queue running --
+
+    def gui_onSweepStarted(self, boo=True):
+        for button in [self.pb_run, self.pb_up, self.pb_down, self.pb_pending, self.pb_remove, self.pb_presets]:
+            button.setEnabled(not boo)
+
+    def gui_onSweepFinished(self):
+        self.gui_onSweepStarted(False)